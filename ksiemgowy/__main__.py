@@ -5,7 +5,7 @@ logic used to generate database entries."""
 
 
 import atexit
-import os
+import functools
 import typing as T
 
 
@@ -20,6 +20,9 @@ import ksiemgowy.config
 import ksiemgowy.models
 import ksiemgowy.homepage_updater
 import ksiemgowy.bookkeeping
+import ksiemgowy.imap_connection
+import ksiemgowy.imap_idle
+import ksiemgowy.outbox
 import ksiemgowy.overdues
 
 LOGGER = logging.getLogger("ksiemgowy.__main__")
@@ -29,6 +32,7 @@ LOGGER = logging.getLogger("ksiemgowy.__main__")
 def atexit_handler(*_: T.Any, **__: T.Any) -> None:
     """Handles program termination in a predictable way."""
     LOGGER.info("Shutting down")
+    ksiemgowy.imap_connection.close_all()
 
 
 def every_seconds_do(
@@ -68,27 +72,54 @@ def main(
 
     LOGGER.info("ksiemgowyd started")
 
-    for account in config.accounts:
-        args = account.__dict__
-        args["mbank_anonymization_key"] = config.mbank_anonymization_key
-        args["database"] = database
-        ksiemgowy.bookkeeping.check_for_updates(
-            config.mbank_anonymization_key,
+    polled_accounts = []
+    for mail_config, mailbox_accounts in (
+        ksiemgowy.bookkeeping.group_accounts_by_mailbox(
+            config.accounts
+        ).items()
+    ):
+        if any(account.use_imap_idle for account in mailbox_accounts):
+            listener = ksiemgowy.imap_idle.IdleListener(
+                mail_config,
+                functools.partial(
+                    ksiemgowy.bookkeeping.handle_new_emails,
+                    anonymizer=config.anonymizer,
+                    database=database,
+                    mail_config=mail_config,
+                    acc_numbers=[
+                        account.acc_number for account in mailbox_accounts
+                    ],
+                    should_send_mail=config.should_send_mail,
+                ),
+            )
+            if listener.start():
+                register_fn(
+                    ksiemgowy.imap_idle.IDLE_POLL_SECONDS,
+                    listener.poll,
+                    [],
+                    {},
+                )
+                continue
+        polled_accounts.extend(mailbox_accounts)
+
+    if polled_accounts:
+        ksiemgowy.bookkeeping.check_accounts(
+            config.anonymizer,
             database,
-            account.mail_config,
-            account.acc_number,
+            polled_accounts,
             config.should_send_mail,
+            config.max_workers,
         )
 
         register_fn(
             3600,
-            ksiemgowy.bookkeeping.check_for_updates,
+            ksiemgowy.bookkeeping.check_accounts,
             [
-                config.mbank_anonymization_key,
+                config.anonymizer,
                 database,
-                account.mail_config,
-                account.acc_number,
+                polled_accounts,
                 config.should_send_mail,
+                config.max_workers,
             ],
             {},
         )
@@ -110,6 +141,18 @@ def main(
             {},
         )
 
+    if config.should_send_mail:
+        senders = list(
+            dict.fromkeys(account.mail_config for account in config.accounts)
+        )
+        for mail_config in senders:
+            register_fn(
+                ksiemgowy.outbox.OUTBOX_POLL_SECONDS,
+                ksiemgowy.outbox.drain_outbox,
+                [database, mail_config],
+                {},
+            )
+
     register_fn(
         3600,
         homepage_update,
@@ -135,8 +178,7 @@ def entrypoint() -> None:
     logging_format = "[%(asctime)s] " + logging.BASIC_FORMAT
     logging.basicConfig(level="INFO", format=logging_format)
     with open(
-        os.environ.get("KSIEMGOWYD_CFG_FILE", "/etc/ksiemgowy/config.yaml"),
-        encoding="utf8",
+        ksiemgowy.config.default_config_path(), encoding="utf8"
     ) as config_file:
         config = ksiemgowy.config.load_config(config_file)
     main(
@@ -0,0 +1,125 @@
+"""A columnar representation of bank action history. Instead of keeping an
+object per action, ActionBatch stores amounts and timestamps in flat arrays
+and replaces account numbers and names with indices into a table of unique
+values - with a long history, the same few hundred hashes repeat
+thousands of times."""
+
+import array
+import datetime
+import typing as T
+
+from ksiemgowy.mbankmail import ActionRecord, BankAction, parse_timestamp
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def to_epoch(timestamp: datetime.datetime) -> float:
+    """Turns a naive timestamp into seconds since EPOCH. No time zone
+    conversion happens, which is what we want since that's how they're
+    stored in the database."""
+    return (timestamp - EPOCH).total_seconds()
+
+
+def from_epoch(seconds: float) -> datetime.datetime:
+    """Reverses to_epoch."""
+    return EPOCH + datetime.timedelta(seconds=seconds)
+
+
+class ActionBatch:
+    """Parallel arrays describing a list of bank actions: the i-th action
+    was sent from values[sender_ids[i]] to values[recipient_ids[i]] by
+    values[person_ids[i]], for amounts[i] PLN, at timestamps[i] seconds
+    since EPOCH. Iterating over the batch yields ActionRecords, so it can
+    be passed wherever an iterable of bank actions is expected."""
+
+    __slots__ = (
+        "values",
+        "value_ids",
+        "sender_ids",
+        "recipient_ids",
+        "person_ids",
+        "amounts",
+        "timestamps",
+    )
+
+    def __init__(self) -> None:
+        self.values: T.List[str] = []
+        self.value_ids: T.Dict[str, int] = {}
+        self.sender_ids = array.array("l")
+        self.recipient_ids = array.array("l")
+        self.person_ids = array.array("l")
+        self.amounts = array.array("d")
+        self.timestamps = array.array("d")
+
+    def intern(self, value: str) -> int:
+        """Returns the index of value in self.values, adding it if it's not
+        there yet."""
+        value_id = self.value_ids.get(value)
+        if value_id is None:
+            value_id = self.value_ids[value] = len(self.values)
+            self.values.append(value)
+        return value_id
+
+    def append_row(
+        self,
+        sender_acc_no: str,
+        recipient_acc_no: str,
+        amount_pln: float,
+        in_person: str,
+        booked_at: datetime.datetime,
+    ) -> None:
+        """Adds a single action, given its fields."""
+        # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self.sender_ids.append(self.intern(sender_acc_no))
+        self.recipient_ids.append(self.intern(recipient_acc_no))
+        self.person_ids.append(self.intern(in_person))
+        self.amounts.append(amount_pln)
+        self.timestamps.append(to_epoch(booked_at))
+
+    def append(self, action: BankAction) -> None:
+        """Adds a single action."""
+        self.append_row(
+            action.sender_acc_no,
+            action.recipient_acc_no,
+            action.amount_pln,
+            action.in_person,
+            action.get_timestamp(),
+        )
+
+    @classmethod
+    def from_rows(
+        cls,
+        rows: T.Iterable[
+            T.Tuple[str, str, float, str, T.Optional[datetime.datetime], str]
+        ],
+        amount_sign: float = 1.0,
+    ) -> "ActionBatch":
+        """Builds a batch out of (sender_acc_no, recipient_acc_no,
+        amount_pln, in_person, booked_at, timestamp) tuples, as returned by
+        a database query. The timestamp string is only parsed if booked_at
+        is missing. Amounts are multiplied by amount_sign."""
+        batch = cls()
+        for sender, recipient, amount, person, booked_at, timestamp in rows:
+            if booked_at is None:
+                booked_at = parse_timestamp(timestamp)
+            batch.append_row(
+                sender, recipient, amount * amount_sign, person, booked_at
+            )
+        return batch
+
+    def __len__(self) -> int:
+        return len(self.amounts)
+
+    def __getitem__(self, index: int) -> ActionRecord:
+        values = self.values
+        return ActionRecord(
+            values[self.sender_ids[index]],
+            values[self.recipient_ids[index]],
+            self.amounts[index],
+            values[self.person_ids[index]],
+            from_epoch(self.timestamps[index]),
+        )
+
+    def __iter__(self) -> T.Iterator[ActionRecord]:
+        for index in range(len(self)):
+            yield self[index]
@@ -0,0 +1,124 @@
+"""Anonymizes bank actions before they're stored. Account numbers and names
+repeat across transfers, so digests of recently seen values are cached.
+
+Two algorithms are supported: "sha256", which hashes the value followed by
+the pepper and is compatible with data stored by earlier versions of
+ksiemgowy, and "blake2b", which uses the pepper as BLAKE2's key. Digests
+produced by the two don't match, so switching an existing installation to
+blake2b means rebuilding the database from the e-mail archive (see
+ksiemgowy.bulk_import) and recomputing hashes used in the configuration
+(ACCOUNT_LABELS), which this module's entry point can do."""
+
+import argparse
+import functools
+import hashlib
+import os
+import typing as T
+
+import yaml
+
+import ksiemgowy.mbankmail
+from ksiemgowy.mbankmail import MbankAction
+
+ALGORITHMS = ["sha256", "blake2b"]
+DEFAULT_ALGORITHM = "sha256"
+DEFAULT_CACHE_SIZE = 4096
+BLAKE2B_MAX_KEY_SIZE = 64
+
+
+class Anonymizer:
+    """Anonymizes potentially sensitive fields of MbankActions using
+    mbank_anonymization_key as cryptographic pepper. Safe to share between
+    threads."""
+
+    def __init__(
+        self,
+        mbank_anonymization_key: bytes,
+        algorithm: str = DEFAULT_ALGORITHM,
+        cache_size: int = DEFAULT_CACHE_SIZE,
+    ) -> None:
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown anonymization algorithm: {algorithm}")
+        self.algorithm = algorithm
+        if (
+            algorithm == "blake2b"
+            and len(mbank_anonymization_key) > BLAKE2B_MAX_KEY_SIZE
+        ):
+            mbank_anonymization_key = hashlib.blake2b(
+                mbank_anonymization_key
+            ).digest()
+        self.mbank_anonymization_key = mbank_anonymization_key
+        self.anonymize_field: T.Callable[[str], str] = functools.lru_cache(
+            maxsize=cache_size
+        )(self.digest)
+
+    def digest(self, value: str) -> str:
+        """Returns a hex digest of value, bypassing the cache."""
+        if self.algorithm == "blake2b":
+            return hashlib.blake2b(
+                value.encode(),
+                key=self.mbank_anonymization_key,
+                digest_size=32,
+            ).hexdigest()
+        return ksiemgowy.mbankmail.anonymize(
+            value, self.mbank_anonymization_key
+        )
+
+    def anonymize(self, action: MbankAction) -> MbankAction:
+        """Returns a copy of action with all sensitive fields anonymized."""
+        return MbankAction(
+            sender_acc_no=self.anonymize_field(action.sender_acc_no),
+            recipient_acc_no=self.anonymize_field(action.recipient_acc_no),
+            amount_pln=action.amount_pln,
+            in_person=self.anonymize_field(action.in_person),
+            in_desc=self.anonymize_field(action.in_desc),
+            balance=action.balance,
+            timestamp=action.timestamp,
+            action_type=action.action_type,
+            booked_at=action.booked_at,
+        )
+
+    def anonymize_all(
+        self, actions: T.Iterable[MbankAction]
+    ) -> T.List[MbankAction]:
+        """Anonymizes a batch of actions."""
+        return [self.anonymize(action) for action in actions]
+
+
+def parse_args() -> T.Dict[str, T.Any]:
+    """Parses command-line arguments and returns them in a form usable as
+    **kwargs."""
+    parser = argparse.ArgumentParser(
+        description="Prints anonymized forms of given values, e.g. account "
+        "numbers that need to be put in ACCOUNT_LABELS."
+    )
+    parser.add_argument("values", nargs="+")
+    parser.add_argument("-a", "--algorithm", choices=ALGORITHMS)
+    # same as ksiemgowy.config.default_config_path, which we can't import:
+    config_path = os.environ.get(
+        "KSIEMGOWYD_CFG_FILE", "/etc/ksiemgowy/config.yaml"
+    )
+    parser.add_argument("-c", "--config-path", default=config_path)
+    return parser.parse_args().__dict__
+
+
+def main(
+    values: T.List[str], algorithm: T.Optional[str], config_path: str
+) -> None:
+    """Entry point for the submodule. Prints digests of values, using the
+    pepper from the configuration file and either the given algorithm or
+    the configured one."""
+    # ksiemgowy.config depends on this module, so we don't use it here:
+    with open(config_path, encoding="utf8") as config_file:
+        config = yaml.load(config_file, yaml.SafeLoader)
+    anonymizer = Anonymizer(
+        config["MBANK_ANONYMIZATION_KEY"].encode(),
+        algorithm
+        or config.get("ANONYMIZATION_ALGORITHM", DEFAULT_ALGORITHM),
+    )
+    for value in values:
+        print(f"{value}\t{anonymizer.digest(value)}")
+
+
+if __name__ == "__main__":
+    main(**parse_args())
@@ -4,18 +4,26 @@ users once they're observed."""
 import typing as T
 import logging
 import imaplib
-import email
+import re
+import time
+import concurrent.futures
+import email.parser
+from dataclasses import dataclass
 from email.message import Message
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
 import ksiemgowy.config
+from ksiemgowy.anonymizer import Anonymizer
 from ksiemgowy.mbankmail import MbankAction
-from ksiemgowy.models import KsiemgowyDB
+from ksiemgowy.models import KsiemgowyDB, OutgoingMail
 
 
 LOGGER = logging.getLogger("ksiemgowy.__main__")
 
+UID_RE = re.compile(rb"\bUID (\d+)")
+HEADER_FETCH_QUERY = "(UID BODY.PEEK[HEADER.FIELDS (DATE MESSAGE-ID)])"
+
 
 def build_confirmation_mail(
     fromaddr: str,
@@ -51,75 +59,400 @@ przez Telegrama, Matriksa albo wyślij oddzielnego maila.
     return msg
 
 
+def build_confirmation_key(mail_key: str, action_no: int) -> str:
+    """Returns the outbox idempotency key of a confirmation e-mail for
+    action_no-th action described in the e-mail identified by mail_key."""
+    return f"confirmation:{mail_key}:{action_no}"
+
+
+def is_positive_transfer(action: MbankAction, acc_number: str) -> bool:
+    """Tells whether action is a transfer to the account we're tracking."""
+    return action.action_type == "in_transfer" and str(
+        action.recipient_acc_no
+    ) == str(acc_number)
+
+
+def is_expense(action: MbankAction, acc_number: str) -> bool:
+    """Tells whether action is a transfer from the account we're
+    tracking."""
+    return action.action_type == "out_transfer" and str(
+        action.sender_acc_no
+    ) == str(acc_number)
+
+
+def classify_action(
+    action: MbankAction, acc_numbers: T.Sequence[str]
+) -> T.Optional[str]:
+    """Tells whether action is a "positive_transfer" or an "expense" of any
+    of the accounts we're tracking. Returns None if it's neither."""
+    for acc_number in acc_numbers:
+        if is_positive_transfer(action, acc_number):
+            return "positive_transfer"
+        if is_expense(action, acc_number):
+            return "expense"
+    return None
+
+
+def group_accounts_by_mailbox(
+    accounts: T.Sequence[ksiemgowy.config.KsiemgowyAccount],
+) -> T.Dict[
+    ksiemgowy.config.MailConfig, T.List[ksiemgowy.config.KsiemgowyAccount]
+]:
+    """Groups accounts whose e-mails are found in the same mailbox, using
+    the same filter. E-mails are marked as handled for all of them at once,
+    so they have to be handled together."""
+    by_mailbox: T.Dict[
+        ksiemgowy.config.MailConfig, T.List[ksiemgowy.config.KsiemgowyAccount]
+    ] = {}
+    for account in accounts:
+        by_mailbox.setdefault(account.mail_config, []).append(account)
+    return by_mailbox
+
+
+def gen_fetched_parts(
+    data: T.List[T.Any],
+) -> T.Iterator[T.Tuple[T.Optional[int], bytes]]:
+    """Walks the response of an IMAP FETCH command, yielding a pair
+    (uid, payload) for each of the returned messages. Servers are free to put
+    the UID either before or after the literal, so both places are checked."""
+    for i, response_part in enumerate(data):
+        if not isinstance(response_part, tuple):
+            continue
+        match = UID_RE.search(response_part[0])
+        if match is None and i + 1 < len(data):
+            trailer = data[i + 1]
+            if isinstance(trailer, bytes):
+                match = UID_RE.search(trailer)
+        uid = int(match.group(1)) if match else None
+        yield uid, response_part[1]
+
+
+def build_mail_key(date: T.Optional[str]) -> str:
+    """Returns the key under which an e-mail with a given Date header is
+    recorded in the observed_email_ids table. The "_0" suffix is there so
+    that the keys match the ones stored by earlier versions of ksiemgowy."""
+    return f"{date}_0"
+
+
+def build_sequence_set(uids: T.Iterable[int]) -> str:
+    """Compresses a collection of UIDs into an IMAP sequence set, e.g.
+    [1, 2, 3, 5] becomes "1:3,5"."""
+    ranges: T.List[T.List[int]] = []
+    for uid in sorted(set(uids)):
+        if ranges and ranges[-1][1] + 1 == uid:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ",".join(
+        str(start) if start == end else f"{start}:{end}"
+        for start, end in ranges
+    )
+
+
+def gen_fetched_batches(
+    mail: imaplib.IMAP4, uids: T.List[int], query: str, batch_size: int
+) -> T.Iterator[T.List[T.Tuple[T.Optional[int], bytes]]]:
+    """Fetches given messages, batch_size of them per FETCH command. Yields
+    the (uid, payload) pairs of each batch as soon as it arrives, so that
+    only one batch needs to be kept in memory at a time."""
+    for start in range(0, len(uids), batch_size):
+        end = start + batch_size
+        sequence_set = build_sequence_set(uids[start:end])
+        _, data = mail.uid("FETCH", sequence_set, query)
+        yield sorted(
+            gen_fetched_parts(data), key=lambda part: part[0] or 0
+        )
+
+
+@dataclass(frozen=True)
+class MailHeaders:
+    """Headers of a single e-mail, fetched without downloading its body."""
+
+    uid: int
+    date: T.Optional[str]
+    message_id: T.Optional[str]
+
+    @property
+    def mail_key(self) -> str:
+        """Returns the key under which the e-mail is recorded in the
+        observed_email_ids table."""
+        return build_mail_key(self.date)
+
+
+def fetch_headers(
+    mail: imaplib.IMAP4, uids: T.List[int], batch_size: int
+) -> T.List[MailHeaders]:
+    """Fetches Date and Message-ID headers of all given messages, batch_size
+    messages per FETCH command."""
+    ret = []
+    parser = email.parser.BytesHeaderParser()
+    for batch in gen_fetched_batches(
+        mail, uids, HEADER_FETCH_QUERY, batch_size
+    ):
+        for uid, payload in batch:
+            if uid is None:
+                continue
+            headers = parser.parsebytes(payload)
+            ret.append(
+                MailHeaders(
+                    uid=uid,
+                    date=headers["Date"],
+                    message_id=headers["Message-ID"],
+                )
+            )
+    return ret
+
+
+def get_uidvalidity(mail: imaplib.IMAP4) -> T.Optional[int]:
+    """Returns UIDVALIDITY of the currently selected mailbox, as reported
+    by the server in response to SELECT."""
+    _, data = mail.response("UIDVALIDITY")
+    if not data or data[0] is None:
+        return None
+    return int(data[-1])
+
+
+def search_uids(mail: imaplib.IMAP4, *criteria: str) -> T.List[int]:
+    """Runs UID SEARCH with all non-empty criteria and returns matching
+    UIDs in ascending order."""
+    _, data = mail.uid("SEARCH", " ".join(c for c in criteria if c))
+    return sorted(int(uid) for uid in data[0].split())
+
+
 def gen_unseen_mbank_emails(
-    database: KsiemgowyDB, mail: imaplib.IMAP4_SSL, imap_filter: str
+    database: KsiemgowyDB,
+    mail: imaplib.IMAP4,
+    imap_filter: str,
+    sync_key: str,
+    batch_size: int = ksiemgowy.config.DEFAULT_FETCH_BATCH_SIZE,
 ) -> T.Iterator[Message]:
-    """Connects to imap_server using login and password from the arguments,
-    then yields a pair (mail_id_as_str, email_as_eml_string) for each of
-    e-mails coming from mBank."""
+    """Searches the inbox for e-mails matching imap_filter, then yields
+    the ones that weren't handled yet, oldest first.
+
+    The highest processed UID is stored in the database together with
+    mailbox's UIDVALIDITY, so usually only messages newer than that are
+    looked at. If UIDVALIDITY changed (or was never recorded), all matching
+    messages are considered and observed_email_ids is used to tell which
+    ones were already handled - in that case only their headers are
+    downloaded in order to do so.
+
+    Messages are downloaded batch_size at a time, which saves a network
+    round trip per message during backfills. The caller is expected to
+    record each yielded message in observed_email_ids, together with its
+    bank actions. Since the watermark is stored separately from them,
+    messages are also looked up in observed_email_ids before they're
+    yielded - if ksiemgowy crashed before it saved the watermark, they
+    could have been handled already."""
+    # pylint: disable=too-many-locals
     mail.select("inbox")
-    _, data = mail.search(None, imap_filter)
-    mail_ids = data[0]
-    id_list = mail_ids.split()
-    for mail_id in reversed(id_list):
-        _, data = mail.fetch(mail_id, "(RFC822)")
-        for mail_number, response_part in enumerate(data):
-            if not isinstance(response_part, tuple):
-                continue
-            msg = email.message_from_string(response_part[1].decode())
-            mail_key = f'{msg["Date"]}_{mail_number}'
-            if database.was_imap_id_already_handled(mail_key):
-                continue
-            LOGGER.info("Handling e-mail id: %r", mail_id)
-            yield msg
-            database.mark_imap_id_already_handled(mail_key)
+    uidvalidity = get_uidvalidity(mail)
+    sync_state = database.get_imap_sync_state(sync_key)
+    is_incremental = (
+        uidvalidity is not None
+        and sync_state is not None
+        and sync_state[0] == uidvalidity
+    )
+    if sync_state is not None and is_incremental:
+        last_uid = sync_state[1]
+        # "n:*" always matches the last message, even if its UID is lower
+        # than n, hence the extra filtering:
+        uids = [
+            uid
+            for uid in search_uids(mail, f"UID {last_uid + 1}:*", imap_filter)
+            if uid > last_uid
+        ]
+    else:
+        LOGGER.info("No valid sync state for %r, doing a full sync", sync_key)
+        all_uids = search_uids(mail, imap_filter)
+        last_uid = max(all_uids, default=0)
+        handled = database.list_handled_imap_ids()
+        uids = [
+            headers.uid
+            for headers in fetch_headers(mail, all_uids, batch_size)
+            if headers.mail_key not in handled
+        ]
+    for batch in gen_fetched_batches(mail, uids, "(RFC822)", batch_size):
+        messages = [
+            (uid, ksiemgowy.mbankmail.lazy_message_from_bytes(payload))
+            for uid, payload in batch
+        ]
+        already_handled = database.filter_handled_imap_ids(
+            build_mail_key(msg["Date"]) for _, msg in messages
+        )
+        batch_last_uid = last_uid
+        try:
+            for uid, msg in messages:
+                mail_key = build_mail_key(msg["Date"])
+                if mail_key in already_handled:
+                    LOGGER.info("Skipping already handled e-mail uid=%r", uid)
+                else:
+                    LOGGER.info(
+                        "Handling e-mail uid=%r, Message-ID: %r",
+                        uid,
+                        msg["Message-ID"],
+                    )
+                    yield msg
+                if uid is not None and is_incremental:
+                    last_uid = uid
+        finally:
+            # this also runs if handling of a message failed, so that the
+            # watermark moves past the ones handled before it. During a full
+            # sync, the watermark is only moved once all of the messages
+            # were handled - otherwise an interrupted run could make us skip
+            # deduplication of the remaining ones:
+            if (
+                last_uid != batch_last_uid
+                and uidvalidity is not None
+                and is_incremental
+            ):
+                database.set_imap_sync_state(sync_key, uidvalidity, last_uid)
+    if uidvalidity is not None and not is_incremental:
+        database.set_imap_sync_state(sync_key, uidvalidity, last_uid)
 
 
 def check_for_updates(
-    mbank_anonymization_key: bytes,
+    anonymizer: Anonymizer,
     database: KsiemgowyDB,
     mail_config: ksiemgowy.config.MailConfig,
-    acc_number: str,
+    acc_numbers: T.Sequence[str],
     should_send_mail: bool,
 ) -> None:
     """Program's entry point."""
     LOGGER.info("checking for updates...")
     mail = mail_config.imap_connect()
+    handle_new_emails(
+        mail,
+        anonymizer,
+        database,
+        mail_config,
+        acc_numbers,
+        should_send_mail,
+    )
+
+
+def check_mailbox_accounts(
+    anonymizer: Anonymizer,
+    database: KsiemgowyDB,
+    accounts: T.Sequence[ksiemgowy.config.KsiemgowyAccount],
+    should_send_mail: bool,
+) -> None:
+    """Runs check_for_updates for accounts that share a mailbox, as
+    grouped by group_accounts_by_mailbox, in a single pass."""
+    started = time.monotonic()
+    mail_config = accounts[0].mail_config
+    check_for_updates(
+        anonymizer,
+        database,
+        mail_config,
+        [account.acc_number for account in accounts],
+        should_send_mail,
+    )
+    LOGGER.info(
+        "Checked %s in %.3fs",
+        mail_config.imap_sync_key,
+        time.monotonic() - started,
+    )
+
+
+def check_accounts(
+    anonymizer: Anonymizer,
+    database: KsiemgowyDB,
+    accounts: T.Sequence[ksiemgowy.config.KsiemgowyAccount],
+    should_send_mail: bool,
+    max_workers: int,
+) -> None:
+    """Checks all given accounts for updates, up to max_workers mailboxes
+    at a time, so that a cycle takes about as long as the slowest mailbox.
+    Accounts that share a mailbox are checked together. If any of
+    the checks fail, the others still run to completion and the first error
+    is re-raised afterwards."""
+    by_mailbox = group_accounts_by_mailbox(accounts)
+    if not by_mailbox:
+        return
+    num_workers = max(1, min(max_workers, len(by_mailbox)))
+    with concurrent.futures.ThreadPoolExecutor(num_workers) as executor:
+        futures = [
+            executor.submit(
+                check_mailbox_accounts,
+                anonymizer,
+                database,
+                mailbox_accounts,
+                should_send_mail,
+            )
+            for mailbox_accounts in by_mailbox.values()
+        ]
+    errors = [
+        error
+        for error in (future.exception() for future in futures)
+        if error is not None
+    ]
+    for error in errors:
+        LOGGER.error("Checking for updates failed: %r", error)
+    if errors:
+        raise errors[0]
+
+
+def handle_new_emails(
+    mail: imaplib.IMAP4,
+    anonymizer: Anonymizer,
+    database: KsiemgowyDB,
+    mail_config: ksiemgowy.config.MailConfig,
+    acc_numbers: T.Sequence[str],
+    should_send_mail: bool,
+) -> None:
+    """Records all new bank actions of acc_numbers found in the mailbox that
+    mail is connected to and queues confirmations for the incoming transfers
+    in the outbox. Each e-mail is recorded in a single transaction and
+    marked as handled for all of acc_numbers."""
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    # pylint: disable=too-many-locals
     for msg in gen_unseen_mbank_emails(
-        database, mail, mail_config.imap_filter
+        database,
+        mail,
+        mail_config.imap_filter,
+        mail_config.imap_sync_key,
+        mail_config.fetch_batch_size,
     ):
+        mail_key = build_mail_key(msg["Date"])
         parsed = ksiemgowy.mbankmail.parse_mbank_email(msg)
-        for action in parsed.get("actions", []):
-            LOGGER.info(
-                "Observed an action: %r",
-                action.anonymized(mbank_anonymization_key),
-            )
-            if action.action_type == "in_transfer" and str(
-                action.recipient_acc_no
-            ) == str(acc_number):
-                database.add_positive_transfer(
-                    action.anonymized(mbank_anonymization_key)
-                )
+        positive_actions = []
+        expenses = []
+        confirmations = []
+        actions = parsed.get("actions", [])
+        for action_no, (action, anonymized) in enumerate(
+            zip(actions, anonymizer.anonymize_all(actions))
+        ):
+            LOGGER.info("Observed an action: %r", anonymized)
+            kind = classify_action(action, acc_numbers)
+            if kind == "positive_transfer":
+                positive_actions.append(anonymized)
                 if should_send_mail:
-                    with mail_config.smtp_login() as smtp_conn:
-                        to_email = database.get_email_for_sender_acc_no(
-                            action.sender_acc_no
+                    to_email = database.get_email_for_sender_acc_no(
+                        action.sender_acc_no
+                    )
+                    confirmations.append(
+                        OutgoingMail(
+                            idempotency_key=build_confirmation_key(
+                                mail_key, action_no
+                            ),
+                            sender=mail_config.login,
+                            message=build_confirmation_mail(
+                                mail_config.login,
+                                action,
+                                to_email,
+                            ).as_string(),
                         )
-                        msg = build_confirmation_mail(
-                            mail_config.login,
-                            action,
-                            to_email,
-                        )
-                        smtp_conn.send_message(msg)
-
+                    )
                 LOGGER.info("added an action")
-            elif action.action_type == "out_transfer" and str(
-                action.sender_acc_no
-            ) == str(acc_number):
-                database.add_expense(
-                    action.anonymized(mbank_anonymization_key)
-                )
+            elif kind == "expense":
+                expenses.append(anonymized)
                 LOGGER.info("added an expense")
             else:
                 LOGGER.info("Skipping an action due to criteria not matched.")
-    LOGGER.info("check_for_updates: done")
+        database.add_bank_actions(
+            positive_actions,
+            expenses,
+            confirmations,
+            handled_imap_ids=[mail_key],
+        )
+    LOGGER.info("handle_new_emails: done")
@@ -0,0 +1,184 @@
+"""Imports bank actions from an archive of mBank e-mails - a Maildir, an mbox
+file or a directory of .eml files - without going through IMAP. Useful for
+rebuilding the database from scratch. E-mails are parsed in a process pool
+and stored in bulk transactions. Already imported e-mails are skipped, so
+it's safe to run the import more than once. Actions of all configured
+accounts are imported in one pass, since e-mails are marked as handled for
+all of them at once."""
+
+import argparse
+import concurrent.futures
+import glob
+import itertools
+import logging
+import mailbox
+import os
+import time
+import typing as T
+
+import ksiemgowy.bookkeeping
+import ksiemgowy.config
+import ksiemgowy.mbankmail
+from ksiemgowy.anonymizer import Anonymizer
+from ksiemgowy.mbankmail import MbankAction
+from ksiemgowy.models import KsiemgowyDB
+
+LOGGER = logging.getLogger(__name__)
+
+# How many e-mails are stored in a single transaction.
+DEFAULT_COMMIT_BATCH_SIZE = 200
+
+ARCHIVE_FORMATS = ["maildir", "mbox", "eml"]
+
+
+def detect_format(path: str) -> str:
+    """Guesses the format of the archive stored under path."""
+    if os.path.isdir(path):
+        if os.path.isdir(os.path.join(path, "cur")):
+            return "maildir"
+        return "eml"
+    return "mbox"
+
+
+def gen_raw_messages(path: str, archive_format: str) -> T.Iterator[bytes]:
+    """Yields raw contents of all e-mails in the archive, one at a time."""
+    if archive_format == "eml":
+        for fpath in sorted(glob.glob(os.path.join(path, "*.eml"))):
+            with open(fpath, "rb") as eml_file:
+                yield eml_file.read()
+        return
+    archive: mailbox.Mailbox[T.Any]
+    if archive_format == "maildir":
+        archive = mailbox.Maildir(path, factory=None, create=False)
+    elif archive_format == "mbox":
+        archive = mailbox.mbox(path, create=False)
+    else:
+        raise ValueError(f"Unexpected archive format: {archive_format}")
+    try:
+        for key in archive.iterkeys():
+            yield archive.get_bytes(key)
+    finally:
+        archive.close()
+
+
+def parse_raw_message(raw: bytes) -> T.Tuple[str, T.List[MbankAction]]:
+    """Parses an e-mail, returning its key in the observed_email_ids table
+    together with bank actions found in it. Run in worker processes."""
+    msg = ksiemgowy.mbankmail.lazy_message_from_bytes(raw)
+    parsed = ksiemgowy.mbankmail.parse_mbank_email(msg)
+    return (
+        ksiemgowy.bookkeeping.build_mail_key(msg["Date"]),
+        parsed.get("actions", []),
+    )
+
+
+def import_messages(
+    database: KsiemgowyDB,
+    raw_messages: T.Iterable[bytes],
+    anonymizer: Anonymizer,
+    acc_numbers: T.Sequence[str],
+    max_workers: T.Optional[int] = None,
+    commit_batch_size: int = DEFAULT_COMMIT_BATCH_SIZE,
+) -> int:
+    """Parses raw_messages across a process pool and stores bank actions
+    related to any of acc_numbers, commit_batch_size e-mails per
+    transaction. Returns the number of imported e-mails."""
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    # pylint: disable=too-many-locals
+    raw_messages = iter(raw_messages)
+    handled = database.list_handled_imap_ids()
+    num_emails = num_actions = num_skipped = 0
+    started = time.monotonic()
+    with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+        while True:
+            # read the archive chunk by chunk, so that it doesn't have to fit
+            # in memory:
+            chunk = list(itertools.islice(raw_messages, commit_batch_size))
+            if not chunk:
+                break
+            positive_actions = []
+            expenses = []
+            mail_keys = []
+            for mail_key, actions in executor.map(
+                parse_raw_message, chunk, chunksize=16
+            ):
+                if mail_key in handled:
+                    num_skipped += 1
+                    continue
+                handled.add(mail_key)
+                mail_keys.append(mail_key)
+                for action in actions:
+                    kind = ksiemgowy.bookkeeping.classify_action(
+                        action, acc_numbers
+                    )
+                    if kind == "positive_transfer":
+                        positive_actions.append(action)
+                    elif kind == "expense":
+                        expenses.append(action)
+            database.add_bank_actions(
+                anonymizer.anonymize_all(positive_actions),
+                anonymizer.anonymize_all(expenses),
+                handled_imap_ids=mail_keys,
+            )
+            num_emails += len(mail_keys)
+            num_actions += len(positive_actions) + len(expenses)
+            elapsed = time.monotonic() - started
+            LOGGER.info(
+                "Imported %d e-mails (%d actions, %d skipped) in %.1fs, "
+                "%.1f e-mails/s",
+                num_emails,
+                num_actions,
+                num_skipped,
+                elapsed,
+                (num_emails + num_skipped) / elapsed if elapsed else 0.0,
+            )
+    return num_emails
+
+
+def parse_args() -> T.Dict[str, T.Any]:
+    """Parses command-line arguments and returns them in a form usable as
+    **kwargs."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-i", "--input-path", required=True)
+    parser.add_argument(
+        "--format", dest="archive_format", choices=ARCHIVE_FORMATS
+    )
+    parser.add_argument(
+        "-c", "--config-path", default=ksiemgowy.config.default_config_path()
+    )
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    parser.add_argument(
+        "-b", "--batch-size", type=int, default=DEFAULT_COMMIT_BATCH_SIZE
+    )
+    parser.add_argument("-L", "--loglevel", default="INFO")
+    return parser.parse_args().__dict__
+
+
+def main(
+    input_path: str,
+    archive_format: T.Optional[str],
+    config_path: str,
+    workers: T.Optional[int],
+    batch_size: int,
+    loglevel: str,
+) -> None:
+    """Entry point for the submodule. Imports the archive stored under
+    input_path into the database specified in the configuration file."""
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    logging.basicConfig(level=loglevel.upper())
+    with open(config_path, encoding="utf8") as config_file:
+        config = ksiemgowy.config.load_config(config_file)
+    archive_format = archive_format or detect_format(input_path)
+    LOGGER.info("Importing %s as %s", input_path, archive_format)
+    import_messages(
+        KsiemgowyDB(config.database_uri),
+        gen_raw_messages(input_path, archive_format),
+        config.anonymizer,
+        [account.acc_number for account in config.accounts],
+        max_workers=workers,
+        commit_batch_size=batch_size,
+    )
+
+
+if __name__ == "__main__":
+    main(**parse_args())
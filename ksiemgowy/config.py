@@ -2,32 +2,83 @@
 configuration."""
 
 import datetime
+import hashlib
+import os
 import smtplib
 import imaplib
+import importlib.util
 import contextlib
 import typing as T
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 import dateutil.parser
 import yaml
 
-from ksiemgowy.mbankmail import MbankAction
+from ksiemgowy.anonymizer import DEFAULT_ALGORITHM, Anonymizer
+from ksiemgowy.imap_connection import IMAPConnectionManager
+from ksiemgowy.mbankmail import BankAction
+
+DEFAULT_FETCH_BATCH_SIZE = 50
+DEFAULT_SMTP_BATCH_SIZE = 20
+DEFAULT_MAX_WORKERS = 4
+
+# "python" replays all bank actions, "sql" lets the database group them by
+# month first, "aggregates" reads such sums from the monthly_aggregates
+# table, which is kept up to date as actions are added, and "incremental"
+# only replays actions added since the last report was built. "numpy" does
+# the same as "python" using array operations and requires NumPy. "parallel"
+# replays actions of each year in a separate process and merges the results:
+REPORT_ENGINES = [
+    "python",
+    "sql",
+    "aggregates",
+    "incremental",
+    "numpy",
+    "parallel",
+]
+DEFAULT_REPORT_ENGINE = "python"
 
 
 @dataclass(frozen=True)
 class MailConfig:
     """A structure that stores our mail credentials and exposes an interface
     that allows the user to create SMTP and IMAP connections. Tested with
-    GMail."""
+    GMail. The IMAP session is kept open between calls to imap_connect."""
 
+    # pylint: disable=too-many-instance-attributes
     login: str
     password: str
     server: str
     imap_filter: str
+    fetch_batch_size: int = DEFAULT_FETCH_BATCH_SIZE
+    smtp_batch_size: int = DEFAULT_SMTP_BATCH_SIZE
+    smtp_batch_interval: float = 0.0
+    imap_connection: IMAPConnectionManager = field(
+        init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self) -> None:
+        # the dataclass is frozen, hence the workaround:
+        object.__setattr__(
+            self, "imap_connection", IMAPConnectionManager(self.imap_login)
+        )
+
+    @property
+    def imap_sync_key(self) -> str:
+        """Identifies this mailbox and the filter used to search it in the
+        imap_sync_state table, so that accounts that search the same mailbox
+        with different filters don't share their progress."""
+        filter_hash = hashlib.sha256(self.imap_filter.encode()).hexdigest()
+        return f"{self.login}@{self.server}/inbox?{filter_hash[:16]}"
 
-    def imap_connect(self) -> imaplib.IMAP4_SSL:
-        """Logs in to IMAP using given credentials."""
+    def imap_connect(self) -> imaplib.IMAP4:
+        """Returns an IMAP session logged in using given credentials, reusing
+        the previous one if it's still alive."""
+        return self.imap_connection.get()
+
+    def imap_login(self) -> imaplib.IMAP4_SSL:
+        """Opens a new IMAP connection and logs in using given credentials."""
         mail = imaplib.IMAP4_SSL(self.server)
         mail.login(self.login, self.password)
         return mail
@@ -58,10 +109,13 @@ class HomepageUpdaterConfig:
 @dataclass(frozen=True)
 class KsiemgowyAccount:
     """Stores information tied to a specific bank account: its number and
-    an e-mail configuration used to handle communications related to it."""
+    an e-mail configuration used to handle communications related to it.
+    If use_imap_idle is set, new e-mails are waited for using IMAP IDLE
+    instead of checking the mailbox every hour."""
 
     acc_number: str
     mail_config: MailConfig
+    use_imap_idle: bool = False
 
 
 @dataclass(frozen=True)
@@ -72,7 +126,7 @@ class CategoryCriteria:
     amount_pln: T.Optional[float]
     category_name: str
 
-    def matches(self, bank_action: MbankAction) -> bool:
+    def matches(self, bank_action: BankAction) -> bool:
         """Checks whether a given bank action matches this specific set of
         criteria."""
         if bank_action.recipient_acc_no != self.recipient_acc_no:
@@ -82,10 +136,59 @@ class CategoryCriteria:
         return True
 
 
+class CategoryIndex:
+    """CategoryCriteria compiled for lookup by recipient and amount, giving
+    the same answer as trying each of them in order. Criteria that follow
+    one without an amount for the same recipient can never match, so they
+    are dropped. Answers are memoized, since the same payments tend to
+    repeat every month."""
+
+    # pylint: disable=too-few-public-methods
+    def __init__(self, categories: T.Iterable[CategoryCriteria]) -> None:
+        # recipient_acc_no -> (category names by amount, fallback category)
+        self.by_recipient: T.Dict[
+            str, T.Tuple[T.Dict[float, str], T.Optional[str]]
+        ] = {}
+        self.memo: T.Dict[T.Tuple[str, float], T.Optional[str]] = {}
+        for criteria in categories:
+            by_amount, fallback = self.by_recipient.get(
+                criteria.recipient_acc_no, ({}, None)
+            )
+            if fallback is not None:
+                continue
+            if criteria.amount_pln:
+                by_amount.setdefault(
+                    criteria.amount_pln, criteria.category_name
+                )
+            else:
+                fallback = criteria.category_name
+            self.by_recipient[criteria.recipient_acc_no] = (
+                by_amount,
+                fallback,
+            )
+
+    def find(
+        self, recipient_acc_no: str, amount_pln: float
+    ) -> T.Optional[str]:
+        """Returns the name of the first category matching a bank action
+        with given recipient and amount, or None if there's none."""
+        key = (recipient_acc_no, amount_pln)
+        if key in self.memo:
+            return self.memo[key]
+        category_name = None
+        if recipient_acc_no in self.by_recipient:
+            by_amount, fallback = self.by_recipient[recipient_acc_no]
+            category_name = by_amount.get(amount_pln, fallback)
+        self.memo[key] = category_name
+        return category_name
+
+
 @dataclass(frozen=True)
 class ReportBuilderConfig:
     """Stores extra state needed for correction of reports build by
-    Ksiemgowy."""
+    Ksiemgowy. engine picks the way reports are computed, see
+    REPORT_ENGINES. category_index is built out of categories and kept for
+    as long as the configuration is."""
 
     # pylint: disable=too-many-instance-attributes
     account_labels: T.Dict[str, str]
@@ -96,20 +199,44 @@ class ReportBuilderConfig:
     last_200pln_d33tah_due_date: datetime.datetime
     extra_monthly_reservations_started_date: datetime.datetime
     categories: T.List[CategoryCriteria]
+    engine: str = DEFAULT_REPORT_ENGINE
+    category_index: CategoryIndex = field(
+        init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self) -> None:
+        object.__setattr__(
+            self, "category_index", CategoryIndex(self.categories)
+        )
 
 
 @dataclass(frozen=True)
 class KsiemgowyConfig:
     """Stores information required to start Ksiemgowy. This includes
     database, e-mail and website credentials, as well as cryptographic pepper
-    used to anonymize account data."""
+    used to anonymize account data. max_workers limits how many mailboxes
+    are checked in parallel."""
 
+    # pylint: disable=too-many-instance-attributes
     database_uri: str
     accounts: T.List[KsiemgowyAccount]
     mbank_anonymization_key: bytes
     should_send_mail: bool
     homepage_updater_config: HomepageUpdaterConfig
     report_builder_config: ReportBuilderConfig
+    max_workers: int = DEFAULT_MAX_WORKERS
+    anonymization_algorithm: str = DEFAULT_ALGORITHM
+    anonymizer: Anonymizer = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        # the dataclass is frozen, hence the workaround:
+        object.__setattr__(
+            self,
+            "anonymizer",
+            Anonymizer(
+                self.mbank_anonymization_key, self.anonymization_algorithm
+            ),
+        )
 
     def get_account_for_overdue_notifications(self) -> KsiemgowyAccount:
         """Returns an e-mail account used for overdue notifications. Currently
@@ -117,8 +244,19 @@ class KsiemgowyConfig:
         return self.accounts[-1]
 
 
+def default_config_path() -> str:
+    """Returns the path of the configuration file to be used if none was
+    given explicitly."""
+    return os.environ.get("KSIEMGOWYD_CFG_FILE", "/etc/ksiemgowy/config.yaml")
+
+
 def parse_report_builder(config_section: T.Any) -> ReportBuilderConfig:
     """Parses the config section related to report_builder module."""
+    engine = config_section.get("REPORT_ENGINE", DEFAULT_REPORT_ENGINE)
+    if engine not in REPORT_ENGINES:
+        raise ValueError(f"Unknown report engine: {engine}")
+    if engine == "numpy" and importlib.util.find_spec("numpy") is None:
+        raise ValueError("REPORT_ENGINE numpy requires NumPy to be installed")
     categories = []
     for category_name, subsection in config_section["CATEGORIES"].items():
         categories.append(
@@ -147,11 +285,13 @@ def parse_report_builder(config_section: T.Any) -> ReportBuilderConfig:
             config_section["EXTRA_MONTHLY_RESERVATIONS_STARTED_DATE"]
         ),
         categories=categories,
+        engine=engine,
     )
 
 
 def load_config(config_file: T.IO[T.Any]) -> KsiemgowyConfig:
     """Parses the configuration file and builds arguments for all routines."""
+    # pylint: disable=too-many-locals
     config = yaml.load(config_file, yaml.SafeLoader)
     accounts = []
     deploy_key_path = config["DEPLOY_KEY_PATH"]
@@ -164,14 +304,25 @@ def load_config(config_file: T.IO[T.Any]) -> KsiemgowyConfig:
         imap_password = account["IMAP_PASSWORD"]
         imap_filter = account["IMAP_FILTER"]
         acc_no = account["ACC_NO"]
+        fetch_batch_size = int(
+            account.get("IMAP_FETCH_BATCH_SIZE", DEFAULT_FETCH_BATCH_SIZE)
+        )
+        smtp_batch_size = int(
+            account.get("SMTP_BATCH_SIZE", DEFAULT_SMTP_BATCH_SIZE)
+        )
+        smtp_batch_interval = float(account.get("SMTP_BATCH_INTERVAL", 0.0))
         accounts.append(
             KsiemgowyAccount(
                 acc_number=acc_no,
+                use_imap_idle=bool(account.get("IMAP_IDLE", False)),
                 mail_config=MailConfig(
                     login=imap_login,
                     password=imap_password,
                     server=imap_server,
                     imap_filter=imap_filter,
+                    fetch_batch_size=fetch_batch_size,
+                    smtp_batch_size=smtp_batch_size,
+                    smtp_batch_interval=smtp_batch_interval,
                 ),
             )
         )
@@ -189,4 +340,8 @@ def load_config(config_file: T.IO[T.Any]) -> KsiemgowyConfig:
             graphite_port=int(config["GRAPHITE_PORT"]),
         ),
         report_builder_config=report_builder_config,
+        max_workers=int(config.get("MAX_WORKERS", DEFAULT_MAX_WORKERS)),
+        anonymization_algorithm=config.get(
+            "ANONYMIZATION_ALGORITHM", DEFAULT_ALGORITHM
+        ),
     )
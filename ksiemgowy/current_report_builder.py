@@ -7,6 +7,7 @@ import datetime
 import logging
 
 from typing import (
+    Callable,
     List,
     Dict,
     Set,
@@ -18,18 +19,34 @@ from typing import (
 
 import dateutil.rrule
 
-from ksiemgowy.mbankmail import MbankAction
-from ksiemgowy.config import CategoryCriteria, ReportBuilderConfig
+from ksiemgowy.mbankmail import ActionRecord, BankAction, to_grosze, to_pln
+from ksiemgowy.config import (
+    CategoryCriteria,
+    CategoryIndex,
+    ReportBuilderConfig,
+)
+from ksiemgowy.models import KsiemgowyDB, MonthlyTotal
 
 
 LOGGER = logging.getLogger("homepage_updater")
 
+# Dues paid within this period are counted in dues_total_lastmonth.
+MONTH = datetime.timedelta(days=31)
+
+# Unless stated otherwise, functions below keep balances and sums in grosze
+# (see ksiemgowy.mbankmail.to_grosze), which build_report turns into PLN.
+# Published amounts are thus always whole grosze and don't depend on the
+# engine or on the order of bank actions. Sums of floats used to leak
+# rounding errors into reports instead, e.g. 4032.9900000000002 where
+# 4032.99 is published now.
+
 
 def apply_global_corrections(
     corrections_by_label: Dict[str, float],
-    balances_by_account_labels: Dict[str, float],
+    balances_by_account_labels: Dict[str, int],
 ) -> None:
-    """Apply a specified set of corrections to balances_by_account_labels."""
+    """Apply a specified set of corrections, given in PLN, to
+    balances_by_account_labels."""
     # Te hacki wynikają z bugów w powiadomieniach mBanku i braku powiadomień
     # związanych z przelewami własnymi:
     for account_name, value in corrections_by_label.items():
@@ -37,8 +54,8 @@ def apply_global_corrections(
             raise RuntimeError(
                 "%r not in balances_by_account_labels" % account_name
             )
-        balances_by_account_labels.setdefault(account_name, 0.0)
-        balances_by_account_labels[account_name] += value
+        balances_by_account_labels.setdefault(account_name, 0)
+        balances_by_account_labels[account_name] += to_grosze(value)
 
     balances_by_account_labels = dict(balances_by_account_labels)
 
@@ -46,27 +63,33 @@ def apply_global_corrections(
 def apply_monthly_corrections(
     monthly_income_corrections: Dict[str, Dict[str, float]],
     monthly_expense_corrections: Dict[str, Dict[str, float]],
-    monthly_income: Dict[str, Dict[str, float]],
-    monthly_expenses: Dict[str, Dict[str, float]],
+    monthly_income: Dict[str, Dict[str, int]],
+    monthly_expenses: Dict[str, Dict[str, int]],
 ) -> None:
-    """Apply a specified set of corrections to monthly_income and
-    monthly_expenses."""
+    """Apply a specified set of corrections, given in PLN, to monthly_income
+    and monthly_expenses."""
     for month in monthly_income_corrections:
         for label, value in monthly_income_corrections[month].items():
             monthly_income.setdefault(month, {}).setdefault(label, 0)
-            monthly_income[month][label] += value
+            monthly_income[month][label] += to_grosze(value)
 
     for month in monthly_expense_corrections:
         for label, value in monthly_expense_corrections[month].items():
             monthly_expenses.setdefault(month, {}).setdefault(label, 0)
-            monthly_expenses[month][label] += value
+            monthly_expenses[month][label] += to_grosze(value)
 
 
 def determine_category(
-    action: MbankAction, categories: List[CategoryCriteria]
+    action: BankAction,
+    categories: Union[CategoryIndex, List[CategoryCriteria]],
 ) -> str:
     """Given an incoming action, determine what label to assign to it."""
 
+    if isinstance(categories, CategoryIndex):
+        category_name = categories.find(
+            action.recipient_acc_no, action.amount_pln
+        )
+        return category_name if category_name is not None else "Pozostałe"
     for category_criteria in categories:
         if category_criteria.matches(action):
             return category_criteria.category_name
@@ -74,8 +97,8 @@ def determine_category(
 
 
 def apply_d33tah_dues(
-    monthly_income: Dict[str, Dict[str, float]],
-    balances_by_account_labels: Dict[str, float],
+    monthly_income: Dict[str, Dict[str, int]],
+    balances_by_account_labels: Dict[str, int],
     first_200pln_d33tah_due_date: datetime.datetime,
     last_200pln_d33tah_due_date: datetime.datetime,
 ) -> None:
@@ -89,47 +112,47 @@ def apply_d33tah_dues(
     ):
         month = f"{timestamp.year}-{timestamp.month:02d}"
         monthly_income.setdefault(month, {}).setdefault("Suma", 0)
-        monthly_income[month]["Suma"] += 200
-        balances_by_account_labels.setdefault("Konto Jacka", 0.0)
-        balances_by_account_labels["Konto Jacka"] += 200.0
+        monthly_income[month]["Suma"] += 20000
+        balances_by_account_labels.setdefault("Konto Jacka", 0)
+        balances_by_account_labels["Konto Jacka"] += 20000
 
 
 def apply_positive_transfers(
     now: datetime.datetime,
     last_updated: datetime.datetime,
-    positive_actions: Iterable[MbankAction],
-    balances_by_account_labels: Dict[str, float],
+    positive_actions: Iterable[BankAction],
+    balances_by_account_labels: Dict[str, int],
     account_labels: Dict[str, str],
-) -> Tuple[float, int, datetime.datetime, Dict[str, Dict[str, float]]]:
+) -> Tuple[int, int, datetime.datetime, Dict[str, Dict[str, int]]]:
     """Apply all positive transfers both to balances_by_account_labels and
     monthly_income. Returns newly built monthly_expenses, as well as total
     money raised and current information about the number of members who
     paid dues and the datestamp of due last paid."""
-    monthly_income: Dict[str, Dict[str, float]] = {}
+    monthly_income: Dict[str, Dict[str, int]] = {}
     observed_acc_numbers = set()
     observed_acc_owners = set()
 
-    total = 0.0
+    total = 0
     num_subscribers = 0
-    month_ago = now - datetime.timedelta(days=31)
+    month_ago = now - MONTH
     for action in positive_actions:
+        amount = to_grosze(action.amount_pln)
         balances_by_account_labels.setdefault(
-            account_labels[action.recipient_acc_no], 0.0
+            account_labels[action.recipient_acc_no], 0
         )
         balances_by_account_labels[
             account_labels[action.recipient_acc_no]
-        ] += action.amount_pln
+        ] += amount
 
-        month = (
-            f"{action.get_timestamp().year}-{action.get_timestamp().month:02d}"
-        )
+        timestamp = action.get_timestamp()
+        month = f"{timestamp.year}-{timestamp.month:02d}"
         monthly_income.setdefault(month, {}).setdefault("Suma", 0)
-        monthly_income[month]["Suma"] += action.amount_pln
+        monthly_income[month]["Suma"] += amount
 
-        if action.get_timestamp() < month_ago:
+        if timestamp < month_ago:
             continue
-        if last_updated is None or action.get_timestamp() > last_updated:
-            last_updated = action.get_timestamp()
+        if last_updated is None or timestamp > last_updated:
+            last_updated = timestamp
         if (
             action.sender_acc_no not in observed_acc_numbers
             and action.in_person not in observed_acc_owners
@@ -137,7 +160,7 @@ def apply_positive_transfers(
             num_subscribers += 1
             observed_acc_numbers.add(action.sender_acc_no)
             observed_acc_owners.add(action.in_person)
-        total += action.amount_pln
+        total += amount
 
     return (
         total,
@@ -148,43 +171,43 @@ def apply_positive_transfers(
 
 
 def apply_expenses(
-    expenses: Iterable[MbankAction],
-    balances_by_account_labels: Dict[str, float],
+    expenses: Iterable[BankAction],
+    balances_by_account_labels: Dict[str, int],
     account_labels: Dict[str, str],
-    categories: List[CategoryCriteria],
-) -> Tuple[datetime.datetime, Dict[str, Dict[str, float]]]:
+    categories: CategoryIndex,
+) -> Tuple[datetime.datetime, Dict[str, Dict[str, int]]]:
     """Apply all expenses both to balances_by_account_labels and
     monthly_expenses. Returns newly built monthly_expenses."""
     last_updated = datetime.datetime(year=1970, month=1, day=1)
-    monthly_expenses: Dict[str, Dict[str, float]] = {}
+    monthly_expenses: Dict[str, Dict[str, int]] = {}
     for action in expenses:
+        amount = to_grosze(action.amount_pln)
         balances_by_account_labels.setdefault(
-            account_labels[action.sender_acc_no], 0.0
+            account_labels[action.sender_acc_no], 0
         )
         balances_by_account_labels[
             account_labels[action.sender_acc_no]
-        ] -= action.amount_pln
-        month = (
-            f"{action.get_timestamp().year}-{action.get_timestamp().month:02d}"
-        )
+        ] -= amount
+        timestamp = action.get_timestamp()
+        month = f"{timestamp.year}-{timestamp.month:02d}"
         category = determine_category(action, categories)
         monthly_expenses.setdefault(month, {}).setdefault(category, 0)
-        monthly_expenses[month][category] += action.amount_pln
-        if last_updated is None or action.get_timestamp() > last_updated:
-            last_updated = action.get_timestamp()
+        monthly_expenses[month][category] += amount
+        if last_updated is None or timestamp > last_updated:
+            last_updated = timestamp
 
     return last_updated, monthly_expenses
 
 
 def build_monthly_final_balance(
     months: Set[str],
-    monthly_income: Dict[str, Dict[str, float]],
-    monthly_expenses: Dict[str, Dict[str, float]],
-) -> Tuple[Dict[str, Dict[str, float]], float]:
+    monthly_income: Dict[str, Dict[str, int]],
+    monthly_expenses: Dict[str, Dict[str, int]],
+) -> Tuple[Dict[str, Dict[str, int]], int]:
     """Calculates monthly final balances, given all of the actions - an amount
     that specifies whether we accumulated more than we spent, or otherwise."""
-    balance_so_far = 0.0
-    monthly_final_balance: Dict[str, Dict[str, float]] = {}
+    balance_so_far = 0
+    monthly_final_balance: Dict[str, Dict[str, int]] = {}
     for month in sorted(months):
         _monthly_income = sum(monthly_income.get(month, {}).values())
         _monthly_expenses = sum(monthly_expenses.get(month, {}).values())
@@ -196,9 +219,9 @@ def build_monthly_final_balance(
 
 def build_monthly_balance(
     months: Set[str],
-    monthly_income: Dict[str, Dict[str, Union[float, int]]],
-    monthly_expenses: Dict[str, Dict[str, float]],
-) -> Dict[str, Dict[str, Union[float, int]]]:
+    monthly_income: Dict[str, Dict[str, int]],
+    monthly_expenses: Dict[str, Dict[str, int]],
+) -> Dict[str, Dict[str, int]]:
     """Calculates balances for each of the months - the final amount of money
     on all of our accounts at the end of the month."""
     return {
@@ -241,6 +264,12 @@ T_MONTHLY_REPORT = TypedDict(
 )
 
 
+T_FINAL_BALANCE_BUILDER = Callable[
+    [Set[str], Dict[str, Dict[str, int]], Dict[str, Dict[str, int]]],
+    Tuple[Dict[str, Dict[str, int]], int],
+]
+
+
 T_CURRENT_REPORT = TypedDict(
     "T_CURRENT_REPORT",
     {
@@ -255,36 +284,38 @@ T_CURRENT_REPORT = TypedDict(
 )
 
 
-def get_current_report(
-    now: datetime.datetime,
-    expenses: Iterable[MbankAction],
-    positive_actions: Iterable[MbankAction],
-    report_builder_config: ReportBuilderConfig,
-) -> T_CURRENT_REPORT:
-    """Module's entry point. Given time, expenses, income and corrections,
-    generates a monthly summary of actions that happened on the accounts."""
+def sums_to_pln(sums: Dict[str, int]) -> Dict[str, float]:
+    """Turns a dictionary of sums in grosze into one of sums in PLN."""
+    return {key: to_pln(value) for key, value in sums.items()}
 
-    balances_by_account_labels: Dict[str, float] = {}
 
-    last_updated, monthly_expenses = apply_expenses(
-        expenses,
-        balances_by_account_labels,
-        report_builder_config.account_labels,
-        report_builder_config.categories,
-    )
+def monthly_sums_to_pln(
+    monthly_sums: Dict[str, Dict[str, int]],
+) -> Dict[str, Dict[str, float]]:
+    """Same as sums_to_pln, but for sums grouped by month first."""
+    return {month: sums_to_pln(sums) for month, sums in monthly_sums.items()}
 
-    (
-        total,
-        num_subscribers,
-        last_updated,
-        monthly_income,
-    ) = apply_positive_transfers(
-        now,
-        last_updated,
-        positive_actions,
-        balances_by_account_labels,
-        report_builder_config.account_labels,
-    )
+
+def build_report(
+    now: datetime.datetime,
+    report_builder_config: ReportBuilderConfig,
+    balances_by_account_labels: Dict[str, int],
+    monthly_income: Dict[str, Dict[str, int]],
+    monthly_expenses: Dict[str, Dict[str, int]],
+    dues: Tuple[int, int, datetime.datetime],
+    final_balance_builder: T_FINAL_BALANCE_BUILDER = (
+        build_monthly_final_balance
+    ),
+) -> T_CURRENT_REPORT:
+    """Applies d33tah's dues and corrections from the configuration to the
+    balances and monthly summaries of bank actions, then calculates the
+    monthly balances and builds the report. dues is a tuple of total money
+    raised in the last month, number of members who paid and the datestamp
+    of due last paid, as returned by apply_positive_transfers.
+    final_balance_builder can replace build_monthly_final_balance. Amounts
+    are turned from grosze into PLN only once everything is added up."""
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    total, num_subscribers, last_updated = dues
 
     apply_d33tah_dues(
         monthly_income,
@@ -307,27 +338,204 @@ def get_current_report(
 
     months = set(monthly_income.keys()).union(set(monthly_expenses.keys()))
 
-    monthly_final_balance, balance_so_far = build_monthly_final_balance(
+    monthly_final_balance, balance_so_far = final_balance_builder(
         months, monthly_income, monthly_expenses
     )
 
     ret: T_CURRENT_REPORT = {
-        "dues_total_lastmonth": total,
+        "dues_total_lastmonth": to_pln(total),
         "dues_last_updated": last_updated.strftime("%d-%m-%Y"),
         "dues_num_subscribers": num_subscribers,
         "extra_monthly_reservations": build_extra_monthly_reservations(
             now, report_builder_config.extra_monthly_reservations_started_date
         ),
-        "balance_so_far": balance_so_far,
-        "balances_by_account_labels": balances_by_account_labels,
+        "balance_so_far": to_pln(balance_so_far),
+        "balances_by_account_labels": sums_to_pln(balances_by_account_labels),
         "monthly": {
-            "Wydatki": monthly_expenses,
-            "Przychody": monthly_income,
-            "Bilans": build_monthly_balance(
-                months, monthly_income, monthly_expenses
+            "Wydatki": monthly_sums_to_pln(monthly_expenses),
+            "Przychody": monthly_sums_to_pln(monthly_income),
+            "Bilans": monthly_sums_to_pln(
+                build_monthly_balance(months, monthly_income, monthly_expenses)
             ),
-            "Saldo": monthly_final_balance,
+            "Saldo": monthly_sums_to_pln(monthly_final_balance),
         },
     }
     LOGGER.debug("get_current_report_dues: ret=%r", ret)
     return ret
+
+
+def get_current_report(
+    now: datetime.datetime,
+    expenses: Iterable[BankAction],
+    positive_actions: Iterable[BankAction],
+    report_builder_config: ReportBuilderConfig,
+) -> T_CURRENT_REPORT:
+    """Module's entry point. Given time, expenses, income and corrections,
+    generates a monthly summary of actions that happened on the accounts."""
+
+    balances_by_account_labels: Dict[str, int] = {}
+
+    last_updated, monthly_expenses = apply_expenses(
+        expenses,
+        balances_by_account_labels,
+        report_builder_config.account_labels,
+        report_builder_config.category_index,
+    )
+
+    (
+        total,
+        num_subscribers,
+        last_updated,
+        monthly_income,
+    ) = apply_positive_transfers(
+        now,
+        last_updated,
+        positive_actions,
+        balances_by_account_labels,
+        report_builder_config.account_labels,
+    )
+
+    return build_report(
+        now,
+        report_builder_config,
+        balances_by_account_labels,
+        monthly_income,
+        monthly_expenses,
+        (total, num_subscribers, last_updated),
+    )
+
+
+def apply_monthly_totals(
+    expense_totals: Iterable[MonthlyTotal],
+    income_totals: Iterable[MonthlyTotal],
+    balances_by_account_labels: Dict[str, int],
+    account_labels: Dict[str, str],
+    categories: CategoryIndex,
+) -> Tuple[
+    datetime.datetime, Dict[str, Dict[str, int]], Dict[str, Dict[str, int]]
+]:
+    """Counterpart of apply_expenses and apply_positive_transfers for sums
+    calculated by the database. Returns the time of the last expense,
+    monthly_income and monthly_expenses. Doesn't look at individual
+    transfers, so the trailing month's dues aren't calculated here."""
+    last_updated = datetime.datetime(year=1970, month=1, day=1)
+    monthly_expenses: Dict[str, Dict[str, int]] = {}
+    for expense_total in expense_totals:
+        label = account_labels[str(expense_total.sender_acc_no)]
+        balances_by_account_labels.setdefault(label, 0)
+        balances_by_account_labels[label] -= expense_total.total_grosze
+        # categories only depend on the recipient and the amount:
+        category = determine_category(
+            ActionRecord(
+                "",
+                expense_total.recipient_acc_no,
+                float(expense_total.amount_pln or 0.0),
+                "",
+                expense_total.last_booked_at,
+            ),
+            categories,
+        )
+        monthly_expenses.setdefault(expense_total.month, {}).setdefault(
+            category, 0
+        )
+        monthly_expenses[expense_total.month][
+            category
+        ] += expense_total.total_grosze
+        last_updated = max(last_updated, expense_total.last_booked_at)
+
+    monthly_income: Dict[str, Dict[str, int]] = {}
+    for income_total in income_totals:
+        label = account_labels[income_total.recipient_acc_no]
+        balances_by_account_labels.setdefault(label, 0)
+        balances_by_account_labels[label] += income_total.total_grosze
+        monthly_income.setdefault(income_total.month, {}).setdefault(
+            "Suma", 0
+        )
+        monthly_income[income_total.month][
+            "Suma"
+        ] += income_total.total_grosze
+
+    return last_updated, monthly_income, monthly_expenses
+
+
+def get_current_report_from_totals(
+    now: datetime.datetime,
+    database: KsiemgowyDB,
+    report_builder_config: ReportBuilderConfig,
+    from_aggregates: bool,
+) -> T_CURRENT_REPORT:
+    """Same as get_current_report, but works on sums of bank actions by
+    month - either calculated by the database or, if from_aggregates is
+    set, read from the monthly_aggregates table. Only positive transfers
+    from the last month are fetched one by one, since they're needed to
+    count the members who paid their dues."""
+    if from_aggregates:
+        sum_by_month = database.list_monthly_aggregates
+    else:
+        sum_by_month = database.sum_bank_actions_by_month
+    balances_by_account_labels: Dict[str, int] = {}
+    last_updated, monthly_income, monthly_expenses = apply_monthly_totals(
+        sum_by_month(False),
+        sum_by_month(True),
+        balances_by_account_labels,
+        report_builder_config.account_labels,
+        report_builder_config.category_index,
+    )
+    # balances and monthly income are already taken care of, so those
+    # calculated here are thrown away:
+    total, num_subscribers, last_updated, _ = apply_positive_transfers(
+        now,
+        last_updated,
+        database.load_positive_transfers(since=now - MONTH),
+        {},
+        report_builder_config.account_labels,
+    )
+    return build_report(
+        now,
+        report_builder_config,
+        balances_by_account_labels,
+        monthly_income,
+        monthly_expenses,
+        (total, num_subscribers, last_updated),
+    )
+
+
+def get_current_report_from_database(
+    now: datetime.datetime,
+    database: KsiemgowyDB,
+    report_builder_config: ReportBuilderConfig,
+) -> T_CURRENT_REPORT:
+    """Builds the current report out of bank actions stored in database,
+    using the engine picked in the configuration."""
+    if report_builder_config.engine == "incremental":
+        # pylint: disable=import-outside-toplevel,cyclic-import
+        from ksiemgowy.incremental_report_builder import (
+            IncrementalReportBuilder,
+        )
+
+        return IncrementalReportBuilder(database, report_builder_config).build(
+            now
+        )
+    if report_builder_config.engine == "numpy":
+        # pylint: disable=import-outside-toplevel,cyclic-import
+        from ksiemgowy.numpy_report_builder import get_current_report_numpy
+
+        return get_current_report_numpy(now, database, report_builder_config)
+    if report_builder_config.engine == "parallel":
+        # pylint: disable=import-outside-toplevel,cyclic-import
+        from ksiemgowy.partial_report import build_report_in_parallel
+
+        return build_report_in_parallel(now, database, report_builder_config)
+    if report_builder_config.engine in ("sql", "aggregates"):
+        return get_current_report_from_totals(
+            now,
+            database,
+            report_builder_config,
+            from_aggregates=report_builder_config.engine == "aggregates",
+        )
+    return get_current_report(
+        now,
+        database.load_expenses(),
+        database.load_positive_transfers(),
+        report_builder_config,
+    )
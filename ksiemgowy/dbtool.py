@@ -0,0 +1,97 @@
+"""Maintenance of ksiemgowy's database: brings its schema up to date and
+checks or rebuilds the monthly_aggregates table, which is maintained
+incrementally and could drift from bank_actions if the latter were edited
+by hand."""
+
+import argparse
+import logging
+import sys
+import typing as T
+
+import ksiemgowy.config
+from ksiemgowy.models import KsiemgowyDB, MonthlyTotal
+
+LOGGER = logging.getLogger(__name__)
+
+COMMANDS = ["migrate", "check-aggregates", "rebuild-aggregates"]
+
+
+def diff_monthly_aggregates(database: KsiemgowyDB) -> T.List[str]:
+    """Compares monthly_aggregates with sums calculated out of bank_actions,
+    returning a description of each difference."""
+    differences = []
+    for is_positive in [True, False]:
+        expected = index_totals(
+            database.sum_bank_actions_by_month(is_positive)
+        )
+        actual = index_totals(database.list_monthly_aggregates(is_positive))
+        for key in sorted(expected.keys() | actual.keys(), key=str):
+            expected_total = expected.get(key)
+            actual_total = actual.get(key)
+            if (
+                expected_total is None
+                or actual_total is None
+                or expected_total.total_grosze != actual_total.total_grosze
+                or expected_total.last_booked_at
+                != actual_total.last_booked_at
+            ):
+                differences.append(
+                    f"expected {expected_total}, found {actual_total}"
+                )
+    return differences
+
+
+def index_totals(
+    totals: T.Iterable[MonthlyTotal],
+) -> T.Dict[T.Tuple[T.Any, ...], MonthlyTotal]:
+    """Indexes totals by the fields they were grouped by."""
+    return {
+        (
+            total.month,
+            total.recipient_acc_no,
+            total.sender_acc_no,
+            total.amount_pln,
+        ): total
+        for total in totals
+    }
+
+
+def open_database(config_path: str) -> KsiemgowyDB:
+    """Opens the database specified in the configuration file, migrating
+    it if needed."""
+    with open(config_path, encoding="utf8") as config_file:
+        config = ksiemgowy.config.load_config(config_file)
+    return KsiemgowyDB(config.database_uri)
+
+
+def parse_args() -> T.Dict[str, T.Any]:
+    """Parses command-line arguments and returns them in a form usable as
+    **kwargs."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("command", choices=COMMANDS)
+    parser.add_argument(
+        "-c", "--config-path", default=ksiemgowy.config.default_config_path()
+    )
+    parser.add_argument("-L", "--loglevel", default="INFO")
+    return parser.parse_args().__dict__
+
+
+def main(command: str, config_path: str, loglevel: str) -> None:
+    """Entry point for the submodule. Opening the database is enough to
+    migrate it, so that's all the migrate command does."""
+    logging.basicConfig(level=loglevel.upper())
+    database = open_database(config_path)
+    if command == "check-aggregates":
+        differences = diff_monthly_aggregates(database)
+        for difference in differences:
+            LOGGER.error("%s", difference)
+        if differences:
+            sys.exit(1)
+        LOGGER.info("monthly_aggregates is consistent with bank_actions")
+    elif command == "rebuild-aggregates":
+        database.rebuild_monthly_aggregates()
+        LOGGER.info("Rebuilt monthly_aggregates")
+
+
+if __name__ == "__main__":
+    main(**parse_args())
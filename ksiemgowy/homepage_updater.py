@@ -215,11 +215,10 @@ def maybe_update_dues(
     """Generates the current report, retrieves the one that's accessible online
     and if the current one is later, updates the remote state."""
     now = datetime.datetime.now()
-    current_report = ksiemgowy.current_report_builder.get_current_report(
-        now,
-        database.list_expenses(),
-        database.list_positive_transfers(),
-        report_builder_config,
+    current_report = (
+        ksiemgowy.current_report_builder.get_current_report_from_database(
+            now, database, report_builder_config
+        )
     )
     remote_state_path = pathlib.Path(f"homepage/{dues_file_path}")
     remote_state = get_remote_state_dues(remote_state_path)
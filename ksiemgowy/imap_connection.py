@@ -0,0 +1,76 @@
+"""Keeps IMAP sessions alive between mailbox checks, so that we don't need
+to do a TLS handshake and log in every time we look for new e-mails."""
+
+import imaplib
+import logging
+import time
+import typing as T
+import weakref
+
+
+LOGGER = logging.getLogger(__name__)
+
+_MANAGERS: "weakref.WeakSet[IMAPConnectionManager]" = weakref.WeakSet()
+
+
+class IMAPConnectionManager:
+    """Owns a single authenticated IMAP session. The session is checked with
+    NOOP before it's handed out and re-established (with exponential
+    backoff) if it turns out to be dead."""
+
+    def __init__(
+        self,
+        connect: T.Callable[[], imaplib.IMAP4],
+        max_attempts: int = 5,
+        initial_backoff: float = 1.0,
+        sleep: T.Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.connect = connect
+        self.max_attempts = max_attempts
+        self.initial_backoff = initial_backoff
+        self.sleep = sleep
+        self.mail: T.Optional[imaplib.IMAP4] = None
+        _MANAGERS.add(self)
+
+    def get(self) -> imaplib.IMAP4:
+        """Returns a working, authenticated IMAP session."""
+        if self.mail is not None:
+            try:
+                self.mail.noop()
+                return self.mail
+            except (imaplib.IMAP4.error, OSError) as err:
+                LOGGER.warning("IMAP session is dead, reconnecting: %r", err)
+                self.mail = None
+        backoff = self.initial_backoff
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self.mail = self.connect()
+                return self.mail
+            except (imaplib.IMAP4.error, OSError) as err:
+                if attempt == self.max_attempts:
+                    raise
+                LOGGER.warning(
+                    "IMAP connection attempt %d failed (%r), retrying in %ss",
+                    attempt,
+                    err,
+                    backoff,
+                )
+                self.sleep(backoff)
+                backoff *= 2
+        raise AssertionError("unreachable")
+
+    def close(self) -> None:
+        """Logs out of the session, if there is one."""
+        if self.mail is None:
+            return
+        try:
+            self.mail.logout()
+        except (imaplib.IMAP4.error, OSError) as err:
+            LOGGER.warning("Error while logging out of IMAP: %r", err)
+        self.mail = None
+
+
+def close_all() -> None:
+    """Closes IMAP sessions of all connection managers. Called on shutdown."""
+    for manager in list(_MANAGERS):
+        manager.close()
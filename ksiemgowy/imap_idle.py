@@ -0,0 +1,170 @@
+"""Lets ksiemgowy learn about new e-mails as soon as they arrive, using the
+IMAP IDLE extension (RFC 2177) instead of hourly polling."""
+
+# imaplib doesn't support IDLE, so we need to drive the protocol ourselves:
+# pylint: disable=protected-access
+
+import imaplib
+import io
+import logging
+import select
+import ssl
+import time
+import typing as T
+
+import ksiemgowy.config
+
+
+LOGGER = logging.getLogger(__name__)
+
+# RFC 2177 asks clients to re-issue IDLE at least every 29 minutes.
+IDLE_RENEW_SECONDS = 29 * 60
+
+# How often IdleListener.poll is supposed to be called.
+IDLE_POLL_SECONDS = 5
+
+
+class IdleListener:
+    """Keeps a single authenticated IMAP connection in IDLE state and calls
+    on_new_mail whenever the server announces new messages. poll() is meant
+    to be called every IDLE_POLL_SECONDS and never blocks for long, so that
+    it can be run from the same scheduler as the rest of ksiemgowy."""
+
+    def __init__(
+        self,
+        mail_config: ksiemgowy.config.MailConfig,
+        on_new_mail: T.Callable[[imaplib.IMAP4], None],
+        clock: T.Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.mail_config = mail_config
+        self.on_new_mail = on_new_mail
+        self.clock = clock
+        self.mail: T.Optional[imaplib.IMAP4] = None
+        self.tag: T.Optional[bytes] = None
+        self.idle_started = 0.0
+
+    def start(self) -> bool:
+        """Connects to the server and selects the inbox. Returns False if
+        the server doesn't advertise IDLE, in which case the caller should
+        fall back to polling."""
+        mail = self.mail_config.imap_connect()
+        if "IDLE" not in mail.capabilities:
+            LOGGER.info(
+                "%s doesn't support IDLE, falling back to polling",
+                self.mail_config.server,
+            )
+            return False
+        mail.select("inbox")
+        self.mail = mail
+        self.tag = None
+        return True
+
+    def enter_idle(self) -> None:
+        """Sends the IDLE command and waits for server's go-ahead."""
+        assert self.mail is not None
+        self.mail.untagged_responses.pop("EXISTS", None)
+        tag = self.mail._new_tag()
+        self.mail.tagged_commands[tag] = None
+        self.mail.send(tag + b" IDLE\r\n")
+        # _get_response returns None once it reads the continuation request:
+        while self.mail._get_response() is not None:
+            if self.mail.tagged_commands[tag] is not None:
+                raise imaplib.IMAP4.error(
+                    f"IDLE rejected: {self.mail.tagged_commands[tag]!r}"
+                )
+        self.tag = tag
+        self.idle_started = self.clock()
+
+    def leave_idle(self) -> None:
+        """Sends DONE and reads all responses up to IDLE's completion."""
+        assert self.mail is not None
+        self.mail.send(b"DONE\r\n")
+        self.mail._command_complete("IDLE", self.tag)
+        self.tag = None
+
+    def has_buffered_data(self) -> bool:
+        """Tells whether imaplib's buffered reader already took data off the
+        socket that wasn't parsed yet. select() can't see such data."""
+        assert self.mail is not None
+        reader = getattr(self.mail, "file", None)
+        if not isinstance(reader, io.BufferedReader):
+            return False
+        sock = self.mail.sock
+        timeout = sock.gettimeout()
+        # peek() only reads from the socket if the buffer is empty, so that
+        # read must not block:
+        sock.setblocking(False)
+        try:
+            return bool(reader.peek(1))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        finally:
+            sock.settimeout(timeout)
+
+    def has_pending_data(self) -> bool:
+        """Tells whether the server sent something we didn't read yet."""
+        assert self.mail is not None
+        if self.has_buffered_data():
+            return True
+        sock = self.mail.sock
+        if isinstance(sock, ssl.SSLSocket) and sock.pending():
+            return True
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable)
+
+    def poll(self) -> None:
+        """Reads whatever the server sent while we were idling and, if any
+        new messages were announced, leaves IDLE, runs on_new_mail and
+        resumes. Reconnects if the connection was lost.
+
+        Announcements can also be parsed already, e.g. if they came before
+        the continuation request, or wait in imaplib's buffered reader, so
+        both are looked at before the socket is."""
+        try:
+            if self.mail is None and not self.start():
+                return
+            assert self.mail is not None
+            if self.tag is None:
+                # catch up on whatever arrived before we started listening:
+                self.run_callback()
+                self.enter_idle()
+                return
+            has_new_mail = "EXISTS" in self.mail.untagged_responses
+            while not has_new_mail and self.has_pending_data():
+                self.mail._get_response()
+                has_new_mail = "EXISTS" in self.mail.untagged_responses
+            if has_new_mail or (
+                self.clock() - self.idle_started > IDLE_RENEW_SECONDS
+            ):
+                self.leave_idle()
+                if has_new_mail or "EXISTS" in self.mail.untagged_responses:
+                    self.run_callback()
+                self.enter_idle()
+        except (imaplib.IMAP4.error, OSError) as err:
+            LOGGER.exception(err)
+            self.drop_connection()
+
+    def drop_connection(self) -> None:
+        """Closes the socket without talking to the server, since we can't
+        tell which state the session is in. The next call to imap_connect
+        will notice that and log in again."""
+        if self.mail is not None:
+            try:
+                self.mail.shutdown()
+            except OSError:
+                pass
+        self.mail = None
+        self.tag = None
+
+    def run_callback(self) -> None:
+        """Calls on_new_mail on the connection we're listening on. Errors
+        other than connection problems, e.g. an e-mail that couldn't be
+        parsed, are logged, so that they don't stop us from listening."""
+        assert self.mail is not None
+        LOGGER.info("New e-mails in %s", self.mail_config.imap_sync_key)
+        try:
+            self.on_new_mail(self.mail)
+        except (imaplib.IMAP4.error, OSError):
+            raise
+        except Exception as err:  # pylint: disable=broad-except
+            LOGGER.error("Handling new e-mails failed: %r", err)
@@ -0,0 +1,124 @@
+"""Builds the same report as current_report_builder.get_current_report, but
+instead of replaying the whole history each time, keeps intermediate
+results in the database together with a watermark - the id of the last
+bank action they include - and only applies actions added since then.
+
+Amounts are kept in grosze, so sums are exact and the result is identical
+to get_current_report's no matter in which order actions are applied."""
+
+import dataclasses
+import datetime
+import hashlib
+import json
+import logging
+
+from ksiemgowy.config import ReportBuilderConfig
+from ksiemgowy.current_report_builder import MONTH, T_CURRENT_REPORT
+from ksiemgowy.models import KsiemgowyDB
+from ksiemgowy.partial_report import PartialReport, reduce_bank_actions
+
+LOGGER = logging.getLogger(__name__)
+
+# Name under which the state is saved in the report_state table.
+STATE_NAME = "current_report"
+
+# Bump when the format of ReportState changes, so that old state is
+# discarded instead of misinterpreted.
+STATE_VERSION = 4
+
+
+def fingerprint_config(report_builder_config: ReportBuilderConfig) -> str:
+    """Returns a digest of all the settings that the report depends on.
+    If it changes, the state has to be rebuilt from scratch."""
+    settings = dataclasses.replace(report_builder_config, engine="")
+    return hashlib.sha256(
+        f"{STATE_VERSION}:{settings!r}".encode()
+    ).hexdigest()
+
+
+@dataclasses.dataclass
+class ReportState:
+    """A PartialReport of all bank actions up to and including the one with
+    id equal to watermark. It only holds running totals, so its size
+    doesn't grow with the number of bank actions."""
+
+    config_fingerprint: str
+    watermark: int = 0
+    report: PartialReport = dataclasses.field(default_factory=PartialReport)
+
+    def to_json(self) -> str:
+        """Serializes the state."""
+        state = dataclasses.asdict(self)
+        state["report"]["last_expense_at"] = (
+            self.report.last_expense_at.isoformat()
+        )
+        return json.dumps(state)
+
+    @classmethod
+    def from_json(cls, serialized: str) -> "ReportState":
+        """Reverses to_json."""
+        state = json.loads(serialized)
+        report = state.pop("report")
+        report["last_expense_at"] = datetime.datetime.fromisoformat(
+            report["last_expense_at"]
+        )
+        return cls(report=PartialReport(**report), **state)
+
+
+class IncrementalReportBuilder:
+    """Builds current reports out of the bank actions stored in database,
+    applying only the ones added since the previous call. The state is
+    saved in the database, so it survives restarts; it's discarded if the
+    configuration changes."""
+
+    def __init__(
+        self,
+        database: KsiemgowyDB,
+        report_builder_config: ReportBuilderConfig,
+    ) -> None:
+        self.database = database
+        self.report_builder_config = report_builder_config
+        self.config_fingerprint = fingerprint_config(report_builder_config)
+
+    def load_state(self) -> ReportState:
+        """Returns the saved state, or a blank one if there's none or it was
+        built using a different configuration."""
+        serialized = self.database.get_report_state(STATE_NAME)
+        if serialized is not None:
+            # the fingerprint covers STATE_VERSION, so it's checked before
+            # the rest of the state is looked at:
+            fingerprint = json.loads(serialized)["config_fingerprint"]
+            if fingerprint == self.config_fingerprint:
+                return ReportState.from_json(serialized)
+            LOGGER.info("Configuration changed, rebuilding report state")
+        return ReportState(config_fingerprint=self.config_fingerprint)
+
+    def build(self, now: datetime.datetime) -> T_CURRENT_REPORT:
+        """Brings the state up to date and builds the report."""
+        config = self.report_builder_config
+        state = self.load_state()
+        watermark, positive_transfers, expenses = (
+            self.database.load_bank_actions_after(state.watermark)
+        )
+        LOGGER.info(
+            "Applying %d bank actions added after #%d",
+            len(positive_transfers) + len(expenses),
+            state.watermark,
+        )
+        state.report = state.report.merge(
+            reduce_bank_actions(
+                positive_transfers,
+                expenses,
+                config.account_labels,
+                config.category_index,
+            )
+        )
+        state.watermark = watermark
+        self.database.set_report_state(STATE_NAME, state.to_json(), now)
+        # the trailing month moves on, so dues paid in it are counted out of
+        # positive transfers read from the database each time:
+        return state.report.finish(
+            now,
+            config,
+            self.database.load_positive_transfers(since=now - MONTH),
+        )
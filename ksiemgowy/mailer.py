@@ -0,0 +1,54 @@
+"""Sends e-mails generated by ksiemgowy, reusing a single SMTP session for
+as many of them as possible."""
+
+import logging
+import smtplib
+import time
+import typing as T
+from email.message import Message
+
+import ksiemgowy.config
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def send_messages(
+    mail_config: ksiemgowy.config.MailConfig,
+    messages: T.Sequence[Message],
+    sleep: T.Callable[[float], None] = time.sleep,
+    on_sent: T.Optional[T.Callable[[int], None]] = None,
+) -> T.Dict[int, Exception]:
+    """Sends all messages over a single SMTP session, smtp_batch_size of them
+    at a time, waiting smtp_batch_interval seconds between the batches so
+    that we don't run into the provider's rate limits. on_sent is called with
+    message's index right after it was sent. Returns errors that happened
+    while sending specific messages, keyed by message's index."""
+    errors: T.Dict[int, Exception] = {}
+    if not messages:
+        return errors
+    batch_size = mail_config.smtp_batch_size
+    num_batches = (len(messages) + batch_size - 1) // batch_size
+    with mail_config.smtp_login() as server:
+        for batch_no, start in enumerate(range(0, len(messages), batch_size)):
+            if batch_no > 0:
+                sleep(mail_config.smtp_batch_interval)
+            end = start + batch_size
+            started = time.monotonic()
+            for i, msg in enumerate(messages[start:end], start):
+                try:
+                    server.send_message(msg)
+                except (smtplib.SMTPException, OSError) as err:
+                    LOGGER.exception(err)
+                    errors[i] = err
+                    continue
+                if on_sent is not None:
+                    on_sent(i)
+            LOGGER.info(
+                "Sent batch %d/%d (%d messages) in %.3fs",
+                batch_no + 1,
+                num_batches,
+                len(messages[start:end]),
+                time.monotonic() - started,
+            )
+    return errors
@@ -2,6 +2,7 @@
 
 """Parses mbank daily notification e-mails."""
 
+import io
 import re
 import argparse
 import dataclasses
@@ -10,12 +11,25 @@ import copy
 import hashlib
 import logging
 import datetime
+import email.parser
 
 from email.message import Message
-from typing import Dict, List
+from typing import (
+    BinaryIO,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Match,
+    Optional,
+    Pattern,
+    Protocol,
+    Tuple,
+    Union,
+)
 
 import dateutil.parser
-import lxml.html
+import lxml.etree
 
 
 INCOMING_RE = re.compile(
@@ -28,6 +42,38 @@ INCOMING_RE = re.compile(
     "Dost\\. (?P<balance>\\d+,\\d{2}) PLN$"
 )
 
+STANDING_ORDER_RE = re.compile(
+    "^mBank: Zlecenie stale"
+    " z rach\\. (?P<sender_acc_no>[0-9.]{8,14})"
+    " na rach\\. (?P<recipient_acc_no>[0-9.]{8,14})"
+    " kwota (?P<amount_pln>\\d+,\\d{2}) PLN"
+    " dla (?P<in_person>[^;]+); "
+    "(?P<in_desc>.+); "
+    "Dost\\. (?P<balance>\\d+,\\d{2}) PLN$"
+)
+
+CARD_PAYMENT_RE = re.compile(
+    "^mBank: Autoryz(?:acja|\\.) karty (?P<sender_acc_no>[0-9.]{4,19})"
+    " na kwote (?P<amount_pln>\\d+,\\d{2}) PLN"
+    " w (?P<in_person>[^;]+?)[.;] "
+    "Dost\\. (?P<balance>\\d+,\\d{2}) PLN$"
+)
+
+FEE_RE = re.compile(
+    "^mBank: Oplata (?P<in_desc>[^;]+?)"
+    " z rach\\. (?P<sender_acc_no>[0-9.]{8,14})"
+    " kwota (?P<amount_pln>\\d+,\\d{2}) PLN; "
+    "Dost\\. (?P<balance>\\d+,\\d{2}) PLN$"
+)
+
+# Compiled once, since parse_mbank_html is run for every e-mail:
+CELLS_XPATH = lxml.etree.XPath("./td")
+TEXT_XPATH = lxml.etree.XPath("./text()")
+
+# An empty line separates headers of a message from its body. MIME parts
+# without headers start with it.
+HEADERS_END_RE = re.compile("(?:\\A|\r?\n)\r?\n")
+
 
 def anonymize(hashed_string: str, mbank_anonymization_key: bytes) -> str:
     """Anonymizes an input string using mbank_anonymization_key as
@@ -37,6 +83,28 @@ def anonymize(hashed_string: str, mbank_anonymization_key: bytes) -> str:
     ).hexdigest()
 
 
+def parse_timestamp(timestamp: str) -> datetime.datetime:
+    """Parses a timestamp of an action. Ones generated by parse_mbank_html
+    are in ISO 8601 format, which is much faster to parse than going through
+    dateutil."""
+    try:
+        return datetime.datetime.fromisoformat(timestamp)
+    except ValueError:
+        return dateutil.parser.parse(timestamp)
+
+
+def to_grosze(amount_pln: float) -> int:
+    """Turns an amount in PLN into a whole number of grosze. Sums of those
+    are exact, so unlike sums of floats, they don't depend on the order in
+    which amounts are added up."""
+    return round(amount_pln * 100)
+
+
+def to_pln(amount_grosze: int) -> float:
+    """Reverses to_grosze."""
+    return amount_grosze / 100
+
+
 # pylint: disable=too-many-instance-attributes
 @dataclasses.dataclass
 class MbankAction:
@@ -50,6 +118,10 @@ class MbankAction:
     balance: float
     timestamp: str
     action_type: str
+    # parsed timestamp, filled in by get_timestamp or read from the database:
+    booked_at: Optional[datetime.datetime] = dataclasses.field(
+        default=None, compare=False, repr=False
+    )
 
     def anonymized(self, mbank_anonymization_key: bytes) -> "MbankAction":
         """Anonymizes all potentially sensitive fields using
@@ -63,63 +135,283 @@ class MbankAction:
 
     def get_timestamp(self) -> datetime.datetime:
         """Returns timestamp. This is there because we currently store the
-        timestamp as string for rather random reasons."""
-        return dateutil.parser.parse(self.timestamp)
+        timestamp as string for rather random reasons. It's parsed only
+        once, then kept in booked_at."""
+        if self.booked_at is None:
+            self.booked_at = parse_timestamp(self.timestamp)
+        return self.booked_at
 
     asdict = dataclasses.asdict
 
 
-def parse_mbank_html(mbank_html: bytes) -> Dict[str, List[MbankAction]]:
-    """Parses mBank .htm attachment file and generates a list of actions
-    that were derived from it."""
-    html = lxml.html.fromstring(mbank_html)
-    date = html.xpath("//h5/text()")[0].split(" - ")[0]
-    actions = []
-    rows = html.xpath("//tr")[2:]
-    logging.debug("len(rows)=%r", len(rows))
-    for row in rows:
-        desc_e = row.xpath(".//td[2]/text()")
-        if not desc_e:
+class BankAction(Protocol):
+    """Fields and methods of a bank action that reports and overdue checks
+    rely on. Implemented both by MbankAction and by the more compact
+    ActionRecord."""
+
+    # pylint: disable=too-few-public-methods
+    sender_acc_no: str
+    recipient_acc_no: str
+    amount_pln: float
+    in_person: str
+
+    def get_timestamp(self) -> datetime.datetime:
+        """Returns the time at which the action was booked."""
+
+
+class ActionRecord:
+    """A slotted counterpart of MbankAction that only carries what's needed
+    to build reports. Produced when iterating over an ActionBatch; it
+    takes a fraction of MbankAction's memory and its timestamp is already
+    parsed."""
+
+    __slots__ = (
+        "sender_acc_no",
+        "recipient_acc_no",
+        "amount_pln",
+        "in_person",
+        "booked_at",
+    )
+
+    def __init__(
+        self,
+        sender_acc_no: str,
+        recipient_acc_no: str,
+        amount_pln: float,
+        in_person: str,
+        booked_at: datetime.datetime,
+    ) -> None:
+        # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self.sender_acc_no = sender_acc_no
+        self.recipient_acc_no = recipient_acc_no
+        self.amount_pln = amount_pln
+        self.in_person = in_person
+        self.booked_at = booked_at
+
+    def __repr__(self) -> str:
+        return (
+            f"ActionRecord({self.sender_acc_no!r}, {self.recipient_acc_no!r},"
+            f" {self.amount_pln!r}, {self.in_person!r}, {self.booked_at!r})"
+        )
+
+    def get_timestamp(self) -> datetime.datetime:
+        """Returns timestamp, same as MbankAction.get_timestamp."""
+        return self.booked_at
+
+
+@dataclasses.dataclass(frozen=True)
+class ActionPattern:
+    """Describes one kind of operation found in mBank's notifications.
+    Descriptions starting with prefix are matched against regex, whose named
+    groups become fields of an MbankAction of the given action_type. Fields
+    that the regex doesn't capture are left empty."""
+
+    prefix: str
+    regex: Pattern[str]
+    action_type: str
+
+    def build(self, match: Match[str], timestamp: str) -> MbankAction:
+        """Turns a successful match into an MbankAction."""
+        fields = match.groupdict("")
+        return MbankAction(
+            sender_acc_no=fields.get("sender_acc_no", ""),
+            recipient_acc_no=fields.get("recipient_acc_no", ""),
+            amount_pln=float(fields["amount_pln"].replace(",", ".")),
+            in_person=fields.get("in_person", ""),
+            in_desc=fields.get("in_desc", ""),
+            balance=float(fields["balance"].replace(",", ".")),
+            timestamp=timestamp,
+            action_type=self.action_type,
+        )
+
+
+class ActionClassifier:
+    """A registry of ActionPatterns. Instead of trying every regex in turn,
+    a description is first looked up by its prefixes - one dict lookup per
+    distinct prefix length - and only the patterns registered under a
+    matching prefix are tried, in the order of registration. Adding
+    patterns with new prefixes doesn't make classification slower."""
+
+    def __init__(self, patterns: Iterable[ActionPattern] = ()) -> None:
+        self.patterns_by_prefix: Dict[str, List[ActionPattern]] = {}
+        self.prefix_lengths: List[int] = []
+        for pattern in patterns:
+            self.register(pattern)
+
+    def register(self, pattern: ActionPattern) -> None:
+        """Adds a pattern to the registry."""
+        self.patterns_by_prefix.setdefault(pattern.prefix, []).append(pattern)
+        if len(pattern.prefix) not in self.prefix_lengths:
+            self.prefix_lengths.append(len(pattern.prefix))
+            self.prefix_lengths.sort(reverse=True)
+
+    def find(self, desc: str) -> Optional[Tuple[ActionPattern, Match[str]]]:
+        """Returns the first pattern that matches desc, together with the
+        match, or None if there's none. Longer prefixes are tried first."""
+        for length in self.prefix_lengths:
+            for pattern in self.patterns_by_prefix.get(desc[:length], ()):
+                match = pattern.regex.match(desc)
+                if match:
+                    return pattern, match
+        return None
+
+
+CLASSIFIER = ActionClassifier(
+    [
+        ActionPattern("mBank: Przelew przych.", INCOMING_RE, "in_transfer"),
+        ActionPattern("mBank: Przelew wych.", INCOMING_RE, "out_transfer"),
+        ActionPattern(
+            "mBank: Zlecenie stale", STANDING_ORDER_RE, "standing_order"
+        ),
+        ActionPattern("mBank: Autoryz", CARD_PAYMENT_RE, "card_payment"),
+        ActionPattern("mBank: Oplata", FEE_RE, "fee"),
+    ]
+)
+
+
+def parse_mbank_row(
+    row: lxml.etree._Element,
+    date: Optional[str],
+    is_debug: bool,
+    classifier: ActionClassifier = CLASSIFIER,
+) -> Optional[MbankAction]:
+    """Turns a table row into an MbankAction, provided that it describes
+    one. Such rows have two cells: time of the operation and its
+    description, which is classified using classifier."""
+    cells = CELLS_XPATH(row)
+    desc_e = TEXT_XPATH(cells[1]) if len(cells) > 1 else []
+    if not desc_e:
+        if is_debug:
             logging.debug("Missing desc_e, skipping")
-            continue
-        desc_s = desc_e[0].strip().replace("\n", "")
+        return None
+    desc_s = desc_e[0].strip().replace("\n", "")
+    if is_debug:
         logging.debug("desc_s=%r", desc_s)
-        time = row.xpath(".//td[1]")[0].text_content().strip()
-        match = INCOMING_RE.match(desc_s)
-        if not match:
+    found = classifier.find(desc_s)
+    if found is None:
+        return None
+    pattern, match = found
+    time = "".join(cells[0].itertext()).strip()
+    return pattern.build(match, f"{date} {time}")
+
+
+def gen_mbank_actions(
+    mbank_html: Union[bytes, BinaryIO],
+    classifier: ActionClassifier = CLASSIFIER,
+) -> Iterator[MbankAction]:
+    """Parses mBank .htm attachment file incrementally, yielding actions as
+    soon as their rows are read. Rows that were already looked at are
+    removed from the tree, so memory usage doesn't grow with the size of
+    the statement. The date of the statement is taken from its first
+    <h5> header and the first two rows (addresses of the bank and the
+    recipient) are skipped. Rows are turned into actions by classifier."""
+    if isinstance(mbank_html, bytes):
+        mbank_html = io.BytesIO(mbank_html)
+    is_debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+    date = None
+    num_rows = 0
+    for _, elem in lxml.etree.iterparse(
+        mbank_html, events=("end",), tag=("h5", "tr"), html=True
+    ):
+        if elem.tag == "h5":
+            if date is None and elem.text:
+                date = elem.text.split(" - ")[0]
             continue
-        action = {}
-        action.update(match.groupdict())
-        action["action_type"] = {
-            "przych": "in_transfer",
-            "wych": "out_transfer",
-        }.get(action["action_type"], "other")
-        action["amount_pln"] = action["amount_pln"].replace(",", ".")
-        action["balance"] = action["balance"].replace(",", ".")
-        actions.append(
-            MbankAction(
-                sender_acc_no=action["sender_acc_no"],
-                recipient_acc_no=action["recipient_acc_no"],
-                amount_pln=float(action["amount_pln"]),
-                in_person=action["in_person"],
-                in_desc=action["in_desc"],
-                balance=float(action["balance"]),
-                timestamp=f"{date} {time}",
-                action_type=action["action_type"],
-            )
-        )
-    return {"actions": actions}
+        num_rows += 1
+        if num_rows > 2:
+            action = parse_mbank_row(elem, date, is_debug, classifier)
+            if action is not None:
+                yield action
+        elem.clear(keep_tail=True)
+        parent = elem.getparent()
+        while elem.getprevious() is not None and parent is not None:
+            del parent[0]
+    if is_debug:
+        logging.debug("num_rows=%r", num_rows)
+
+
+def parse_mbank_html(mbank_html: bytes) -> Dict[str, List[MbankAction]]:
+    """Parses mBank .htm attachment file and generates a list of actions
+    that were derived from it."""
+    return {"actions": list(gen_mbank_actions(mbank_html))}
+
+
+def parse_headers_only(text: str) -> Message:
+    """Parses the header block of a message or a MIME part. The rest of the
+    text becomes message's payload as it is, without being looked at."""
+    match = HEADERS_END_RE.search(text)
+    headers_end = match.end() if match else len(text)
+    msg = email.parser.HeaderParser().parsestr(text[:headers_end])
+    msg.set_payload(text[headers_end:])
+    return msg
+
+
+def lazy_message_from_bytes(raw: bytes) -> Message:
+    """Parses headers of an e-mail, leaving its body as it is. MIME parts
+    of such a message are only split and parsed once parse_mbank_email
+    gets to them."""
+    # that's what email.parser.BytesParser does, too:
+    return parse_headers_only(raw.decode("ascii", "surrogateescape"))
+
+
+def gen_mime_subparts(msg: Message) -> Iterator[Message]:
+    """Yields parts of a multipart message. If the message came from
+    lazy_message_from_bytes, its body is split one part at a time and only
+    headers of each part are parsed - payloads aren't touched."""
+    if msg.is_multipart():
+        for part in msg.get_payload():
+            if isinstance(part, Message):
+                yield part
+        return
+    body = msg.get_payload()
+    boundary = msg.get_boundary()
+    if boundary is None or not isinstance(body, str):
+        return
+    # RFC 2046 only allows transport padding after the boundary, so lines
+    # that merely start with it aren't delimiters:
+    delimiter_re = re.compile(
+        "^--" + re.escape(boundary) + "(--)?[ \t]*\r?$", re.MULTILINE
+    )
+    start = None
+    for match in delimiter_re.finditer(body):
+        if start is not None:
+            # the line break before a delimiter is a part of it:
+            end = max(start, match.start() - 1)
+            part = body[start:end]
+            if part.endswith("\r"):
+                part = part[:-1]
+            yield parse_headers_only(part)
+        if match.group(1):
+            return  # that was the closing delimiter
+        start = match.end() + 1
+    if start is not None and start <= len(body):
+        part = body[start:]
+        if part.endswith("\r"):
+            part = part[:-1]
+        yield parse_headers_only(part)
+
+
+def gen_html_attachments(msg: Message) -> Iterator[bytes]:
+    """Yields decoded contents of all HTML attachments of an e-mail, in the
+    order in which they appear. Payloads of other parts aren't decoded."""
+    if msg.get_content_maintype() == "multipart":
+        for part in gen_mime_subparts(msg):
+            yield from gen_html_attachments(part)
+        return
+    if msg.get_content_type() != "text/html" or msg.get_param("name") is None:
+        return
+    payload = msg.get_payload(decode=True)
+    if isinstance(payload, bytes):
+        yield payload
 
 
 def parse_mbank_email(msg: Message) -> Dict[str, List[MbankAction]]:
     """Finds attachment with mBank account update in an .eml mBank email,
-    then behaves like parse_mbank_html."""
+    then behaves like parse_mbank_html. msg may come either from one of the
+    email.message_from_* functions or from lazy_message_from_bytes."""
     parsed = {}
-    for part in msg.walk():
-        params = dict(part.get_params())
-        if "name" not in params or part.get_content_type() != "text/html":
-            continue
-        parsed = parse_mbank_html(part.get_payload(decode=True))
+    for attachment in gen_html_attachments(msg):
+        parsed = parse_mbank_html(attachment)
         if parsed["actions"]:
             break
     return parsed
@@ -3,25 +3,84 @@
 # This is here because we're accessing _mapping attribute of a row object
 # pylint: disable=protected-access
 
+import contextlib
 import logging
 import datetime
-from typing import Dict, Iterator, Optional
+import threading
+from dataclasses import dataclass
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
 
 import sqlalchemy
 
-import ksiemgowy.mbankmail
-from ksiemgowy.mbankmail import MbankAction
+from ksiemgowy.action_batch import ActionBatch
+from ksiemgowy.mbankmail import MbankAction, parse_timestamp, to_grosze
 
 LOGGER = logging.getLogger(__name__)
 
 
+@dataclass(frozen=True)
+class OutgoingMail:
+    """A rendered e-mail waiting in the outbox. idempotency_key makes sure
+    that the same notification is never queued twice."""
+
+    idempotency_key: str
+    sender: str
+    message: str
+
+
+@dataclass(frozen=True)
+class OutboxEntry:
+    """An e-mail that was taken out of the outbox in order to be sent."""
+
+    entry_id: int
+    message: str
+    attempts: int
+
+
+@dataclass(frozen=True)
+class MonthlyTotal:
+    """Sum of bank actions of a given month that share the same accounts
+    and, in case of expenses, amounts. Fields that weren't grouped by are
+    None. Amounts of expenses are positive. The sum is in grosze, so that
+    it's exact."""
+
+    month: str
+    recipient_acc_no: str
+    sender_acc_no: Optional[str]
+    amount_pln: Optional[float]
+    total_grosze: int
+    last_booked_at: datetime.datetime
+
+
 class KsiemgowyDB:
     """A class that groups together all models that describe the state of
-    ksiemgowy."""
+    ksiemgowy. It's safe to use from multiple threads - all access to the
+    database is serialized."""
+
+    # pylint: disable=too-many-instance-attributes,too-many-public-methods
 
     def __init__(self, database_uri: str) -> None:
         """Initializes the database, creating tables if they don't exist."""
-        self.database = sqlalchemy.create_engine(database_uri)
+        connect_args = {}
+        if database_uri.startswith("sqlite"):
+            # we share a single connection between threads, guarding it
+            # with self.lock:
+            connect_args["check_same_thread"] = False
+        self.database = sqlalchemy.create_engine(
+            database_uri, connect_args=connect_args
+        )
+        self.lock = threading.RLock()
         metadata = sqlalchemy.MetaData()
 
         self.bank_actions = sqlalchemy.Table(
@@ -36,16 +95,26 @@ class KsiemgowyDB:
             sqlalchemy.Column("balance", sqlalchemy.Float),
             sqlalchemy.Column("timestamp", sqlalchemy.String),
             sqlalchemy.Column("action_type", sqlalchemy.String),
+            sqlalchemy.Column("booked_at", sqlalchemy.DateTime, index=True),
+            # these match the ways in which reports and overdue checks look
+            # up bank actions - by account and by type, ordered by time:
+            sqlalchemy.Index(
+                "ix_bank_actions_sender_acc_no_booked_at",
+                "sender_acc_no",
+                "booked_at",
+            ),
+            sqlalchemy.Index(
+                "ix_bank_actions_recipient_acc_no_booked_at",
+                "recipient_acc_no",
+                "booked_at",
+            ),
+            sqlalchemy.Index(
+                "ix_bank_actions_action_type_booked_at",
+                "action_type",
+                "booked_at",
+            ),
         )
 
-        try:
-            self.bank_actions.create(bind=self.database)
-        except (
-            sqlalchemy.exc.OperationalError,
-            sqlalchemy.exc.ProgrammingError,
-        ):
-            pass
-
         self.sender_acc_no_to_email = sqlalchemy.Table(
             "sender_acc_no_to_email",
             metadata,
@@ -73,46 +142,331 @@ class KsiemgowyDB:
             sqlalchemy.Column("imap_id", sqlalchemy.String, unique=True),
         )
 
-        try:
-            self.sender_acc_no_to_email.create(bind=self.database)
-        except (
-            sqlalchemy.exc.OperationalError,
-            sqlalchemy.exc.ProgrammingError,
-        ):
-            pass
+        self.imap_sync_state = sqlalchemy.Table(
+            "imap_sync_state",
+            metadata,
+            sqlalchemy.Column("mailbox", sqlalchemy.String, primary_key=True),
+            sqlalchemy.Column("uidvalidity", sqlalchemy.BigInteger),
+            sqlalchemy.Column("last_uid", sqlalchemy.BigInteger),
+        )
 
-        try:
-            self.observed_email_ids.create(bind=self.database)
-        except (
-            sqlalchemy.exc.OperationalError,
-            sqlalchemy.exc.ProgrammingError,
-        ):
-            pass
+        self.outbox = sqlalchemy.Table(
+            "outbox",
+            metadata,
+            sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+            sqlalchemy.Column(
+                "idempotency_key", sqlalchemy.String, unique=True
+            ),
+            sqlalchemy.Column("sender", sqlalchemy.String, index=True),
+            sqlalchemy.Column("message", sqlalchemy.Text),
+            sqlalchemy.Column("created_at", sqlalchemy.DateTime),
+            sqlalchemy.Column("attempts", sqlalchemy.Integer, default=0),
+            sqlalchemy.Column("next_attempt_at", sqlalchemy.DateTime),
+            sqlalchemy.Column("sent_at", sqlalchemy.DateTime),
+            sqlalchemy.Column("last_error", sqlalchemy.String),
+        )
+
+        # sums of bank_actions, as returned by sum_bank_actions_by_month,
+        # kept up to date by add_bank_actions:
+        self.monthly_aggregates = sqlalchemy.Table(
+            "monthly_aggregates",
+            metadata,
+            sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+            sqlalchemy.Column("is_positive", sqlalchemy.Boolean),
+            sqlalchemy.Column("month", sqlalchemy.String),
+            sqlalchemy.Column("recipient_acc_no", sqlalchemy.String),
+            sqlalchemy.Column("sender_acc_no", sqlalchemy.String),
+            sqlalchemy.Column("amount_pln", sqlalchemy.Float),
+            sqlalchemy.Column("total_grosze", sqlalchemy.BigInteger),
+            sqlalchemy.Column("last_booked_at", sqlalchemy.DateTime),
+            sqlalchemy.Index(
+                "ix_monthly_aggregates_key",
+                "is_positive",
+                "month",
+                "recipient_acc_no",
+                "sender_acc_no",
+                "amount_pln",
+            ),
+        )
+
+        # state of ksiemgowy.incremental_report_builder, serialized:
+        self.report_state = sqlalchemy.Table(
+            "report_state",
+            metadata,
+            sqlalchemy.Column("name", sqlalchemy.String, primary_key=True),
+            sqlalchemy.Column("state", sqlalchemy.Text),
+            sqlalchemy.Column("updated_at", sqlalchemy.DateTime),
+        )
+
+        self.schema_version = sqlalchemy.Table(
+            "schema_version",
+            metadata,
+            sqlalchemy.Column("version", sqlalchemy.Integer, primary_key=True),
+            sqlalchemy.Column("applied_at", sqlalchemy.DateTime),
+        )
 
+        self.metadata = metadata
+        self.migrate()
         self.connection = self.database.connect()
 
-    def was_imap_id_already_handled(self, imap_id: str) -> bool:
-        """Tells whether a given IMAP ID was already processed by ksiemgowy."""
-        with self.connection.begin():
-            entries = self.connection.execute(
-                self.observed_email_ids.select().where(
-                    self.observed_email_ids.c.imap_id == imap_id
+    def get_schema_version(self, connection: sqlalchemy.Connection) -> int:
+        """Returns the version of the database schema, as recorded in the
+        schema_version table."""
+        version: Optional[int] = connection.execute(
+            sqlalchemy.select(self.schema_version.c.version)
+            .order_by(self.schema_version.c.version.desc())
+            .limit(1)
+        ).scalar()
+        return version or 0
+
+    def migrate(self) -> None:
+        """Brings the database schema up to date. Tables that don't exist
+        yet are created as described above. If the database was created
+        by an earlier version of ksiemgowy, MIGRATIONS that weren't applied
+        yet are run in order, each one recorded in schema_version in the same
+        transaction as its changes."""
+        with self.database.begin() as connection:
+            is_new = not sqlalchemy.inspect(connection).has_table(
+                "bank_actions"
+            )
+            self.metadata.create_all(connection)
+            if is_new:
+                connection.execute(
+                    self.schema_version.insert(),
+                    {
+                        "version": len(MIGRATIONS),
+                        "applied_at": datetime.datetime.now(),
+                    },
                 )
-            ).fetchone()
-            return bool(entries)
+                return
+            version = self.get_schema_version(connection)
+        for new_version, migration in enumerate(
+            MIGRATIONS[version:], start=version + 1
+        ):
+            LOGGER.info(
+                "Migrating to version %d: %s", new_version, migration.__name__
+            )
+            with self.database.begin() as connection:
+                migration(self, connection)
+                connection.execute(
+                    self.schema_version.insert(),
+                    {
+                        "version": new_version,
+                        "applied_at": datetime.datetime.now(),
+                    },
+                )
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[None]:
+        """Begins a transaction, making sure that no other thread uses the
+        connection until it's finished."""
+        with self.lock, self.connection.begin():
+            yield
+
+    def _enqueue_mail(
+        self, mail: OutgoingMail, now: datetime.datetime
+    ) -> None:
+        """Puts an e-mail into the outbox, unless one with the same
+        idempotency key is already there. Needs to be called within
+        a transaction."""
+        existing = self.connection.execute(
+            self.outbox.select().where(
+                self.outbox.c.idempotency_key == mail.idempotency_key
+            )
+        ).fetchone()
+        if existing is not None:
+            LOGGER.info("%r is already queued", mail.idempotency_key)
+            return
+        self.connection.execute(
+            self.outbox.insert(),
+            {
+                "idempotency_key": mail.idempotency_key,
+                "sender": mail.sender,
+                "message": mail.message,
+                "created_at": now,
+                "attempts": 0,
+                "next_attempt_at": now,
+            },
+        )
+
+    def enqueue_mail(
+        self, mail: OutgoingMail, now: datetime.datetime
+    ) -> None:
+        """Puts an e-mail into the outbox, unless one with the same
+        idempotency key is already there."""
+        with self._transaction():
+            self._enqueue_mail(mail, now)
+
+    def list_pending_mail(
+        self, sender: str, now: datetime.datetime, max_attempts: int
+    ) -> List[OutboxEntry]:
+        """Lists e-mails from a given sender that are due to be sent."""
+        cols = self.outbox.c
+        with self._transaction():
+            return [
+                OutboxEntry(
+                    entry_id=row["id"],
+                    message=row["message"],
+                    attempts=row["attempts"],
+                )
+                for row in self.connection.execute(
+                    self.outbox.select()
+                    .where(
+                        sqlalchemy.and_(
+                            cols.sender == sender,
+                            cols.sent_at.is_(None),
+                            cols.attempts < max_attempts,
+                            cols.next_attempt_at <= now,
+                        )
+                    )
+                    .order_by(cols.id)
+                ).mappings()
+            ]
+
+    def mark_mail_sent(self, entry_id: int, now: datetime.datetime) -> None:
+        """Marks an outbox entry as successfully sent."""
+        with self._transaction():
+            self.connection.execute(
+                self.outbox.update()
+                .where(self.outbox.c.id == entry_id)
+                .values(sent_at=now)
+            )
 
-    def mark_imap_id_already_handled(self, imap_id: str) -> None:
-        """Marks a given IMAP ID as already processed by ksiemgowy."""
-        LOGGER.debug("mark_imap_id_already_handled(%r)", imap_id)
-        with self.connection.begin():
+    def mark_mail_failed(
+        self,
+        entry_id: int,
+        error: str,
+        next_attempt_at: datetime.datetime,
+    ) -> None:
+        """Records a failed attempt to send an outbox entry."""
+        cols = self.outbox.c
+        with self._transaction():
+            self.connection.execute(
+                self.outbox.update()
+                .where(cols.id == entry_id)
+                .values(
+                    attempts=cols.attempts + 1,
+                    last_error=error,
+                    next_attempt_at=next_attempt_at,
+                )
+            )
+
+    def list_handled_imap_ids(self) -> Set[str]:
+        """Returns all IMAP IDs that were already processed by ksiemgowy."""
+        with self._transaction():
+            return set(
+                self.connection.execute(
+                    sqlalchemy.select(self.observed_email_ids.c.imap_id)
+                ).scalars()
+            )
+
+    def _filter_handled_imap_ids(self, imap_ids: Set[str]) -> Set[str]:
+        """Returns those of given IMAP IDs that were already processed by
+        ksiemgowy. Needs to be called within a transaction."""
+        if not imap_ids:
+            return set()
+        cols = self.observed_email_ids.c
+        return set(
             self.connection.execute(
-                self.observed_email_ids.insert(), {"imap_id": imap_id}
+                sqlalchemy.select(cols.imap_id).where(
+                    cols.imap_id.in_(imap_ids)
+                )
+            ).scalars()
+        )
+
+    def filter_handled_imap_ids(self, imap_ids: Iterable[str]) -> Set[str]:
+        """Returns those of given IMAP IDs that were already processed by
+        ksiemgowy, without loading all of the others."""
+        with self._transaction():
+            return self._filter_handled_imap_ids(set(imap_ids))
+
+    def _mark_imap_ids_already_handled(self, imap_ids: Iterable[str]) -> None:
+        """Marks given IMAP IDs as already processed by ksiemgowy, skipping
+        the ones that already were. Needs to be called within
+        a transaction."""
+        new_ids = set(imap_ids)
+        if not new_ids:
+            return
+        LOGGER.debug("mark_imap_ids_already_handled(%r)", new_ids)
+        new_ids -= self._filter_handled_imap_ids(new_ids)
+        if new_ids:
+            self.connection.execute(
+                self.observed_email_ids.insert(),
+                [{"imap_id": imap_id} for imap_id in sorted(new_ids)],
+            )
+
+    def mark_imap_ids_already_handled(self, imap_ids: Iterable[str]) -> None:
+        """Marks given IMAP IDs as already processed by ksiemgowy, using
+        a single INSERT. IDs that were already marked are skipped."""
+        with self._transaction():
+            self._mark_imap_ids_already_handled(imap_ids)
+
+    def get_imap_sync_state(self, mailbox: str) -> Optional[Tuple[int, int]]:
+        """Returns a pair (uidvalidity, last_uid) describing how far a given
+        mailbox was already processed, or None if it never was."""
+        with self._transaction():
+            row = self.connection.execute(
+                self.imap_sync_state.select().where(
+                    self.imap_sync_state.c.mailbox == mailbox
+                )
+            ).fetchone()
+            if row is None:
+                return None
+            return row._mapping["uidvalidity"], row._mapping["last_uid"]
+
+    def set_imap_sync_state(
+        self, mailbox: str, uidvalidity: int, last_uid: int
+    ) -> None:
+        """Records that a given mailbox was processed up to last_uid."""
+        cols = self.imap_sync_state.c
+        with self._transaction():
+            result = self.connection.execute(
+                self.imap_sync_state.update()
+                .where(cols.mailbox == mailbox)
+                .values(uidvalidity=uidvalidity, last_uid=last_uid)
+            )
+            if result.rowcount == 0:
+                self.connection.execute(
+                    self.imap_sync_state.insert(),
+                    {
+                        "mailbox": mailbox,
+                        "uidvalidity": uidvalidity,
+                        "last_uid": last_uid,
+                    },
+                )
+
+    def get_report_state(self, name: str) -> Optional[str]:
+        """Returns the report state saved under a given name, or None if
+        there's none."""
+        with self._transaction():
+            state: Optional[str] = self.connection.execute(
+                sqlalchemy.select(self.report_state.c.state).where(
+                    self.report_state.c.name == name
+                )
+            ).scalar()
+            return state
+
+    def set_report_state(
+        self, name: str, state: str, now: datetime.datetime
+    ) -> None:
+        """Saves report state under a given name, replacing the old one."""
+        cols = self.report_state.c
+        with self._transaction():
+            result = self.connection.execute(
+                self.report_state.update()
+                .where(cols.name == name)
+                .values(state=state, updated_at=now)
             )
+            if result.rowcount == 0:
+                self.connection.execute(
+                    self.report_state.insert(),
+                    {"name": name, "state": state, "updated_at": now},
+                )
 
     def get_email_for_sender_acc_no(self, sender_acc_no: str) -> Optional[str]:
         """Returns an e-mail address for a given sender_acc_no."""
 
-        with self.connection.begin():
+        with self._transaction():
             row = self.connection.execute(
                 self.sender_acc_no_to_email.select().where(
                     self.sender_acc_no_to_email.c.sender_acc_no == sender_acc_no
@@ -131,7 +485,7 @@ class KsiemgowyDB:
         notified."""
         ret = {}
         cols = self.sender_acc_no_to_email.c
-        with self.connection.begin():
+        with self._transaction():
             for entry in self.connection.execute(
                 self.sender_acc_no_to_email.select().where(
                     sqlalchemy.or_(
@@ -145,13 +499,39 @@ class KsiemgowyDB:
 
             return ret
 
+    def list_latest_payments(
+        self, paid_after: datetime.datetime, paid_before: datetime.datetime
+    ) -> Dict[str, datetime.datetime]:
+        """Returns senders whose most recent positive transfer was booked
+        between paid_after and paid_before, together with its time. Only
+        transfers booked after paid_after are looked at, which makes it a
+        range scan of the booked_at index."""
+        cols = self.bank_actions.c
+        paid_at = sqlalchemy.func.max(cols.booked_at).label("paid_at")
+        ret = {}
+        with self._transaction():
+            for row in self.connection.execute(
+                sqlalchemy.select(cols.sender_acc_no, paid_at)
+                .where(cols.booked_at > paid_after, cols.amount_pln > 0)
+                .group_by(cols.sender_acc_no)
+                .having(paid_at < paid_before)
+            ):
+                ret[row.sender_acc_no] = row.paid_at
+        return ret
+
     def postpone_next_notification(
-        self, sender_acc_no: str, now: datetime.datetime
+        self,
+        sender_acc_no: str,
+        now: datetime.datetime,
+        notification: Optional[OutgoingMail] = None,
     ) -> None:
         """Postpone next overdue notification for an account with a given
-        sender_acc_no."""
+        sender_acc_no. If notification is given, it's put in the outbox
+        within the same transaction."""
         cols = self.sender_acc_no_to_email.c
-        with self.connection.begin():
+        with self._transaction():
+            if notification is not None:
+                self._enqueue_mail(notification, now)
             row = self.connection.execute(
                 self.sender_acc_no_to_email.select().where(
                     cols.sender_acc_no == sender_acc_no
@@ -171,43 +551,449 @@ class KsiemgowyDB:
                 .values(notify_overdue_no_earlier_than=new_date)
             )
 
+    def _amount_sign_filter(
+        self, is_positive: bool
+    ) -> sqlalchemy.ColumnElement[bool]:
+        """Selects either positive transfers or expenses, which are stored
+        with negative amounts."""
+        if is_positive:
+            return self.bank_actions.c.amount_pln > 0
+        return self.bank_actions.c.amount_pln < 0
+
+    def _select_actions(self, is_positive: bool) -> List[Tuple[Any, ...]]:
+        """Returns all positive transfers or all expenses, as tuples of
+        MbankAction's fields. Rows are fetched up front so that the lock
+        isn't held while the caller iterates."""
+        cols = self.bank_actions.c
+        with self._transaction():
+            return [
+                tuple(row)
+                for row in self.connection.execute(
+                    sqlalchemy.select(
+                        *[column for column in cols if column.name != "id"]
+                    ).where(self._amount_sign_filter(is_positive))
+                )
+            ]
+
+    def _load_action_batch(
+        self,
+        is_positive: bool,
+        since: Optional[datetime.datetime],
+        *conditions: sqlalchemy.ColumnElement[bool],
+    ) -> ActionBatch:
+        """Reads columns needed by reports straight into an ActionBatch.
+        If since is given, only actions booked since then are read; so are
+        only the ones that meet any further conditions."""
+        cols = self.bank_actions.c
+        query = sqlalchemy.select(
+            cols.sender_acc_no,
+            cols.recipient_acc_no,
+            cols.amount_pln,
+            cols.in_person,
+            cols.booked_at,
+            cols.timestamp,
+        ).where(self._amount_sign_filter(is_positive), *conditions)
+        if since is not None:
+            query = query.where(cols.booked_at >= since)
+        with self._transaction():
+            return ActionBatch.from_rows(
+                self.connection.execute(query.order_by(cols.id)),
+                amount_sign=1.0 if is_positive else -1.0,
+            )
+
+    def load_bank_actions(
+        self,
+        booked_since: Optional[datetime.datetime] = None,
+        booked_before: Optional[datetime.datetime] = None,
+        acc_no: Optional[str] = None,
+    ) -> Tuple[ActionBatch, ActionBatch]:
+        """Returns a tuple (positive_transfers, expenses) of bank actions
+        booked in a given period, in the order in which they were added. If
+        acc_no is given, only positive transfers to that account and
+        expenses from it are returned. Amounts of expenses are positive."""
+        cols = self.bank_actions.c
+        positive_conditions = []
+        if booked_before is not None:
+            positive_conditions.append(cols.booked_at < booked_before)
+        expense_conditions = list(positive_conditions)
+        if acc_no is not None:
+            positive_conditions.append(cols.recipient_acc_no == acc_no)
+            expense_conditions.append(cols.sender_acc_no == acc_no)
+        return (
+            self._load_action_batch(True, booked_since, *positive_conditions),
+            self._load_action_batch(False, booked_since, *expense_conditions),
+        )
+
+    def list_booked_years(self) -> List[int]:
+        """Returns years in which bank actions were booked, in order."""
+        year = sqlalchemy.extract("year", self.bank_actions.c.booked_at)
+        with self._transaction():
+            return [
+                int(row[0])
+                for row in self.connection.execute(
+                    sqlalchemy.select(year).distinct().order_by(year)
+                )
+            ]
+
+    def list_own_accounts(self) -> List[str]:
+        """Returns our accounts, as seen in bank actions - recipients of
+        positive transfers and senders of expenses - in order."""
+        cols = self.bank_actions.c
+        query = sqlalchemy.union(
+            sqlalchemy.select(cols.recipient_acc_no).where(
+                self._amount_sign_filter(True)
+            ),
+            sqlalchemy.select(cols.sender_acc_no).where(
+                self._amount_sign_filter(False)
+            ),
+        )
+        with self._transaction():
+            return sorted(
+                row[0] for row in self.connection.execute(query)
+            )
+
+    def load_bank_actions_after(
+        self, last_id: int
+    ) -> Tuple[int, ActionBatch, ActionBatch]:
+        """Returns a tuple (new_last_id, positive_transfers, expenses)
+        describing bank actions added after the one with a given id, in the
+        order in which they were added. new_last_id is the id of the last
+        of them, or last_id if there are none. Amounts of expenses are
+        positive."""
+        cols = self.bank_actions.c
+        positive_transfers = ActionBatch()
+        expenses = ActionBatch()
+        with self._transaction():
+            rows = self.connection.execute(
+                sqlalchemy.select(
+                    cols.id,
+                    cols.sender_acc_no,
+                    cols.recipient_acc_no,
+                    cols.amount_pln,
+                    cols.in_person,
+                    cols.booked_at,
+                    cols.timestamp,
+                )
+                .where(cols.id > last_id)
+                .order_by(cols.id)
+            )
+            for row in rows:
+                row_id, sender, recipient, amount, person, booked_at, ts = row
+                if booked_at is None:
+                    booked_at = parse_timestamp(ts)
+                if amount > 0:
+                    positive_transfers.append_row(
+                        sender, recipient, amount, person, booked_at
+                    )
+                elif amount < 0:
+                    expenses.append_row(
+                        sender, recipient, -amount, person, booked_at
+                    )
+                last_id = row_id
+        return last_id, positive_transfers, expenses
+
+    def _sum_bank_actions_by_month(
+        self, connection: sqlalchemy.Connection, is_positive: bool
+    ) -> List[MonthlyTotal]:
+        """Implements sum_bank_actions_by_month using a given connection."""
+        cols = self.bank_actions.c
+        year = sqlalchemy.extract("year", cols.booked_at)
+        month = sqlalchemy.extract("month", cols.booked_at)
+        group_by = [year, month, cols.recipient_acc_no]
+        if not is_positive:
+            group_by += [cols.sender_acc_no, cols.amount_pln]
+        sign = 1 if is_positive else -1
+        grosze = sqlalchemy.cast(
+            sqlalchemy.func.round(cols.amount_pln * 100), sqlalchemy.BigInteger
+        )
+        rows = connection.execute(
+            sqlalchemy.select(
+                *group_by,
+                sqlalchemy.cast(
+                    sqlalchemy.func.sum(grosze), sqlalchemy.BigInteger
+                ),
+                sqlalchemy.func.max(cols.booked_at),
+            )
+            .where(self._amount_sign_filter(is_positive))
+            .group_by(*group_by)
+        ).all()
+        return [
+            MonthlyTotal(
+                month=f"{int(row[0])}-{int(row[1]):02d}",
+                recipient_acc_no=row[2],
+                sender_acc_no=None if is_positive else row[3],
+                amount_pln=None if is_positive else sign * row[4],
+                total_grosze=sign * int(row[-2]),
+                last_booked_at=row[-1],
+            )
+            for row in rows
+        ]
+
+    def sum_bank_actions_by_month(
+        self, is_positive: bool
+    ) -> List[MonthlyTotal]:
+        """Sums up all positive transfers or all expenses in the database,
+        grouping them by month and recipient. Expenses are also grouped by
+        sender and amount, so that their categories can be told."""
+        with self._transaction():
+            return self._sum_bank_actions_by_month(
+                self.connection, is_positive
+            )
+
+    def list_monthly_aggregates(
+        self, is_positive: bool
+    ) -> List[MonthlyTotal]:
+        """Returns the same as sum_bank_actions_by_month, but reads it from
+        the monthly_aggregates table instead of going through all bank
+        actions."""
+        cols = self.monthly_aggregates.c
+        with self._transaction():
+            rows = self.connection.execute(
+                sqlalchemy.select(
+                    cols.month,
+                    cols.recipient_acc_no,
+                    cols.sender_acc_no,
+                    cols.amount_pln,
+                    cols.total_grosze,
+                    cols.last_booked_at,
+                ).where(cols.is_positive == is_positive)
+            ).all()
+        return [MonthlyTotal(*row) for row in rows]
+
+    def _update_monthly_aggregates(
+        self, rows: Iterable[Dict[str, Any]]
+    ) -> None:
+        """Adds bank actions, given as rows of bank_actions, to
+        monthly_aggregates. Needs to be called within a transaction."""
+        totals: Dict[Tuple[Any, ...], List[Any]] = {}
+        for row in rows:
+            is_positive = row["amount_pln"] > 0
+            booked_at = row["booked_at"]
+            key = (
+                is_positive,
+                f"{booked_at.year}-{booked_at.month:02d}",
+                row["recipient_acc_no"],
+                None if is_positive else row["sender_acc_no"],
+                None if is_positive else -row["amount_pln"],
+            )
+            total = totals.setdefault(key, [0, booked_at])
+            total[0] += to_grosze(abs(row["amount_pln"]))
+            total[1] = max(total[1], booked_at)
+        cols = self.monthly_aggregates.c
+        key_columns = [
+            cols.is_positive,
+            cols.month,
+            cols.recipient_acc_no,
+            cols.sender_acc_no,
+            cols.amount_pln,
+        ]
+        for key, (total_grosze, last_booked_at) in totals.items():
+            # comparisons with None become IS NULL:
+            condition = sqlalchemy.and_(
+                *[column == value for column, value in zip(key_columns, key)]
+            )
+            updated = self.connection.execute(
+                self.monthly_aggregates.update()
+                .where(condition)
+                .values(
+                    total_grosze=cols.total_grosze + total_grosze,
+                    last_booked_at=sqlalchemy.case(
+                        (cols.last_booked_at < last_booked_at, last_booked_at),
+                        else_=cols.last_booked_at,
+                    ),
+                )
+            )
+            if updated.rowcount == 0:
+                self.connection.execute(
+                    self.monthly_aggregates.insert(),
+                    {
+                        **{
+                            column.name: value
+                            for column, value in zip(key_columns, key)
+                        },
+                        "total_grosze": total_grosze,
+                        "last_booked_at": last_booked_at,
+                    },
+                )
+
+    def _rebuild_monthly_aggregates(
+        self, connection: sqlalchemy.Connection
+    ) -> None:
+        """Implements rebuild_monthly_aggregates using a given connection."""
+        connection.execute(self.monthly_aggregates.delete())
+        rows = [
+            {
+                "is_positive": is_positive,
+                "month": total.month,
+                "recipient_acc_no": total.recipient_acc_no,
+                "sender_acc_no": total.sender_acc_no,
+                "amount_pln": total.amount_pln,
+                "total_grosze": total.total_grosze,
+                "last_booked_at": total.last_booked_at,
+            }
+            for is_positive in [True, False]
+            for total in self._sum_bank_actions_by_month(
+                connection, is_positive
+            )
+        ]
+        if rows:
+            connection.execute(self.monthly_aggregates.insert(), rows)
+
+    def rebuild_monthly_aggregates(self) -> None:
+        """Recalculates the whole monthly_aggregates table out of bank
+        actions."""
+        with self._transaction():
+            self._rebuild_monthly_aggregates(self.connection)
+
     def list_positive_transfers(self) -> Iterator[MbankAction]:
         """Returns a generator that lists all positive transfers that were
         observed so far."""
-        with self.connection.begin():
-            for entry in self.connection.execute(
-                self.bank_actions.select().where(
-                    self.bank_actions.c.amount_pln > 0
-                )
-            ).mappings():
-                entry = {k: v for k, v in dict(entry).items() if k != "id"}
-                yield ksiemgowy.mbankmail.MbankAction(**entry)
+        for row in self._select_actions(is_positive=True):
+            yield MbankAction(*row)
 
-    def add_positive_transfer(self, positive_action: MbankAction) -> None:
-        """Adds a positive transfer to the database."""
-        with self.connection.begin():
-            self.connection.execute(
-                self.bank_actions.insert(), positive_action.asdict()
-            )
+    def load_positive_transfers(
+        self, since: Optional[datetime.datetime] = None
+    ) -> ActionBatch:
+        """Returns positive transfers observed so far - or booked since
+        a given time - as an ActionBatch, which is much cheaper than
+        list_positive_transfers for long histories."""
+        return self._load_action_batch(is_positive=True, since=since)
+
+    def add_bank_actions(
+        self,
+        positive_actions: Sequence[MbankAction],
+        expenses: Sequence[MbankAction],
+        confirmations: Sequence[OutgoingMail] = (),
+        handled_imap_ids: Iterable[str] = (),
+    ) -> None:
+        """Adds positive transfers and expenses to the database, updating
+        monthly_aggregates, queues given confirmations in the outbox and
+        marks e-mails identified by handled_imap_ids as handled. Everything
+        happens in a single transaction, using one INSERT per table, so
+        e-mails are either ingested completely or not at all."""
+        rows = []
+        for action in positive_actions:
+            row = action.asdict()
+            row["booked_at"] = action.get_timestamp()
+            rows.append(row)
+        for expense in expenses:
+            row = expense.asdict()
+            row["amount_pln"] = -row["amount_pln"]
+            row["booked_at"] = expense.get_timestamp()
+            rows.append(row)
+        with self._transaction():
+            if rows:
+                self.connection.execute(self.bank_actions.insert(), rows)
+                self._update_monthly_aggregates(rows)
+            now = datetime.datetime.now()
+            for confirmation in confirmations:
+                self._enqueue_mail(confirmation, now)
+            self._mark_imap_ids_already_handled(handled_imap_ids)
+
+    def add_positive_transfer(
+        self,
+        positive_action: MbankAction,
+        confirmation: Optional[OutgoingMail] = None,
+    ) -> None:
+        """Adds a positive transfer to the database. If confirmation is given,
+        it's put in the outbox within the same transaction."""
+        self.add_bank_actions(
+            [positive_action],
+            [],
+            [confirmation] if confirmation is not None else [],
+        )
 
     def add_expense(self, bank_action: MbankAction) -> None:
         """Adds an expense to the database."""
-        bank_action.amount_pln *= -1
-        with self.connection.begin():
-            self.connection.execute(
-                self.bank_actions.insert(), **bank_action.asdict()
-            )
+        self.add_bank_actions([], [bank_action])
 
     def list_expenses(self) -> Iterator[MbankAction]:
         """Returns a generator that lists all expenses transfers that were
         observed so far."""
-        with self.connection.begin():
-            for entry in self.connection.execute(
-                self.bank_actions.select().where(
-                    self.bank_actions.c.amount_pln < 0
-                )
-            ).mappings():
-                entry = {k: v for k, v in dict(entry).items() if k != "id"}
-                bank_action = ksiemgowy.mbankmail.MbankAction(**entry)
-                bank_action.amount_pln *= -1
-                yield bank_action
+        for row in self._select_actions(is_positive=False):
+            bank_action = MbankAction(*row)
+            bank_action.amount_pln *= -1
+            yield bank_action
+
+    def load_expenses(self) -> ActionBatch:
+        """Returns all expenses observed so far as an ActionBatch, with
+        positive amounts, same as list_expenses."""
+        return self._load_action_batch(is_positive=False, since=None)
+
+
+def add_booked_at_column(
+    database: KsiemgowyDB, connection: sqlalchemy.Connection
+) -> None:
+    """Adds bank_actions.booked_at, filling it in for all existing rows."""
+    columns = sqlalchemy.inspect(connection).get_columns("bank_actions")
+    if any(column["name"] == "booked_at" for column in columns):
+        return
+    cols = database.bank_actions.c
+    column_type = cols.booked_at.type.compile(dialect=connection.dialect)
+    connection.execute(
+        sqlalchemy.text(
+            f"ALTER TABLE bank_actions ADD COLUMN booked_at {column_type}"
+        )
+    )
+    rows = connection.execute(sqlalchemy.select(cols.id, cols.timestamp)).all()
+    if rows:
+        connection.execute(
+            database.bank_actions.update()
+            .where(cols.id == sqlalchemy.bindparam("row_id"))
+            .values(booked_at=sqlalchemy.bindparam("new_booked_at")),
+            [
+                {
+                    "row_id": row_id,
+                    "new_booked_at": parse_timestamp(timestamp),
+                }
+                for row_id, timestamp in rows
+            ],
+        )
+
+
+def add_bank_actions_indexes(
+    database: KsiemgowyDB, connection: sqlalchemy.Connection
+) -> None:
+    """Creates indexes of bank_actions that are missing, which is all but
+    the one on amount_pln for databases that predate schema versioning,
+    and gathers statistics that let the query planner pick them."""
+    existing = {
+        index["name"]
+        for index in sqlalchemy.inspect(connection).get_indexes("bank_actions")
+    }
+    for index in database.bank_actions.indexes:
+        if index.name not in existing:
+            index.create(bind=connection)
+    # without statistics, SQLite won't use the indexes for range scans:
+    connection.execute(sqlalchemy.text("ANALYZE bank_actions"))
+
+
+def fill_monthly_aggregates(
+    database: KsiemgowyDB, connection: sqlalchemy.Connection
+) -> None:
+    """Fills the monthly_aggregates table in, based on existing bank
+    actions."""
+    database._rebuild_monthly_aggregates(connection)
+
+
+def store_monthly_aggregates_in_grosze(
+    database: KsiemgowyDB, connection: sqlalchemy.Connection
+) -> None:
+    """Replaces monthly_aggregates.total_pln, a float, with total_grosze,
+    which is exact. The table only holds sums of bank actions, so it's
+    recreated and filled in again."""
+    columns = sqlalchemy.inspect(connection).get_columns("monthly_aggregates")
+    if any(column["name"] == "total_grosze" for column in columns):
+        return
+    database.monthly_aggregates.drop(bind=connection)
+    database.monthly_aggregates.create(bind=connection)
+    database._rebuild_monthly_aggregates(connection)
+
+
+# Migration number i + 1 is MIGRATIONS[i]. Only ever append to this list.
+MIGRATIONS: List[Callable[[KsiemgowyDB, sqlalchemy.Connection], None]] = [
+    add_booked_at_column,
+    add_bank_actions_indexes,
+    fill_monthly_aggregates,
+    store_monthly_aggregates_in_grosze,
+]
@@ -0,0 +1,239 @@
+"""Builds the same report as current_report_builder.get_current_report, but
+works on ActionBatch columns as NumPy arrays: monthly sums are grouped
+reductions over month and category codes instead of a dictionary update per
+bank action, and monthly final balances are a cumulative sum.
+
+Amounts are added up in grosze, like in current_report_builder, so the sums
+are identical to those calculated in pure Python. NumPy is an optional
+dependency - if it's not installed, HAVE_NUMPY is False and the
+"numpy" report engine can't be used."""
+
+import datetime
+import typing as T
+
+from ksiemgowy.action_batch import ActionBatch, from_epoch, to_epoch
+from ksiemgowy.config import CategoryIndex, ReportBuilderConfig
+from ksiemgowy.current_report_builder import (
+    MONTH,
+    T_CURRENT_REPORT,
+    apply_positive_transfers,
+    build_report,
+    determine_category,
+)
+from ksiemgowy.mbankmail import ActionRecord
+from ksiemgowy.models import KsiemgowyDB
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    HAVE_NUMPY = False
+else:
+    HAVE_NUMPY = True
+
+MonthlySums = T.Dict[str, T.Dict[str, int]]
+
+
+def get_columns(
+    batch: ActionBatch,
+) -> T.Tuple[T.Any, T.Any, T.Any]:
+    """Returns amounts, month ordinals (months since January 1970) and
+    recipient ids of a batch as arrays. The arrays share memory with the
+    batch where possible."""
+    amounts = numpy.frombuffer(batch.amounts, dtype=numpy.float64)
+    seconds = numpy.floor(
+        numpy.frombuffer(batch.timestamps, dtype=numpy.float64)
+    )
+    months = (
+        seconds.astype("int64")
+        .astype("datetime64[s]")
+        .astype("datetime64[M]")
+        .astype("int64")
+    )
+    return amounts, months, numpy.asarray(batch.recipient_ids)
+
+
+def to_grosze(amounts: T.Any) -> T.Any:
+    """Same as ksiemgowy.mbankmail.to_grosze, but for an array of amounts.
+    Both round halves to even."""
+    return numpy.rint(amounts * 100).astype(numpy.int64)
+
+
+def format_month(month: int) -> str:
+    """Turns a month ordinal back into the format used in reports."""
+    return f"{1970 + month // 12}-{month % 12 + 1:02d}"
+
+
+def encode_labels(
+    batch: ActionBatch,
+    ids: T.Any,
+    account_labels: T.Dict[str, str],
+    labels: T.List[str],
+) -> T.Any:
+    """Returns account label codes for given ids of values of the batch,
+    adding labels not seen yet to the end of labels."""
+    unique_ids, inverse = numpy.unique(ids, return_inverse=True)
+    codes = []
+    for value_id in unique_ids.tolist():
+        label = account_labels[batch.values[value_id]]
+        if label not in labels:
+            labels.append(label)
+        codes.append(labels.index(label))
+    return numpy.asarray(codes, dtype=numpy.int64)[inverse]
+
+
+def encode_categories(
+    batch: ActionBatch,
+    recipient_ids: T.Any,
+    amounts: T.Any,
+    categories: CategoryIndex,
+    names: T.List[str],
+) -> T.Any:
+    """Returns category codes of all actions in the batch, adding category
+    names to names. Categories are determined once per distinct pair of
+    recipient and amount."""
+    if amounts.size == 0:
+        return numpy.zeros(0, dtype=numpy.int64)
+    pairs = numpy.stack([recipient_ids.astype(numpy.float64), amounts])
+    unique_pairs, inverse = numpy.unique(
+        pairs, axis=1, return_inverse=True
+    )
+    codes = []
+    for recipient_id, amount in unique_pairs.T.tolist():
+        name = determine_category(
+            ActionRecord(
+                "",
+                batch.values[int(recipient_id)],
+                amount,
+                "",
+                datetime.datetime(1970, 1, 1),
+            ),
+            categories,
+        )
+        if name not in names:
+            names.append(name)
+        codes.append(names.index(name))
+    return numpy.asarray(codes, dtype=numpy.int64)[inverse.reshape(-1)]
+
+
+def sum_by_month(
+    months: T.Any, codes: T.Any, names: T.List[str], amounts: T.Any
+) -> MonthlySums:
+    """Sums amounts in grosze by month and code, returning the sums in the
+    same nested dictionaries apply_expenses and apply_positive_transfers
+    build. Within a month, keys are inserted in the order in which they
+    first appear, same as there. numpy.bincount adds up float64 values,
+    which is exact for whole numbers below 2**53."""
+    keys = months * len(names) + codes
+    unique_keys, first_seen, inverse = numpy.unique(
+        keys, return_index=True, return_inverse=True
+    )
+    sums = numpy.bincount(
+        inverse.reshape(-1), weights=amounts, minlength=len(unique_keys)
+    )
+    monthly_sums: MonthlySums = {}
+    for group in numpy.argsort(first_seen, kind="stable").tolist():
+        month, code = divmod(int(unique_keys[group]), len(names))
+        month_sums = monthly_sums.setdefault(format_month(month), {})
+        month_sums[names[code]] = int(sums[group])
+    return monthly_sums
+
+
+def build_monthly_final_balance(
+    months: T.Set[str],
+    monthly_income: MonthlySums,
+    monthly_expenses: MonthlySums,
+) -> T.Tuple[MonthlySums, int]:
+    """Same as current_report_builder.build_monthly_final_balance, but
+    calculates the running balance with numpy.cumsum."""
+    sorted_months = sorted(months)
+    balances = numpy.cumsum(
+        numpy.asarray(
+            [
+                sum(monthly_income.get(month, {}).values())
+                - sum(monthly_expenses.get(month, {}).values())
+                for month in sorted_months
+            ],
+            dtype=numpy.int64,
+        )
+    ).tolist()
+    monthly_final_balance = {
+        month: {"Suma": balance}
+        for month, balance in zip(sorted_months, balances)
+    }
+    return monthly_final_balance, balances[-1] if balances else 0
+
+
+def get_current_report_numpy(
+    now: datetime.datetime,
+    database: KsiemgowyDB,
+    report_builder_config: ReportBuilderConfig,
+) -> T_CURRENT_REPORT:
+    """Builds the current report out of bank actions stored in database,
+    the same way get_current_report does."""
+    # pylint: disable=too-many-locals
+    if not HAVE_NUMPY:
+        raise RuntimeError("The numpy report engine requires NumPy")
+    account_labels = report_builder_config.account_labels
+    expenses = database.load_expenses()
+    positive_transfers = database.load_positive_transfers()
+    labels: T.List[str] = []
+
+    amounts, months, recipient_ids = get_columns(expenses)
+    grosze = to_grosze(amounts)
+    label_codes = encode_labels(
+        expenses, numpy.asarray(expenses.sender_ids), account_labels, labels
+    )
+    category_names: T.List[str] = []
+    category_codes = encode_categories(
+        expenses,
+        recipient_ids,
+        amounts,
+        report_builder_config.category_index,
+        category_names,
+    )
+    monthly_expenses = sum_by_month(
+        months, category_codes, category_names, grosze
+    )
+    last_updated = datetime.datetime(year=1970, month=1, day=1)
+    if len(expenses):
+        last_updated = max(last_updated, from_epoch(max(expenses.timestamps)))
+
+    positive_amounts, positive_months, positive_recipient_ids = get_columns(
+        positive_transfers
+    )
+    positive_grosze = to_grosze(positive_amounts)
+    positive_label_codes = encode_labels(
+        positive_transfers, positive_recipient_ids, account_labels, labels
+    )
+    monthly_income = sum_by_month(
+        positive_months,
+        numpy.zeros(len(positive_transfers), dtype=numpy.int64),
+        ["Suma"],
+        positive_grosze,
+    )
+
+    balances = numpy.zeros(len(labels), dtype=numpy.int64)
+    numpy.subtract.at(balances, label_codes, grosze)
+    numpy.add.at(balances, positive_label_codes, positive_grosze)
+
+    # the trailing month is short, so dues are counted the usual way:
+    recent = numpy.flatnonzero(
+        numpy.frombuffer(positive_transfers.timestamps, dtype=numpy.float64)
+        >= to_epoch(now - MONTH)
+    )
+    total, num_subscribers, last_updated, _ = apply_positive_transfers(
+        now,
+        last_updated,
+        [positive_transfers[index] for index in recent.tolist()],
+        {},
+        account_labels,
+    )
+    return build_report(
+        now,
+        report_builder_config,
+        dict(zip(labels, balances.tolist())),
+        monthly_income,
+        monthly_expenses,
+        (total, num_subscribers, last_updated),
+        final_balance_builder=build_monthly_final_balance,
+    )
@@ -0,0 +1,62 @@
+"""Drains the outbox table: sends the e-mails that other parts of ksiemgowy
+queued there, retrying the failed ones with exponential backoff."""
+
+import datetime
+import email
+import logging
+import smtplib
+import typing as T
+
+import ksiemgowy.config
+import ksiemgowy.mailer
+from ksiemgowy.models import KsiemgowyDB
+
+
+LOGGER = logging.getLogger(__name__)
+
+OUTBOX_POLL_SECONDS = 60
+MAX_ATTEMPTS = 8
+INITIAL_BACKOFF = datetime.timedelta(minutes=1)
+
+
+def drain_outbox(
+    database: KsiemgowyDB,
+    mail_config: ksiemgowy.config.MailConfig,
+    now: T.Optional[datetime.datetime] = None,
+) -> None:
+    """Sends all due e-mails queued by mail_config's account. Each e-mail is
+    marked as sent right after the server accepts it; failed ones are
+    scheduled for another attempt until MAX_ATTEMPTS is reached."""
+    if now is None:
+        now = datetime.datetime.now()
+    entries = database.list_pending_mail(mail_config.login, now, MAX_ATTEMPTS)
+    if not entries:
+        return
+    LOGGER.info("drain_outbox: sending %d e-mails", len(entries))
+    messages = [email.message_from_string(entry.message) for entry in entries]
+
+    sent = set()
+
+    def on_sent(i: int) -> None:
+        database.mark_mail_sent(entries[i].entry_id, datetime.datetime.now())
+        sent.add(i)
+
+    try:
+        errors = ksiemgowy.mailer.send_messages(
+            mail_config, messages, on_sent=on_sent
+        )
+    except (smtplib.SMTPException, OSError) as err:
+        LOGGER.exception(err)
+        errors = {i: err for i in range(len(entries)) if i not in sent}
+
+    for i, error in errors.items():
+        entry = entries[i]
+        if entry.attempts + 1 >= MAX_ATTEMPTS:
+            LOGGER.error(
+                "Giving up on outbox entry %d: %r", entry.entry_id, error
+            )
+        database.mark_mail_failed(
+            entry.entry_id,
+            repr(error),
+            now + INITIAL_BACKOFF * 2 ** entry.attempts,
+        )
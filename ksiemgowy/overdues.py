@@ -2,24 +2,19 @@
 
 import datetime
 import logging
-import typing as T
-import smtplib
 
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
 import ksiemgowy.config
-from ksiemgowy.mbankmail import MbankAction
-from ksiemgowy.models import KsiemgowyDB
+from ksiemgowy.models import KsiemgowyDB, OutgoingMail
 
 
 LOGGER = logging.getLogger("ksiemgowy.__main__")
 
 
-def send_overdue_email(
-    server: smtplib.SMTP_SSL, fromaddr: str, overdue_email: str
-) -> None:
-    """Sends an e-mail notifying that a member is overdue with their
+def build_overdue_email(fromaddr: str, overdue_email: str) -> MIMEMultipart:
+    """Builds an e-mail notifying that a member is overdue with their
     payments."""
     msg = MIMEMultipart("alternative")
     msg["From"] = fromaddr
@@ -62,39 +57,35 @@ https://github.com/hakierspejs/wiki/wiki/Finanse#przypomnienie-o-sk%C5%82adkach
 """
 
     msg.attach(MIMEText(message_text, "plain", "utf-8"))
-    server.send_message(msg)
+    return msg
 
 
 def notify_about_overdues(
     database: KsiemgowyDB,
     mail_config: ksiemgowy.config.MailConfig,
 ) -> None:
-    """Checks whether any of the organization members is overdue and notifies
-    them about that fact."""
+    """Checks whether any of the organization members is overdue and queues
+    notifications about that fact in the outbox."""
     LOGGER.info("notify_about_overdues()")
-    latest_dues: T.Dict[str, MbankAction] = {}
-    for action in database.list_positive_transfers():
-        if (
-            action.sender_acc_no not in latest_dues
-            or latest_dues[action.sender_acc_no].get_timestamp()
-            < action.get_timestamp()
-        ):
-            latest_dues[action.sender_acc_no] = action
-
     now = datetime.datetime.now()
     ago_35d = now - datetime.timedelta(days=35)
     ago_55d = now - datetime.timedelta(days=55)
     overdues = []
     emails = database.get_potentially_overdue_accounts(now)
-    for payment in latest_dues.values():
-        if ago_55d < payment.get_timestamp() < ago_35d:
-            if payment.sender_acc_no in emails:
-                overdues.append(payment.sender_acc_no)
-
-    with mail_config.smtp_login() as server:
-        for sender_acc_no in overdues:
-            email = emails[sender_acc_no]
-            send_overdue_email(server, mail_config.login, email)
-            database.postpone_next_notification(sender_acc_no, now)
+    for sender_acc_no in database.list_latest_payments(ago_55d, ago_35d):
+        if sender_acc_no in emails:
+            overdues.append(sender_acc_no)
+
+    for sender_acc_no in overdues:
+        msg = build_overdue_email(mail_config.login, emails[sender_acc_no])
+        database.postpone_next_notification(
+            sender_acc_no,
+            now,
+            OutgoingMail(
+                idempotency_key=f"overdue:{sender_acc_no}:{now.isoformat()}",
+                sender=mail_config.login,
+                message=msg.as_string(),
+            ),
+        )
 
     LOGGER.info("done notify_about_overdues()")
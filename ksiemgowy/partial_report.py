@@ -0,0 +1,236 @@
+"""Reports on subsets of bank actions that can be merged together. Sums are
+in grosze, so merging PartialReports in any order gives the same result as
+reducing all of their bank actions at once. Monthly balances ("Saldo") and
+dues of the trailing month are only calculated when the report is
+finished.
+
+build_report_in_parallel splits bank actions into slices - by year or by
+account - and reduces each of them in a process pool. Workers load their
+slices from the database themselves, so only the partial reports are sent
+between processes. IncrementalReportBuilder keeps a PartialReport of all
+bank actions it has seen and merges in one of the actions added since."""
+
+import concurrent.futures
+import dataclasses
+import datetime
+import functools
+import typing as T
+
+from ksiemgowy.action_batch import EPOCH, ActionBatch
+from ksiemgowy.config import CategoryIndex, ReportBuilderConfig
+from ksiemgowy.current_report_builder import (
+    MONTH,
+    T_CURRENT_REPORT,
+    apply_expenses,
+    apply_positive_transfers,
+    build_report,
+)
+from ksiemgowy.mbankmail import BankAction
+from ksiemgowy.models import KsiemgowyDB
+
+SLICE_KEYS = ["year", "account"]
+
+MonthlySums = T.Dict[str, T.Dict[str, int]]
+
+
+def add_sums(
+    first: T.Dict[str, int], second: T.Dict[str, int]
+) -> T.Dict[str, int]:
+    """Returns a new dictionary with values of both added up by key."""
+    result = dict(first)
+    for key, value in second.items():
+        result[key] = result.get(key, 0) + value
+    return result
+
+
+def add_monthly_sums(
+    first: MonthlySums, second: MonthlySums
+) -> MonthlySums:
+    """Same as add_sums, but for sums grouped by month first."""
+    result = {month: dict(sums) for month, sums in first.items()}
+    for month, sums in second.items():
+        result[month] = add_sums(result.get(month, {}), sums)
+    return result
+
+
+@dataclasses.dataclass
+class PartialReport:
+    """Balances and monthly sums of a subset of bank actions, in grosze."""
+
+    balances_by_account_labels: T.Dict[str, int] = dataclasses.field(
+        default_factory=dict
+    )
+    monthly_income: MonthlySums = dataclasses.field(default_factory=dict)
+    monthly_expenses: MonthlySums = dataclasses.field(default_factory=dict)
+    last_expense_at: datetime.datetime = EPOCH
+
+    def merge(self, other: "PartialReport") -> "PartialReport":
+        """Returns a report covering bank actions of both. Neither of the
+        merged reports is modified; an empty PartialReport is the identity
+        element."""
+        return PartialReport(
+            add_sums(
+                self.balances_by_account_labels,
+                other.balances_by_account_labels,
+            ),
+            add_monthly_sums(self.monthly_income, other.monthly_income),
+            add_monthly_sums(self.monthly_expenses, other.monthly_expenses),
+            max(self.last_expense_at, other.last_expense_at),
+        )
+
+    def finish(
+        self,
+        now: datetime.datetime,
+        report_builder_config: ReportBuilderConfig,
+        recent_positive_transfers: T.Iterable[BankAction],
+    ) -> T_CURRENT_REPORT:
+        """Counts dues paid in the trailing month, out of positive transfers
+        booked in it, and builds the report. The PartialReport isn't
+        modified."""
+        # balances and monthly income are already taken care of, so those
+        # calculated here are thrown away:
+        total, num_subscribers, last_updated, _ = apply_positive_transfers(
+            now,
+            self.last_expense_at,
+            recent_positive_transfers,
+            {},
+            report_builder_config.account_labels,
+        )
+        return build_report(
+            now,
+            report_builder_config,
+            dict(self.balances_by_account_labels),
+            add_monthly_sums({}, self.monthly_income),
+            add_monthly_sums({}, self.monthly_expenses),
+            (total, num_subscribers, last_updated),
+        )
+
+
+def reduce_bank_actions(
+    positive_transfers: T.Iterable[BankAction],
+    expenses: T.Iterable[BankAction],
+    account_labels: T.Dict[str, str],
+    categories: CategoryIndex,
+) -> PartialReport:
+    """Turns bank actions into a PartialReport. Amounts of expenses are
+    expected to be positive."""
+    balances_by_account_labels: T.Dict[str, int] = {}
+    last_expense_at, monthly_expenses = apply_expenses(
+        expenses,
+        balances_by_account_labels,
+        account_labels,
+        categories,
+    )
+    # dues are counted once the report is finished, so none of the
+    # transfers is treated as recent here:
+    _, _, _, monthly_income = apply_positive_transfers(
+        datetime.datetime.max,
+        last_expense_at,
+        positive_transfers,
+        balances_by_account_labels,
+        account_labels,
+    )
+    return PartialReport(
+        balances_by_account_labels,
+        monthly_income,
+        monthly_expenses,
+        last_expense_at,
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def open_database(database_uri: str) -> KsiemgowyDB:
+    """Opens the database once per worker process."""
+    return KsiemgowyDB(database_uri)
+
+
+def list_slices(database: KsiemgowyDB, by: str) -> T.List[T.Any]:
+    """Returns keys of slices of bank actions stored in database: years in
+    which they were booked or our accounts that they concern."""
+    if by not in SLICE_KEYS:
+        raise ValueError(f"Unknown slice key: {by}")
+    if by == "year":
+        return list(database.list_booked_years())
+    return list(database.list_own_accounts())
+
+
+def load_slice(
+    database: KsiemgowyDB, by: str, key: T.Any
+) -> T.Tuple[ActionBatch, ActionBatch]:
+    """Returns (positive_transfers, expenses) of a slice returned by
+    list_slices."""
+    if by == "year":
+        return database.load_bank_actions(
+            booked_since=datetime.datetime(key, 1, 1),
+            booked_before=datetime.datetime(key + 1, 1, 1),
+        )
+    return database.load_bank_actions(acc_no=key)
+
+
+def reduce_slice(
+    database_uri: str,
+    by: str,
+    key: T.Any,
+    account_labels: T.Dict[str, str],
+    categories: CategoryIndex,
+) -> PartialReport:
+    """Loads a slice of bank actions and turns it into a PartialReport. Run
+    in worker processes."""
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    positive_transfers, expenses = load_slice(
+        open_database(database_uri), by, key
+    )
+    return reduce_bank_actions(
+        positive_transfers, expenses, account_labels, categories
+    )
+
+
+def is_in_memory(database: KsiemgowyDB) -> bool:
+    """Tells whether the database lives in memory of this process, where
+    workers can't reach it."""
+    url = database.database.url
+    return url.get_backend_name() == "sqlite" and url.database in (
+        None,
+        "",
+        ":memory:",
+    )
+
+
+def build_report_in_parallel(
+    now: datetime.datetime,
+    database: KsiemgowyDB,
+    report_builder_config: ReportBuilderConfig,
+    by: str = "year",
+    max_workers: T.Optional[int] = None,
+) -> T_CURRENT_REPORT:
+    """Builds the current report out of bank actions stored in database,
+    reducing slices of them in a process pool. In-memory databases can't
+    be shared with workers, so their slices are reduced one by one."""
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    keys = list_slices(database, by)
+    account_labels = report_builder_config.account_labels
+    categories = report_builder_config.category_index
+    if is_in_memory(database):
+        partial_reports = [
+            reduce_bank_actions(
+                *load_slice(database, by, key), account_labels, categories
+            )
+            for key in keys
+        ]
+    else:
+        reduce = functools.partial(
+            reduce_slice,
+            database.database.url.render_as_string(hide_password=False),
+            by,
+            account_labels=account_labels,
+            categories=categories,
+        )
+        with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+            partial_reports = list(executor.map(reduce, keys))
+    return functools.reduce(
+        PartialReport.merge, partial_reports, PartialReport()
+    ).finish(
+        now,
+        report_builder_config,
+        database.load_positive_transfers(since=now - MONTH),
+    )
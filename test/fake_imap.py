@@ -0,0 +1,88 @@
+"""An in-memory stand-in for imaplib.IMAP4, good enough to exercise the
+subset of IMAP that ksiemgowy uses."""
+
+import email
+import typing as T
+
+
+class FakeIMAP:
+    def __init__(self, get_messages: T.Callable[[], T.List[bytes]]):
+        self.get_messages = get_messages
+        self.commands: T.List[T.Tuple[str, ...]] = []
+        self.uidvalidity = 1
+
+    def _uids(self) -> T.List[int]:
+        return list(range(1, len(self.get_messages()) + 1))
+
+    def _parse_uid_set(self, uid_set: T.Union[str, bytes]) -> T.List[int]:
+        if isinstance(uid_set, bytes):
+            uid_set = uid_set.decode()
+        all_uids = self._uids()
+        ret = []
+        for part in uid_set.split(","):
+            if ":" in part:
+                start, end = part.split(":")
+                highest = max(all_uids, default=0)
+                first = highest if start == "*" else int(start)
+                last = highest if end == "*" else int(end)
+                first, last = min(first, last), max(first, last)
+                ret.extend(u for u in all_uids if first <= u <= last)
+            else:
+                ret.extend(u for u in all_uids if u == int(part))
+        return ret
+
+    def select(self, mailbox: str = "INBOX") -> T.Tuple[str, T.List[bytes]]:
+        self.commands.append(("SELECT", mailbox))
+        return "OK", [str(len(self.get_messages())).encode()]
+
+    def response(self, code: str) -> T.Tuple[str, T.List[T.Any]]:
+        if code == "UIDVALIDITY":
+            return "OK", [str(self.uidvalidity).encode()]
+        return "OK", [None]
+
+    def uid(self, command: str, *args: T.Any) -> T.Tuple[str, T.List[T.Any]]:
+        command = command.upper()
+        self.commands.append(("UID", command) + tuple(map(str, args)))
+        if command == "SEARCH":
+            uids = self._uids()
+            criteria = args[-1].split()
+            if "UID" in criteria:
+                uids = self._parse_uid_set(criteria[criteria.index("UID") + 1])
+            return "OK", [" ".join(map(str, uids)).encode()]
+        if command == "FETCH":
+            return "OK", self._fetch(args[0], args[1])
+        raise NotImplementedError(command)
+
+    def _fetch(self, uid_set: T.Union[str, bytes], query: str) -> T.List[T.Any]:
+        messages = self.get_messages()
+        data: T.List[T.Any] = []
+        for uid in self._parse_uid_set(uid_set):
+            raw = messages[uid - 1]
+            if "HEADER.FIELDS" in query:
+                msg = email.message_from_bytes(raw)
+                payload = (
+                    f"Date: {msg['Date']}\r\n"
+                    f"Message-ID: {msg['Message-ID']}\r\n\r\n"
+                ).encode()
+                item = "BODY[HEADER.FIELDS (DATE MESSAGE-ID)]"
+            else:
+                payload = raw
+                item = "RFC822"
+            meta = f"{uid} (UID {uid} {item} {{{len(payload)}}}".encode()
+            data.append((meta, payload))
+            data.append(b")")
+        return data
+
+    def header_fetches(self) -> int:
+        return sum(
+            1
+            for command in self.commands
+            if command[:2] == ("UID", "FETCH") and "HEADER" in command[3]
+        )
+
+    def body_fetches(self) -> int:
+        return sum(
+            1
+            for command in self.commands
+            if command[:2] == ("UID", "FETCH") and "RFC822" in command[3]
+        )
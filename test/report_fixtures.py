@@ -0,0 +1,112 @@
+"""Bank actions and report builder configuration shared by the tests of
+report engines and of the tables they read from."""
+
+import dataclasses
+import datetime
+import random
+import typing as T
+
+from ksiemgowy.config import CategoryCriteria, ReportBuilderConfig
+from ksiemgowy.mbankmail import MbankAction
+
+HAKIERSPEJS_ACC_NO = "hakierspejs"
+SAVINGS_ACC_NO = "savings"
+LANDLORD_ACC_NO = "landlord"
+ISP_ACC_NO = "isp"
+
+NOW = datetime.datetime(2021, 9, 4, 12, 14)
+
+
+def build_action(
+    sender_acc_no: str,
+    recipient_acc_no: str,
+    amount_pln: float,
+    timestamp: T.Union[str, datetime.datetime],
+) -> MbankAction:
+    if isinstance(timestamp, datetime.datetime):
+        timestamp = timestamp.strftime("%Y-%m-%d %H:%M")
+    return MbankAction(
+        sender_acc_no=sender_acc_no,
+        recipient_acc_no=recipient_acc_no,
+        amount_pln=amount_pln,
+        in_person=f"owner of {sender_acc_no}",
+        in_desc="",
+        balance=0.0,
+        timestamp=timestamp,
+        action_type="in_transfer",
+    )
+
+
+def build_history(
+    now: datetime.datetime = NOW,
+    num_days: int = 600,
+    accounts: T.Sequence[str] = (HAKIERSPEJS_ACC_NO,),
+    rng: T.Optional[random.Random] = None,
+) -> T.Tuple[T.List[MbankAction], T.List[MbankAction]]:
+    """Returns (positive_actions, expenses) booked during num_days days
+    before now, oldest first: a due paid by one of seven members every
+    three days, rent every month and bills every two weeks in between.
+    Dues go to accounts in turn, expenses are paid from them in turn.
+    Amounts are multiples of 12.5 PLN, unless rng is given - then they're
+    picked at random, with two decimal places."""
+    positive_actions = []
+    expenses = []
+    for day in range(num_days - 1, -1, -1):
+        if day % 3:
+            continue
+        timestamp = now - datetime.timedelta(days=day, hours=day % 24)
+        account = accounts[day // 3 % len(accounts)]
+        amount_pln = 50.0 + day % 4 * 12.5
+        if rng is not None:
+            amount_pln = round(rng.uniform(10, 200), 2)
+        positive_actions.append(
+            build_action(f"member{day % 7}", account, amount_pln, timestamp)
+        )
+        if day % 15:
+            continue
+        recipient, amount_pln = LANDLORD_ACC_NO, 800.0
+        if day % 30:
+            recipient, amount_pln = ISP_ACC_NO, 177.25
+        if rng is not None:
+            amount_pln = round(rng.uniform(10, 1000), 2)
+        expenses.append(
+            build_action(account, recipient, amount_pln, timestamp)
+        )
+    return positive_actions, expenses
+
+
+def build_config(**changes: T.Any) -> ReportBuilderConfig:
+    """Returns a configuration matching accounts used by build_history,
+    with given fields replaced."""
+    config = ReportBuilderConfig(
+        account_labels={
+            HAKIERSPEJS_ACC_NO: "Konto stowarzyszenia",
+            SAVINGS_ACC_NO: "Konto oszczędnościowe",
+        },
+        corrections_by_label={"Konto stowarzyszenia": -10.0},
+        monthly_income_corrections={"2020-04": {"Suma": 200.0}},
+        monthly_expense_corrections={"2021-01": {"Domena": 55.25}},
+        first_200pln_d33tah_due_date=datetime.datetime(2020, 1, 7),
+        last_200pln_d33tah_due_date=datetime.datetime(2020, 5, 5),
+        extra_monthly_reservations_started_date=datetime.datetime(
+            2020, 11, 24
+        ),
+        categories=[
+            CategoryCriteria(
+                category_name="Czynsz",
+                recipient_acc_no=LANDLORD_ACC_NO,
+                amount_pln=800.0,
+            ),
+            CategoryCriteria(
+                category_name="Media",
+                recipient_acc_no=LANDLORD_ACC_NO,
+                amount_pln=None,
+            ),
+            CategoryCriteria(
+                category_name="Internet",
+                recipient_acc_no=ISP_ACC_NO,
+                amount_pln=None,
+            ),
+        ],
+    )
+    return dataclasses.replace(config, **changes)
@@ -0,0 +1,72 @@
+import unittest
+
+import ksiemgowy.models
+from ksiemgowy.action_batch import ActionBatch
+from ksiemgowy.mbankmail import MbankAction
+
+
+def build_action(sender_acc_no, amount_pln, timestamp):
+    return MbankAction(
+        sender_acc_no=sender_acc_no,
+        recipient_acc_no="hakierspejs",
+        amount_pln=amount_pln,
+        in_person=f"owner of {sender_acc_no}",
+        in_desc="",
+        balance=0.0,
+        timestamp=timestamp,
+        action_type="in_transfer",
+    )
+
+
+class ActionBatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.actions = [
+            build_action("a", 100.0, "2021-01-01 12:00"),
+            build_action("b", 50.0, "2021-02-01 12:30"),
+            build_action("a", 100.0, "2021-03-01 08:15"),
+        ]
+        self.batch = ActionBatch()
+        for action in self.actions:
+            self.batch.append(action)
+
+    def test_values_are_interned(self):
+        self.assertEqual(len(self.batch), 3)
+        self.assertEqual(
+            self.batch.values,
+            ["a", "hakierspejs", "owner of a", "b", "owner of b"],
+        )
+        self.assertEqual(list(self.batch.sender_ids), [0, 3, 0])
+
+    def test_iteration_yields_same_fields(self):
+        for action, record in zip(self.actions, self.batch):
+            self.assertEqual(record.sender_acc_no, action.sender_acc_no)
+            self.assertEqual(record.recipient_acc_no, action.recipient_acc_no)
+            self.assertEqual(record.amount_pln, action.amount_pln)
+            self.assertEqual(record.in_person, action.in_person)
+            self.assertEqual(record.get_timestamp(), action.get_timestamp())
+
+
+class LoadActionBatchTestCase(unittest.TestCase):
+    def test_batches_match_listed_actions(self):
+        database = ksiemgowy.models.KsiemgowyDB("sqlite://")
+        database.add_bank_actions(
+            [build_action("a", 100.0, "2021-01-01 12:00")],
+            [build_action("b", 30.0, "2021-01-02 13:00")],
+        )
+        for batch, actions in [
+            (
+                database.load_positive_transfers(),
+                database.list_positive_transfers(),
+            ),
+            (database.load_expenses(), database.list_expenses()),
+        ]:
+            self.assertEqual(
+                [
+                    (r.sender_acc_no, r.amount_pln, r.get_timestamp())
+                    for r in batch
+                ],
+                [
+                    (a.sender_acc_no, a.amount_pln, a.get_timestamp())
+                    for a in actions
+                ],
+            )
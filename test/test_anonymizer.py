@@ -0,0 +1,55 @@
+import unittest
+
+from ksiemgowy.anonymizer import Anonymizer
+from ksiemgowy.mbankmail import MbankAction
+
+
+def build_action(sender_acc_no):
+    return MbankAction(
+        sender_acc_no=sender_acc_no,
+        recipient_acc_no="81089394",
+        amount_pln=200.0,
+        in_person="JAN KOWALSKI",
+        in_desc="SKŁADKA",
+        balance=796.03,
+        timestamp="2021-05-07 01:50",
+        action_type="in_transfer",
+    )
+
+
+class AnonymizerTestCase(unittest.TestCase):
+    def test_sha256_matches_mbank_action_anonymized(self):
+        action = build_action("3511...075800")
+        self.assertEqual(
+            Anonymizer(b"pepper").anonymize(action),
+            action.anonymized(b"pepper"),
+        )
+
+    def test_repeated_values_are_cached(self):
+        anonymizer = Anonymizer(b"pepper")
+        anonymized = anonymizer.anonymize_all(
+            [build_action(str(i % 2)) for i in range(10)]
+        )
+        self.assertEqual(len(anonymized), 10)
+        self.assertEqual(anonymized[0], anonymized[2])
+        # 2 sender accounts plus 3 other fields that never change:
+        self.assertEqual(anonymizer.anonymize_field.cache_info().misses, 5)
+
+    def test_blake2b_is_keyed(self):
+        digest = Anonymizer(b"pepper", "blake2b").anonymize_field("81089394")
+        self.assertEqual(len(digest), 64)
+        self.assertNotEqual(
+            digest, Anonymizer(b"pepper").anonymize_field("81089394")
+        )
+        self.assertNotEqual(
+            digest,
+            Anonymizer(b"other", "blake2b").anonymize_field("81089394"),
+        )
+
+    def test_blake2b_accepts_long_keys(self):
+        anonymizer = Anonymizer(b"x" * 100, "blake2b")
+        self.assertEqual(len(anonymizer.anonymize_field("81089394")), 64)
+
+    def test_unknown_algorithm(self):
+        with self.assertRaises(ValueError):
+            Anonymizer(b"pepper", "md5")
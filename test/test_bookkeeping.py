@@ -0,0 +1,218 @@
+import email
+import threading
+import unittest
+import unittest.mock as mock
+
+import ksiemgowy.bookkeeping as M
+import ksiemgowy.config
+import ksiemgowy.models
+from ksiemgowy.anonymizer import Anonymizer
+from ksiemgowy.mbankmail import MbankAction
+
+from test.fake_imap import FakeIMAP
+
+
+class SequenceSetTestCase(unittest.TestCase):
+    def test_build_sequence_set_compresses_ranges(self):
+        self.assertEqual(M.build_sequence_set([5, 1, 2, 3, 7, 8]), "1:3,5,7:8")
+
+    def test_build_sequence_set_single_uid(self):
+        self.assertEqual(M.build_sequence_set([42]), "42")
+
+
+class GenUnseenMbankEmailsTestCase(unittest.TestCase):
+    def setUp(self):
+        with open("docs/przykladowy_zalacznik_mbanku.eml", "rb") as f:
+            eml = f.read()
+        self.messages = [
+            eml.replace(b"Date: ", f"Date: {i} ".encode(), 1)
+            for i in range(7)
+        ]
+        self.imap = FakeIMAP(lambda: self.messages)
+        self.database = ksiemgowy.models.KsiemgowyDB("sqlite://")
+
+    def test_bodies_are_fetched_in_batches(self):
+        fetched = list(
+            M.gen_unseen_mbank_emails(
+                self.database, self.imap, "ALL", "test", batch_size=3
+            )
+        )
+        self.assertEqual(len(fetched), 7)
+        self.assertEqual(self.imap.header_fetches(), 3)
+        self.assertEqual(self.imap.body_fetches(), 3)
+
+    def test_handled_ids_are_loaded_once_and_left_to_the_caller(self):
+        with mock.patch.object(
+            self.database,
+            "list_handled_imap_ids",
+            wraps=self.database.list_handled_imap_ids,
+        ) as list_mock, mock.patch.object(
+            self.database,
+            "mark_imap_ids_already_handled",
+            wraps=self.database.mark_imap_ids_already_handled,
+        ) as mark_mock:
+            list(
+                M.gen_unseen_mbank_emails(
+                    self.database, self.imap, "ALL", "test", batch_size=3
+                )
+            )
+        self.assertEqual(list_mock.call_count, 1)
+        # e-mails are only marked as handled together with their actions,
+        # by KsiemgowyDB.add_bank_actions:
+        mark_mock.assert_not_called()
+        self.assertEqual(self.database.list_handled_imap_ids(), set())
+
+    def test_messages_handled_before_a_failure_are_marked(self):
+        parse_mbank_email = M.ksiemgowy.mbankmail.parse_mbank_email
+        parsed = []
+
+        def parse(msg):
+            if len(parsed) == 2:
+                raise ValueError("handling failed")
+            parsed.append(msg)
+            return parse_mbank_email(msg)
+
+        with mock.patch.object(
+            M.ksiemgowy.mbankmail, "parse_mbank_email", side_effect=parse
+        ), self.assertRaises(ValueError):
+            M.handle_new_emails(
+                self.imap,
+                Anonymizer(b""),
+                self.database,
+                build_account("a", "81089394").mail_config,
+                ["81089394"],
+                False,
+            )
+        self.assertEqual(len(self.database.list_handled_imap_ids()), 2)
+        self.assertEqual(len(list(self.database.list_positive_transfers())), 2)
+
+    def test_messages_handled_after_the_watermark_are_skipped(self):
+        # as if ksiemgowy crashed after recording the 3rd and 4th message,
+        # but before it moved the watermark past them:
+        self.database.set_imap_sync_state("test", self.imap.uidvalidity, 2)
+        self.database.mark_imap_ids_already_handled(
+            M.build_mail_key(email.message_from_bytes(raw)["Date"])
+            for raw in self.messages[2:4]
+        )
+        fetched = list(
+            M.gen_unseen_mbank_emails(
+                self.database, self.imap, "ALL", "test", batch_size=3
+            )
+        )
+        self.assertEqual(
+            [msg["Date"] for msg in fetched],
+            [
+                email.message_from_bytes(raw)["Date"]
+                for raw in self.messages[4:]
+            ],
+        )
+        self.assertEqual(
+            self.database.get_imap_sync_state("test"),
+            (self.imap.uidvalidity, 7),
+        )
+
+
+def build_account(login, acc_number):
+    return ksiemgowy.config.KsiemgowyAccount(
+        acc_number=acc_number,
+        mail_config=ksiemgowy.config.MailConfig(
+            login=login, password="", server="imap.example.com", imap_filter=""
+        ),
+    )
+
+
+class CheckAccountsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.database = ksiemgowy.models.KsiemgowyDB("sqlite://")
+
+    def test_mailboxes_are_checked_in_parallel(self):
+        barrier = threading.Barrier(2, timeout=5)
+        accounts = [build_account("a", "1"), build_account("b", "2")]
+        with mock.patch.object(
+            M, "check_for_updates", side_effect=lambda *_: barrier.wait()
+        ) as check:
+            M.check_accounts(Anonymizer(b""), self.database, accounts, False, 2)
+        self.assertEqual(check.call_count, 2)
+
+    def test_accounts_sharing_a_mailbox_are_checked_together(self):
+        accounts = [build_account("a", "1"), build_account("a", "2")]
+        with mock.patch.object(M, "check_for_updates") as check_mock, \
+                mock.patch.object(
+                    M.concurrent.futures, "ThreadPoolExecutor",
+                    wraps=M.concurrent.futures.ThreadPoolExecutor,
+                ) as executor_mock:
+            M.check_accounts(Anonymizer(b""), self.database, accounts, False, 4)
+        self.assertEqual(
+            [c.args[3] for c in check_mock.call_args_list], [["1", "2"]]
+        )
+        executor_mock.assert_called_once_with(1)
+
+    def test_failure_does_not_stop_other_accounts(self):
+        accounts = [build_account("a", "1"), build_account("b", "2")]
+        error = OSError("connection reset")
+
+        def check(_, __, mail_config, *___):
+            if mail_config.login == "a":
+                raise error
+
+        with mock.patch.object(
+            M, "check_for_updates", side_effect=check
+        ) as check_mock:
+            with self.assertRaises(OSError):
+                M.check_accounts(Anonymizer(b""), self.database, accounts, False, 1)
+        self.assertEqual(check_mock.call_count, 2)
+
+
+class HandleNewEmailsTestCase(unittest.TestCase):
+    def setUp(self):
+        with open("docs/przykladowy_zalacznik_mbanku.eml", "rb") as f:
+            eml = f.read()
+        self.messages = [eml]
+        self.imap = FakeIMAP(lambda: self.messages)
+        self.database = ksiemgowy.models.KsiemgowyDB("sqlite://")
+
+    def build_action(self, action_type, sender_acc_no, recipient_acc_no):
+        return MbankAction(
+            sender_acc_no=sender_acc_no,
+            recipient_acc_no=recipient_acc_no,
+            amount_pln=10.0,
+            in_person="",
+            in_desc="",
+            balance=0.0,
+            timestamp="2021-01-01 10:00",
+            action_type=action_type,
+        )
+
+    def test_actions_of_all_accounts_are_recorded_in_one_pass(self):
+        actions = [
+            self.build_action("in_transfer", "member", "1"),
+            self.build_action("out_transfer", "2", "landlord"),
+            self.build_action("in_transfer", "member", "3"),
+        ]
+        mail_config = build_account("a", "1").mail_config
+        with mock.patch.object(
+            M.ksiemgowy.mbankmail,
+            "parse_mbank_email",
+            return_value={"actions": actions},
+        ):
+            M.handle_new_emails(
+                self.imap,
+                Anonymizer(b""),
+                self.database,
+                mail_config,
+                ["1", "2"],
+                False,
+            )
+            # the e-mail is handled already, so running this again doesn't
+            # record its actions twice:
+            M.handle_new_emails(
+                self.imap,
+                Anonymizer(b""),
+                self.database,
+                mail_config,
+                ["1", "2"],
+                False,
+            )
+        self.assertEqual(len(list(self.database.list_positive_transfers())), 1)
+        self.assertEqual(len(list(self.database.list_expenses())), 1)
+        self.assertEqual(len(self.database.list_handled_imap_ids()), 1)
@@ -0,0 +1,71 @@
+import mailbox
+import os
+import shutil
+import tempfile
+import unittest
+
+import ksiemgowy.bulk_import as M
+import ksiemgowy.models
+from ksiemgowy.anonymizer import Anonymizer
+
+EML_PATH = "docs/przykladowy_zalacznik_mbanku.eml"
+
+
+class BulkImportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        with open(EML_PATH, "rb") as f:
+            eml = f.read()
+        self.messages = [
+            eml.replace(b"Date: ", f"Date: {i} ".encode(), 1)
+            for i in range(5)
+        ]
+        self.database = ksiemgowy.models.KsiemgowyDB("sqlite://")
+
+    def import_archive(self, path, acc_numbers=("81089394",)):
+        return M.import_messages(
+            self.database,
+            M.gen_raw_messages(path, M.detect_format(path)),
+            Anonymizer(b""),
+            acc_numbers,
+            max_workers=2,
+            commit_batch_size=2,
+        )
+
+    def test_eml_directory(self):
+        for i, message in enumerate(self.messages):
+            with open(os.path.join(self.tmpdir, f"{i}.eml"), "wb") as f:
+                f.write(message)
+        self.assertEqual(M.detect_format(self.tmpdir), "eml")
+        self.assertEqual(self.import_archive(self.tmpdir), 5)
+        self.assertEqual(len(list(self.database.list_positive_transfers())), 5)
+        self.assertEqual(len(self.database.list_handled_imap_ids()), 5)
+
+    def test_reimport_is_a_noop(self):
+        path = os.path.join(self.tmpdir, "archive.mbox")
+        archive = mailbox.mbox(path)
+        for message in self.messages:
+            archive.add(message)
+        archive.close()
+        self.assertEqual(M.detect_format(path), "mbox")
+        self.assertEqual(self.import_archive(path), 5)
+        self.assertEqual(self.import_archive(path), 0)
+        self.assertEqual(len(list(self.database.list_positive_transfers())), 5)
+
+    def test_maildir(self):
+        path = os.path.join(self.tmpdir, "Maildir")
+        archive = mailbox.Maildir(path)
+        for message in self.messages:
+            archive.add(message)
+        self.assertEqual(M.detect_format(path), "maildir")
+        self.assertEqual(self.import_archive(path), 5)
+
+    def test_actions_of_all_accounts_are_imported(self):
+        for i, message in enumerate(self.messages):
+            with open(os.path.join(self.tmpdir, f"{i}.eml"), "wb") as f:
+                f.write(message)
+        self.assertEqual(
+            self.import_archive(self.tmpdir, ["12345", "81089394"]), 5
+        )
+        self.assertEqual(len(list(self.database.list_positive_transfers())), 5)
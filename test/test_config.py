@@ -1,9 +1,107 @@
 import unittest
 
 import ksiemgowy.config
+import ksiemgowy.mbankmail
+import ksiemgowy.models
 
 
 class ConfigTestCase(unittest.TestCase):
     def test_example_config_ok(self):
         with open("docs/example_config.yaml", encoding="utf8") as f:
             ksiemgowy.config.load_config(f)
+
+
+class MailConfigTestCase(unittest.TestCase):
+    def build_mail_config(self, **changes):
+        kwargs = {
+            "login": "ksiemgowy@example.com",
+            "password": "secret",
+            "server": "imap.example.com",
+            "imap_filter": '(FROM "kontakt@mbank.pl")',
+        }
+        kwargs.update(changes)
+        return ksiemgowy.config.MailConfig(**kwargs)
+
+    def test_imap_sync_key_depends_on_filter(self):
+        first = self.build_mail_config()
+        second = self.build_mail_config(
+            imap_filter='(FROM "kontakt@mbank.pl" SUBJECT "oszczednosci")'
+        )
+        self.assertNotEqual(first.imap_sync_key, second.imap_sync_key)
+        self.assertEqual(
+            first.imap_sync_key, self.build_mail_config().imap_sync_key
+        )
+        self.assertNotEqual(
+            first.imap_sync_key,
+            self.build_mail_config(login="other@example.com").imap_sync_key,
+        )
+
+    def test_filters_keep_separate_sync_state(self):
+        database = ksiemgowy.models.KsiemgowyDB("sqlite://")
+        first = self.build_mail_config()
+        second = self.build_mail_config(imap_filter="(UNSEEN)")
+        database.set_imap_sync_state(first.imap_sync_key, 1, 100)
+        self.assertIsNone(database.get_imap_sync_state(second.imap_sync_key))
+        database.set_imap_sync_state(second.imap_sync_key, 1, 5)
+        self.assertEqual(
+            database.get_imap_sync_state(first.imap_sync_key), (1, 100)
+        )
+
+
+class CategoryIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.categories = [
+            ksiemgowy.config.CategoryCriteria(
+                recipient_acc_no=recipient,
+                amount_pln=amount,
+                category_name=name,
+            )
+            for recipient, amount, name in [
+                ("landlord", 800.0, "a"),
+                ("isp", None, "b"),
+                ("landlord", None, "c"),
+                ("landlord", 55.0, "d"),
+                ("isp", 55.0, "e"),
+                ("shop", 10.0, "f"),
+                ("shop", 10.0, "g"),
+            ]
+        ]
+        self.index = ksiemgowy.config.CategoryIndex(self.categories)
+
+    def test_first_match_wins(self):
+        for recipient in ["landlord", "isp", "shop", "unknown"]:
+            for amount in [800.0, 55.0, 10.0, 1.5]:
+                action = ksiemgowy.mbankmail.ActionRecord(
+                    "", recipient, amount, "", None
+                )
+                expected = next(
+                    (
+                        criteria.category_name
+                        for criteria in self.categories
+                        if criteria.matches(action)
+                    ),
+                    None,
+                )
+                with self.subTest(recipient=recipient, amount=amount):
+                    self.assertEqual(
+                        self.index.find(recipient, amount), expected
+                    )
+
+    def test_results_are_memoized(self):
+        self.assertEqual(self.index.find("landlord", 800.0), "a")
+        self.assertEqual(self.index.find("unknown", 800.0), None)
+        self.assertEqual(
+            self.index.memo,
+            {("landlord", 800.0): "a", ("unknown", 800.0): None},
+        )
+
+    def test_report_builder_config_builds_index(self):
+        with open("docs/example_config.yaml", encoding="utf8") as f:
+            config = ksiemgowy.config.load_config(f)
+        self.assertEqual(
+            config.report_builder_config.category_index.find(
+                config.report_builder_config.categories[0].recipient_acc_no,
+                config.report_builder_config.categories[0].amount_pln,
+            ),
+            config.report_builder_config.categories[0].category_name,
+        )
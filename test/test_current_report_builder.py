@@ -1,12 +1,19 @@
 #!/usr/bin/env python3
 
+import dataclasses
 import datetime
+import random
 import unittest
 
+import ksiemgowy.config
+import ksiemgowy.models
+from ksiemgowy.action_batch import ActionBatch
 from ksiemgowy.mbankmail import MbankAction
 
 from ksiemgowy.config import ReportBuilderConfig, CategoryCriteria
 import ksiemgowy.current_report_builder as M
+import ksiemgowy.numpy_report_builder
+from test import report_fixtures
 
 
 HAKIERSPEJS_ACC_NO = (
@@ -17,12 +24,19 @@ LANDLORD_ACC_NO = (
     "5c0de18baddf47952002df587685dea519f06b639051ea3e4749ef058f6782bf"
 )
 
+# NumPy is optional, so the numpy engine is only tested if it's installed:
+AVAILABLE_REPORT_ENGINES = [
+    engine
+    for engine in ksiemgowy.config.REPORT_ENGINES
+    if engine != "numpy" or ksiemgowy.numpy_report_builder.HAVE_NUMPY
+]
+
 
 class SecondReportBuilderBuilderTestCase(unittest.TestCase):
-    def test_system(self):
-        now = datetime.datetime(2021, 9, 4, 12, 14, 6, 812646)
+    def setUp(self):
+        self.now = datetime.datetime(2021, 9, 4, 12, 14, 6, 812646)
 
-        expenses = [
+        self.expenses = [
             MbankAction(
                 sender_acc_no=HAKIERSPEJS_ACC_NO,
                 recipient_acc_no=LANDLORD_ACC_NO,
@@ -44,7 +58,7 @@ class SecondReportBuilderBuilderTestCase(unittest.TestCase):
                 action_type="out_transfer",
             ),
         ]
-        positive_actions = [
+        self.positive_actions = [
             MbankAction(
                 sender_acc_no="totallyFake",
                 recipient_acc_no=HAKIERSPEJS_ACC_NO,
@@ -57,7 +71,7 @@ class SecondReportBuilderBuilderTestCase(unittest.TestCase):
             )
         ]
 
-        current_builder_config = ReportBuilderConfig(
+        self.current_builder_config = ReportBuilderConfig(
             account_labels={
                 "d66afcd5d08d61a5678dd3dd3f"
                 "bb6b2f84985c5add8306e6b3a1c2df0e85f840": "Konto Jacka"
@@ -65,9 +79,9 @@ class SecondReportBuilderBuilderTestCase(unittest.TestCase):
             corrections_by_label={"Konto Jacka": 0.0},
             monthly_income_corrections={},
             monthly_expense_corrections={},
-            first_200pln_d33tah_due_date=now,
-            last_200pln_d33tah_due_date=now,
-            extra_monthly_reservations_started_date=now,
+            first_200pln_d33tah_due_date=self.now,
+            last_200pln_d33tah_due_date=self.now,
+            extra_monthly_reservations_started_date=self.now,
             categories=[
                 CategoryCriteria(
                     category_name="Czynsz",
@@ -97,11 +111,7 @@ class SecondReportBuilderBuilderTestCase(unittest.TestCase):
             ],
         )
 
-        current_report = M.get_current_report(
-            now, expenses, positive_actions, current_builder_config
-        )
-
-        expected_output = {
+        self.expected_output = {
             "dues_total_lastmonth": 1000.0,
             "dues_last_updated": "02-09-2021",
             "dues_num_subscribers": 1,
@@ -122,4 +132,151 @@ class SecondReportBuilderBuilderTestCase(unittest.TestCase):
             },
         }
 
-        self.assertEqual(expected_output, current_report)
+    def test_system(self):
+        current_report = M.get_current_report(
+            self.now,
+            self.expenses,
+            self.positive_actions,
+            self.current_builder_config,
+        )
+        self.assertEqual(self.expected_output, current_report)
+
+    def test_action_batches(self):
+        expense_batch = ActionBatch()
+        for action in self.expenses:
+            expense_batch.append(action)
+        positive_batch = ActionBatch()
+        for action in self.positive_actions:
+            positive_batch.append(action)
+        self.assertEqual(
+            self.expected_output,
+            M.get_current_report(
+                self.now,
+                expense_batch,
+                positive_batch,
+                self.current_builder_config,
+            ),
+        )
+
+    def test_engines(self):
+        database = ksiemgowy.models.KsiemgowyDB("sqlite://")
+        database.add_bank_actions(
+            [
+                dataclasses.replace(action, balance=0.0)
+                for action in self.positive_actions
+            ],
+            [
+                dataclasses.replace(action, balance=0.0)
+                for action in self.expenses
+            ],
+        )
+        for engine in AVAILABLE_REPORT_ENGINES:
+            with self.subTest(engine=engine):
+                self.assertEqual(
+                    self.expected_output,
+                    M.get_current_report_from_database(
+                        self.now,
+                        database,
+                        dataclasses.replace(
+                            self.current_builder_config, engine=engine
+                        ),
+                    ),
+                )
+
+
+class PublishedAmountsTestCase(unittest.TestCase):
+    def test_amounts_are_rounded_to_grosze(self):
+        # adding these up as floats gives 4032.9900000000002 and
+        # 0.30000000000000004, which older versions published:
+        positive_actions = [
+            report_fixtures.build_action(
+                "member1", report_fixtures.HAKIERSPEJS_ACC_NO, amount, day
+            )
+            for amount, day in [
+                (1000.1, "2021-08-10 10:00"),
+                (2000.2, "2021-08-20 10:00"),
+                (1032.69, "2021-08-30 10:00"),
+            ]
+        ]
+        expenses = [
+            report_fixtures.build_action(
+                report_fixtures.HAKIERSPEJS_ACC_NO,
+                report_fixtures.ISP_ACC_NO,
+                amount,
+                day,
+            )
+            for amount, day in [
+                (0.1, "2021-08-11 10:00"),
+                (0.2, "2021-08-12 10:00"),
+            ]
+        ]
+        report = M.get_current_report(
+            report_fixtures.NOW,
+            expenses,
+            positive_actions,
+            report_fixtures.build_config(),
+        )
+        self.assertEqual(report["dues_total_lastmonth"], 4032.99)
+        self.assertEqual(report["balance_so_far"], 4977.44)
+        self.assertEqual(
+            report["balances_by_account_labels"],
+            {"Konto Jacka": 800.0, "Konto stowarzyszenia": 4022.69},
+        )
+        self.assertEqual(
+            {
+                key: sums["2021-08"]
+                for key, sums in report["monthly"].items()
+            },
+            {
+                "Wydatki": {"Internet": 0.3},
+                "Przychody": {"Suma": 4032.99},
+                "Bilans": {"Suma": 4032.69},
+                "Saldo": {"Suma": 4977.44},
+            },
+        )
+
+
+class ReportEnginesTestCase(unittest.TestCase):
+    def assert_engines_agree(self, positive_actions, expenses):
+        now = report_fixtures.NOW
+        database = ksiemgowy.models.KsiemgowyDB("sqlite://")
+        database.add_bank_actions(positive_actions, expenses)
+        config = report_fixtures.build_config()
+        expected_output = M.get_current_report(
+            now, expenses, positive_actions, config
+        )
+        self.assertEqual(len(expected_output["monthly"]["Przychody"]), 21)
+        for engine in AVAILABLE_REPORT_ENGINES:
+            with self.subTest(engine=engine):
+                self.assertEqual(
+                    expected_output,
+                    M.get_current_report_from_database(
+                        now,
+                        database,
+                        dataclasses.replace(config, engine=engine),
+                    ),
+                )
+        return expected_output
+
+    def test_engines_agree_on_long_history(self):
+        self.assert_engines_agree(*report_fixtures.build_history())
+
+    def test_engines_agree_on_arbitrary_amounts(self):
+        # sums of amounts like these aren't exact in floating point, so the
+        # order in which they're added up mustn't matter:
+        report = self.assert_engines_agree(
+            *report_fixtures.build_history(
+                accounts=[
+                    report_fixtures.HAKIERSPEJS_ACC_NO,
+                    report_fixtures.SAVINGS_ACC_NO,
+                ],
+                rng=random.Random(2021),
+            )
+        )
+        amounts = [report["balance_so_far"]]
+        amounts += report["balances_by_account_labels"].values()
+        for sums in report["monthly"].values():
+            for month_sums in sums.values():
+                amounts += month_sums.values()
+        for amount in amounts:
+            self.assertEqual(amount, round(amount, 2))
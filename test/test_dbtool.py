@@ -0,0 +1,58 @@
+import datetime
+import unittest
+
+import ksiemgowy.dbtool
+import ksiemgowy.models
+from test.report_fixtures import build_action
+
+
+class MonthlyAggregatesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.database = ksiemgowy.models.KsiemgowyDB("sqlite://")
+        for day in range(1, 28, 3):
+            self.database.add_bank_actions(
+                [
+                    build_action("member", "us", 100.0, f"2021-01-{day:02d}"),
+                    build_action("member", "us", 50.0, f"2021-02-{day:02d}"),
+                ],
+                [build_action("us", "landlord", 800.0, f"2021-02-{day:02d}")],
+            )
+
+    def test_aggregates_are_maintained(self):
+        self.assertEqual(
+            ksiemgowy.dbtool.diff_monthly_aggregates(self.database), []
+        )
+        self.assertEqual(
+            sorted(
+                (total.month, total.total_grosze)
+                for total in self.database.list_monthly_aggregates(True)
+            ),
+            [("2021-01", 90000), ("2021-02", 45000)],
+        )
+        (expenses,) = self.database.list_monthly_aggregates(False)
+        self.assertEqual(
+            expenses,
+            ksiemgowy.models.MonthlyTotal(
+                month="2021-02",
+                recipient_acc_no="landlord",
+                sender_acc_no="us",
+                amount_pln=800.0,
+                total_grosze=720000,
+                last_booked_at=datetime.datetime(2021, 2, 25),
+            ),
+        )
+
+    def test_rebuild(self):
+        with self.database.database.begin() as connection:
+            connection.execute(
+                self.database.monthly_aggregates.update().values(
+                    total_grosze=0
+                )
+            )
+        self.assertEqual(
+            len(ksiemgowy.dbtool.diff_monthly_aggregates(self.database)), 3
+        )
+        self.database.rebuild_monthly_aggregates()
+        self.assertEqual(
+            ksiemgowy.dbtool.diff_monthly_aggregates(self.database), []
+        )
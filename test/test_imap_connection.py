@@ -0,0 +1,49 @@
+import imaplib
+import unittest
+import unittest.mock as mock
+
+import ksiemgowy.imap_connection as M
+
+
+class IMAPConnectionManagerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.connect = mock.Mock()
+        self.sleep = mock.Mock()
+        self.manager = M.IMAPConnectionManager(
+            self.connect, max_attempts=3, sleep=self.sleep
+        )
+
+    def test_session_is_reused_while_alive(self):
+        first = self.manager.get()
+        second = self.manager.get()
+        self.assertIs(first, second)
+        self.assertEqual(self.connect.call_count, 1)
+        first.noop.assert_called_once_with()
+
+    def test_dead_session_is_replaced(self):
+        self.connect.side_effect = [mock.Mock(), mock.Mock()]
+        first = self.manager.get()
+        first.noop.side_effect = imaplib.IMAP4.abort("socket error: EOF")
+        second = self.manager.get()
+        self.assertIsNot(first, second)
+        self.assertEqual(self.connect.call_count, 2)
+
+    def test_connecting_is_retried_with_backoff(self):
+        session = mock.Mock()
+        self.connect.side_effect = [OSError(), OSError(), session]
+        self.assertIs(self.manager.get(), session)
+        self.assertEqual(
+            self.sleep.call_args_list, [mock.call(1.0), mock.call(2.0)]
+        )
+
+    def test_gives_up_after_max_attempts(self):
+        self.connect.side_effect = OSError()
+        with self.assertRaises(OSError):
+            self.manager.get()
+        self.assertEqual(self.connect.call_count, 3)
+
+    def test_close_all_logs_out(self):
+        session = self.manager.get()
+        M.close_all()
+        session.logout.assert_called_once_with()
+        self.assertIsNone(self.manager.mail)
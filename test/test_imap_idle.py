@@ -0,0 +1,84 @@
+import socket
+import unittest
+import unittest.mock as mock
+
+import ksiemgowy.imap_idle as M
+
+
+class IdleListenerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.mail = mock.Mock()
+        self.mail.capabilities = ("IMAP4REV1", "IDLE")
+        self.mail.untagged_responses = {}
+        self.mail.tagged_commands = {}
+        self.mail._new_tag.return_value = b"A001"
+        # the continuation request:
+        self.mail._get_response.return_value = None
+        self.mail_config = mock.Mock()
+        self.mail_config.imap_connect.return_value = self.mail
+        self.on_new_mail = mock.Mock()
+        self.listener = M.IdleListener(self.mail_config, self.on_new_mail)
+
+    def test_start_fails_without_idle_capability(self):
+        self.mail.capabilities = ("IMAP4REV1",)
+        self.assertFalse(self.listener.start())
+
+    def test_first_poll_catches_up_and_enters_idle(self):
+        self.assertTrue(self.listener.start())
+        self.listener.poll()
+        self.on_new_mail.assert_called_once_with(self.mail)
+        self.mail.send.assert_called_once_with(b"A001 IDLE\r\n")
+
+    def test_exists_triggers_callback(self):
+        self.listener.start()
+        self.listener.poll()
+        self.mail.untagged_responses["EXISTS"] = [b"2"]
+        with mock.patch.object(
+            self.listener, "has_pending_data", return_value=False
+        ) as pending_mock:
+            self.listener.poll()
+        # the announcement was parsed already, so the socket isn't read:
+        pending_mock.assert_not_called()
+        self.assertEqual(self.on_new_mail.call_count, 2)
+        self.mail.send.assert_any_call(b"DONE\r\n")
+
+    def test_quiet_poll_does_nothing(self):
+        self.listener.start()
+        self.listener.poll()
+        with mock.patch.object(
+            self.listener, "has_pending_data", return_value=False
+        ):
+            self.listener.poll()
+        self.assertEqual(self.on_new_mail.call_count, 1)
+
+    def test_callback_errors_do_not_stop_listening(self):
+        self.on_new_mail.side_effect = ValueError("unparseable e-mail")
+        self.listener.start()
+        with self.assertLogs(M.LOGGER, "ERROR"):
+            self.listener.poll()
+        self.assertIs(self.listener.mail, self.mail)
+        self.assertEqual(self.listener.tag, b"A001")
+
+    def test_connection_errors_in_callback_reconnect(self):
+        self.on_new_mail.side_effect = OSError("connection reset")
+        self.listener.start()
+        with self.assertLogs(M.LOGGER, "ERROR"):
+            self.listener.poll()
+        self.assertIsNone(self.listener.mail)
+
+    def test_buffered_responses_are_pending(self):
+        server, client = socket.socketpair()
+        self.addCleanup(server.close)
+        self.addCleanup(client.close)
+        self.mail.sock = client
+        self.mail.file = client.makefile("rb")
+        self.addCleanup(self.mail.file.close)
+        self.listener.start()
+        self.assertFalse(self.listener.has_pending_data())
+        server.sendall(b"+ idling\r\n* 2 EXISTS\r\n")
+        self.assertEqual(self.mail.file.readline(), b"+ idling\r\n")
+        # the rest was read off the socket together with the first line:
+        self.assertTrue(self.listener.has_pending_data())
+        self.assertEqual(self.mail.file.readline(), b"* 2 EXISTS\r\n")
+        self.assertFalse(self.listener.has_pending_data())
+        self.assertIsNone(client.gettimeout())
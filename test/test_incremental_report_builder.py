@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+import dataclasses
+import datetime
+import json
+import unittest
+
+import ksiemgowy.models
+import ksiemgowy.current_report_builder as current_report_builder
+import ksiemgowy.incremental_report_builder as M
+from test import report_fixtures
+
+NUM_DAYS = 84
+
+
+class IncrementalReportBuilderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.start = report_fixtures.NOW - datetime.timedelta(days=NUM_DAYS)
+        self.database = ksiemgowy.models.KsiemgowyDB("sqlite://")
+        self.config = report_fixtures.build_config(
+            monthly_income_corrections={"2021-07": {"Suma": 200.0}},
+            engine="incremental",
+        )
+        self.history = report_fixtures.build_history(num_days=NUM_DAYS)
+        self.positive_actions = []
+        self.expenses = []
+
+    def add_week(self, week):
+        """Adds bank actions booked during given week, both to the database
+        and to the lists get_current_report is called with."""
+        since = self.start + datetime.timedelta(weeks=week)
+        now = since + datetime.timedelta(weeks=1)
+        positive_actions, expenses = [
+            [
+                action
+                for action in actions
+                if since <= action.get_timestamp() < now
+            ]
+            for actions in self.history
+        ]
+        self.database.add_bank_actions(positive_actions, expenses)
+        self.positive_actions.extend(positive_actions)
+        self.expenses.extend(expenses)
+        return now
+
+    def assert_matches_full_report(self, builder, now):
+        self.assertEqual(
+            builder.build(now),
+            current_report_builder.get_current_report(
+                now, self.expenses, self.positive_actions, self.config
+            ),
+        )
+
+    def test_matches_full_report_as_actions_are_added(self):
+        builder = M.IncrementalReportBuilder(self.database, self.config)
+        for week in range(12):
+            now = self.add_week(week)
+            self.assert_matches_full_report(builder, now)
+            # building again with nothing new mustn't change anything:
+            self.assert_matches_full_report(builder, now)
+
+    def test_state_is_persisted(self):
+        now = self.add_week(0)
+        M.IncrementalReportBuilder(self.database, self.config).build(now)
+        state = M.ReportState.from_json(
+            self.database.get_report_state(M.STATE_NAME)
+        )
+        self.assertEqual(
+            state.watermark, len(self.positive_actions) + len(self.expenses)
+        )
+        self.assertEqual(M.ReportState.from_json(state.to_json()), state)
+        now = self.add_week(1)
+        self.assert_matches_full_report(
+            M.IncrementalReportBuilder(self.database, self.config), now
+        )
+
+    def test_config_change_rebuilds_state(self):
+        now = self.add_week(0)
+        M.IncrementalReportBuilder(self.database, self.config).build(now)
+        self.config = dataclasses.replace(
+            self.config, categories=[], corrections_by_label={}
+        )
+        self.assert_matches_full_report(
+            M.IncrementalReportBuilder(self.database, self.config), now
+        )
+
+    def test_state_of_an_older_version_is_discarded(self):
+        now = self.add_week(0)
+        self.database.set_report_state(
+            M.STATE_NAME,
+            json.dumps(
+                {
+                    "config_fingerprint": "outdated",
+                    "watermark": 1,
+                    "positive_amounts": {"Konto stowarzyszenia": [50.0]},
+                }
+            ),
+            now,
+        )
+        self.assert_matches_full_report(
+            M.IncrementalReportBuilder(self.database, self.config), now
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
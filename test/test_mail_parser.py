@@ -1,4 +1,7 @@
+import datetime
+import email
 import unittest
+import unittest.mock as mock
 
 import ksiemgowy.mbankmail
 
@@ -26,3 +29,184 @@ class MailParserTestCase(unittest.TestCase):
             ]
         }
         self.assertEqual(parsed, expected)
+
+    def test_mail_parser_many_rows(self):
+        with open("docs/przykladowy_zalacznik_mbanku.html", "rb") as f:
+            s = f.read().decode()
+        start = s.index("<tr>", s.index("Opis operacji"))
+        end = s.index("</tr>", start) + len("</tr>")
+        row = s[start:end]
+        rows = [
+            row.replace("01:50", f"0{i}:50").replace("200,00", f"20{i},00")
+            for i in range(3)
+        ]
+        s = s[:start] + "".join(rows) + s[end:]
+        parsed = ksiemgowy.mbankmail.parse_mbank_html(s.encode())
+        self.assertEqual(
+            [(a.timestamp, a.amount_pln) for a in parsed["actions"]],
+            [
+                ("2021-05-07 00:50", 200.0),
+                ("2021-05-07 01:50", 201.0),
+                ("2021-05-07 02:50", 202.0),
+            ],
+        )
+
+    def test_gen_mbank_actions_reads_file_objects(self):
+        with open("docs/przykladowy_zalacznik_mbanku.html", "rb") as f:
+            s = f.read()
+        with open("docs/przykladowy_zalacznik_mbanku.html", "rb") as f:
+            actions = ksiemgowy.mbankmail.gen_mbank_actions(f)
+            self.assertEqual(
+                list(actions),
+                ksiemgowy.mbankmail.parse_mbank_html(s)["actions"],
+            )
+
+
+class LazyMimeParsingTestCase(unittest.TestCase):
+    def setUp(self):
+        with open("docs/przykladowy_zalacznik_mbanku.eml", "rb") as f:
+            self.raw = f.read()
+
+    def test_lazy_parsing_finds_the_same_actions(self):
+        self.assertEqual(
+            ksiemgowy.mbankmail.parse_mbank_email(
+                ksiemgowy.mbankmail.lazy_message_from_bytes(self.raw)
+            ),
+            ksiemgowy.mbankmail.parse_mbank_email(
+                email.message_from_bytes(self.raw)
+            ),
+        )
+
+    def test_subparts_are_split_lazily(self):
+        msg = ksiemgowy.mbankmail.lazy_message_from_bytes(self.raw)
+        self.assertEqual(msg["Date"], "Sat, 08 May 2021 07:45:59 +0200")
+        parts = list(ksiemgowy.mbankmail.gen_mime_subparts(msg))
+        self.assertEqual(
+            [p.get_content_type() for p in parts],
+            ["multipart/mixed", "application/pkcs7-signature"],
+        )
+        self.assertIsInstance(parts[1].get_payload(), str)
+        self.assertTrue(parts[1].get_payload().startswith("MI"))
+
+    def test_part_without_headers(self):
+        msg = ksiemgowy.mbankmail.parse_headers_only(
+            "Content-Type: multipart/mixed; boundary=b\r\n\r\n"
+            "--b\r\n\r\nplain text\r\n--b--\r\n"
+        )
+        (part,) = ksiemgowy.mbankmail.gen_mime_subparts(msg)
+        self.assertEqual(part.get_payload(), "plain text")
+        self.assertEqual(part.get_content_type(), "text/plain")
+
+    def test_lines_starting_with_the_boundary_are_not_delimiters(self):
+        raw = (
+            "Content-Type: multipart/mixed; boundary=b\r\n\r\n"
+            "preamble\r\n"
+            "--b \t\r\n\r\n--bogus\r\n--b--x\r\n"
+            "--b\r\n\r\nsecond\r\n"
+            "--b--  \r\nepilogue\r\n"
+        )
+        parts = list(
+            ksiemgowy.mbankmail.gen_mime_subparts(
+                ksiemgowy.mbankmail.parse_headers_only(raw)
+            )
+        )
+        self.assertEqual(
+            [part.get_payload() for part in parts],
+            ["--bogus\r\n--b--x", "second"],
+        )
+        self.assertEqual(
+            [part.get_payload() for part in parts],
+            [
+                part.get_payload()
+                for part in email.message_from_string(raw).get_payload()
+            ],
+        )
+
+
+class TimestampTestCase(unittest.TestCase):
+    def test_timestamp_is_parsed_once(self):
+        action = ksiemgowy.mbankmail.MbankAction(
+            sender_acc_no="1",
+            recipient_acc_no="2",
+            amount_pln=1.0,
+            in_person="",
+            in_desc="",
+            balance=0.0,
+            timestamp="2021-05-07 01:50",
+            action_type="in_transfer",
+        )
+        with mock.patch("dateutil.parser.parse") as parse:
+            self.assertEqual(
+                action.get_timestamp(), datetime.datetime(2021, 5, 7, 1, 50)
+            )
+            parse.assert_not_called()
+        action.timestamp = "garbage"
+        self.assertEqual(action.booked_at, action.get_timestamp())
+
+    def test_non_iso_timestamp(self):
+        self.assertEqual(
+            ksiemgowy.mbankmail.parse_timestamp("May 7 2021 01:50"),
+            datetime.datetime(2021, 5, 7, 1, 50),
+        )
+
+
+class ActionClassifierTestCase(unittest.TestCase):
+    def classify(self, desc):
+        found = ksiemgowy.mbankmail.CLASSIFIER.find(desc)
+        if found is None:
+            return None
+        pattern, match = found
+        return pattern.build(match, "2021-05-07 01:50")
+
+    def test_transfers(self):
+        action = self.classify(
+            "mBank: Przelew wych. z rach. 81089394 na rach. 3511...075800 "
+            "kwota 800,00 PLN dla JAN KOWALSKI; CZYNSZ; Dost. 596,03 PLN"
+        )
+        self.assertEqual(action.action_type, "out_transfer")
+        self.assertEqual(action.recipient_acc_no, "3511...075800")
+        self.assertEqual(action.amount_pln, 800.0)
+        self.assertEqual(action.balance, 596.03)
+
+    def test_other_operations(self):
+        standing_order = self.classify(
+            "mBank: Zlecenie stale z rach. 81089394 na rach. 3511...075800 "
+            "kwota 100,00 PLN dla JAN KOWALSKI; SKLADKA; Dost. 496,03 PLN"
+        )
+        self.assertEqual(standing_order.action_type, "standing_order")
+        self.assertEqual(standing_order.sender_acc_no, "81089394")
+        card_payment = self.classify(
+            "mBank: Autoryz. karty ...1234 na kwote 12,34 PLN w SKLEP LODZ. "
+            "Dost. 483,69 PLN"
+        )
+        self.assertEqual(card_payment.action_type, "card_payment")
+        self.assertEqual(card_payment.in_person, "SKLEP LODZ")
+        self.assertEqual(card_payment.recipient_acc_no, "")
+        fee = self.classify(
+            "mBank: Oplata za karte z rach. 81089394 kwota 5,00 PLN; "
+            "Dost. 478,69 PLN"
+        )
+        self.assertEqual(fee.action_type, "fee")
+        self.assertEqual(fee.in_desc, "za karte")
+        self.assertEqual(fee.amount_pln, 5.0)
+
+    def test_unknown_operation(self):
+        self.assertIsNone(
+            self.classify("mBank: Blokada srodkow na kwote 12,34 PLN")
+        )
+        self.assertIsNone(self.classify("mBank: Przelew przych. bzdura"))
+
+    def test_custom_pattern(self):
+        classifier = ksiemgowy.mbankmail.ActionClassifier()
+        classifier.register(
+            ksiemgowy.mbankmail.ActionPattern(
+                "mBank: Przelew przych.",
+                ksiemgowy.mbankmail.INCOMING_RE,
+                "donation",
+            )
+        )
+        with open("docs/przykladowy_zalacznik_mbanku.html", "rb") as f:
+            actions = list(
+                ksiemgowy.mbankmail.gen_mbank_actions(f.read(), classifier)
+            )
+        self.assertEqual([a.action_type for a in actions], ["donation"])
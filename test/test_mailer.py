@@ -0,0 +1,39 @@
+import contextlib
+import unittest
+import unittest.mock as mock
+
+import ksiemgowy.config
+import ksiemgowy.mailer as M
+
+
+class SendMessagesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = mock.Mock()
+        self.sessions = 0
+        test = self
+
+        class FakeMailConfig(ksiemgowy.config.MailConfig):
+            @contextlib.contextmanager
+            def smtp_login(self):
+                test.sessions += 1
+                yield test.server
+
+        self.mail_config = FakeMailConfig(
+            login="",
+            password="",
+            server="",
+            imap_filter="",
+            smtp_batch_size=2,
+            smtp_batch_interval=1.5,
+        )
+
+    def test_messages_are_sent_in_batches_over_one_session(self):
+        sleep = mock.Mock()
+        M.send_messages(self.mail_config, ["a", "b", "c", "d", "e"], sleep)
+        self.assertEqual(self.server.send_message.call_count, 5)
+        self.assertEqual(self.sessions, 1)
+        self.assertEqual(sleep.call_args_list, [mock.call(1.5)] * 2)
+
+    def test_nothing_to_send_opens_no_session(self):
+        M.send_messages(self.mail_config, [])
+        self.assertEqual(self.sessions, 0)
@@ -12,6 +12,8 @@ import ksiemgowy.config
 import ksiemgowy.bookkeeping
 from ksiemgowy.mbankmail import MbankAction
 
+from test.fake_imap import FakeIMAP
+
 
 def run_immediately(_, fn, args, kwargs):
     fn(*args, **kwargs)
@@ -20,35 +22,35 @@ def run_immediately(_, fn, args, kwargs):
 class KsiemgowySystemTestCase(unittest.TestCase):
     def setUp(self):
         """Generates a mock that fakes imaplib interface, returning e-mails
-        from a given iterator. Not my proudest hack. Apologies!"""
+        from self.incoming_messages."""
 
         self.sent_messages: T.List[email.message.Message] = []
         self.incoming_messages: T.List[bytes] = []
 
-        def mail_fetch_mock(mail, _):
-            return None, [(None, mail)]
-
-        def return_messages(*args, **kwargs):
-            return self.incoming_messages
-
-        mail_connection_mock = mock.Mock()
-        messages_mock = mock.Mock()
-        messages_mock.split.side_effect = return_messages
-        mail_connection_mock.search.return_value = (None, [messages_mock])
-        mail_connection_mock.fetch.side_effect = mail_fetch_mock
-        mail_mock = mock.Mock()
-        mail_mock.imap_connect.return_value = mail_connection_mock
+        self.imap = FakeIMAP(lambda: self.incoming_messages)
+        test = self
 
         def send_message_mock(msg):
             self.sent_messages.append(msg)
 
-        @contextlib.contextmanager
-        def smtp_login_mock(*args, **kwargs):
-            server_mock = mock.Mock()
-            server_mock.send_message.side_effect = send_message_mock
-            yield server_mock
-
-        mail_mock.smtp_login = smtp_login_mock
+        class FakeMailConfig(ksiemgowy.config.MailConfig):
+            def imap_connect(self):
+                return test.imap
+
+            @contextlib.contextmanager
+            def smtp_login(self):
+                test.smtp_sessions += 1
+                server_mock = mock.Mock()
+                server_mock.send_message.side_effect = send_message_mock
+                yield server_mock
+
+        self.smtp_sessions = 0
+        mail_mock = FakeMailConfig(
+            login="ksiemgowy@example.com",
+            password="",
+            server="imap.example.com",
+            imap_filter="FROM kontakt@mbank.pl",
+        )
 
         self.config_mock = ksiemgowy.config.KsiemgowyConfig(
             database_uri="",
@@ -124,6 +126,21 @@ class KsiemgowySystemTestCase(unittest.TestCase):
             self.run_entrypoint()
             self.assertEqual(len(self.sent_messages), 1)
 
+    def test_confirmations_share_a_single_smtp_session(self):
+
+        with open(
+            "docs/przykladowy_zalacznik_mbanku.eml",
+            "rb",
+        ) as f:
+            eml = f.read()
+        self.incoming_messages = [
+            eml.replace(b"Date: ", f"Date: {i} ".encode(), 1)
+            for i in range(3)
+        ]
+        self.run_entrypoint()
+        self.assertEqual(len(self.sent_messages), 3)
+        self.assertEqual(self.smtp_sessions, 1)
+
     def test_running_entrypoint_twice_sends_a_single_message(self):
 
         with open(
@@ -135,6 +152,48 @@ class KsiemgowySystemTestCase(unittest.TestCase):
             self.run_entrypoint()
             self.assertEqual(len(self.sent_messages), 1)
 
+    def test_second_run_downloads_no_bodies(self):
+
+        with open(
+            "docs/przykladowy_zalacznik_mbanku.eml",
+            "rb",
+        ) as f:
+            self.incoming_messages = [f.read()]
+            self.run_entrypoint()
+            self.assertEqual(self.imap.body_fetches(), 1)
+            self.run_entrypoint()
+            self.assertEqual(self.imap.body_fetches(), 1)
+
+    def test_second_run_only_looks_at_new_uids(self):
+
+        with open(
+            "docs/przykladowy_zalacznik_mbanku.eml",
+            "rb",
+        ) as f:
+            self.incoming_messages = [f.read()]
+            self.run_entrypoint()
+            self.assertEqual(self.imap.header_fetches(), 1)
+            self.run_entrypoint()
+            self.assertEqual(self.imap.header_fetches(), 1)
+            self.assertIn(
+                ("UID", "SEARCH", "UID 2:* FROM kontakt@mbank.pl"),
+                self.imap.commands,
+            )
+
+    def test_uidvalidity_change_falls_back_to_deduplication(self):
+
+        with open(
+            "docs/przykladowy_zalacznik_mbanku.eml",
+            "rb",
+        ) as f:
+            self.incoming_messages = [f.read()]
+            self.run_entrypoint()
+            self.imap.uidvalidity += 1
+            self.run_entrypoint()
+            self.assertEqual(self.imap.header_fetches(), 2)
+            self.assertEqual(self.imap.body_fetches(), 1)
+            self.assertEqual(len(self.sent_messages), 1)
+
     def test_entrypoint_does_nothing_when_inbox_is_empty(self):
 
         self.run_entrypoint()
@@ -0,0 +1,288 @@
+import datetime
+import tempfile
+import unittest
+import unittest.mock as mock
+
+import sqlalchemy
+
+import ksiemgowy.models
+from ksiemgowy.mbankmail import MbankAction
+from ksiemgowy.models import OutgoingMail
+
+
+def build_action(amount_pln):
+    return MbankAction(
+        sender_acc_no="1",
+        recipient_acc_no="2",
+        amount_pln=amount_pln,
+        in_person="",
+        in_desc="",
+        balance=0.0,
+        timestamp="2021-01-01",
+        action_type="in_transfer",
+    )
+
+
+class AddBankActionsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.database = ksiemgowy.models.KsiemgowyDB("sqlite://")
+
+    def test_actions_are_stored_and_email_is_marked(self):
+        self.database.add_bank_actions(
+            [build_action(100.0), build_action(50.0)],
+            [build_action(30.0)],
+            [OutgoingMail("key", "ksiemgowy@example.com", "msg")],
+            handled_imap_ids=["mail_0"],
+        )
+        self.assertEqual(
+            sorted(a.amount_pln for a in self.database.list_positive_transfers()),
+            [50.0, 100.0],
+        )
+        self.assertEqual(
+            [a.amount_pln for a in self.database.list_expenses()], [30.0]
+        )
+        self.assertEqual(self.database.list_handled_imap_ids(), {"mail_0"})
+
+    def test_email_is_ingested_all_or_nothing(self):
+        with mock.patch.object(
+            self.database, "_enqueue_mail", side_effect=RuntimeError
+        ):
+            with self.assertRaises(RuntimeError):
+                self.database.add_bank_actions(
+                    [build_action(100.0)],
+                    [],
+                    [OutgoingMail("key", "ksiemgowy@example.com", "msg")],
+                    handled_imap_ids=["mail_0"],
+                )
+        self.assertEqual(list(self.database.list_positive_transfers()), [])
+        self.assertEqual(self.database.list_handled_imap_ids(), set())
+
+    def test_add_expense(self):
+        expense = build_action(30.0)
+        self.database.add_expense(expense)
+        self.assertEqual(
+            [a.amount_pln for a in self.database.list_expenses()], [30.0]
+        )
+        self.assertEqual(expense.amount_pln, 30.0)
+
+
+class LoadBankActionsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.database = ksiemgowy.models.KsiemgowyDB("sqlite://")
+        positive_actions = []
+        expenses = []
+        for recipient_acc_no, timestamp in [
+            ("ours", "2020-12-31 23:59"),
+            ("ours", "2021-01-01 00:00"),
+            ("savings", "2021-06-01 12:00"),
+        ]:
+            action = build_action(100.0)
+            action.recipient_acc_no = recipient_acc_no
+            action.timestamp = timestamp
+            positive_actions.append(action)
+        for sender_acc_no, timestamp in [
+            ("ours", "2019-05-05 10:00"),
+            ("savings", "2021-02-02 10:00"),
+        ]:
+            action = build_action(30.0)
+            action.sender_acc_no = sender_acc_no
+            action.timestamp = timestamp
+            expenses.append(action)
+        self.database.add_bank_actions(positive_actions, expenses)
+
+    def summarize(self, actions):
+        return [
+            (
+                action.recipient_acc_no,
+                action.sender_acc_no,
+                action.get_timestamp().strftime("%Y-%m-%d %H:%M"),
+            )
+            for action in actions
+        ]
+
+    def test_list_booked_years(self):
+        self.assertEqual(
+            self.database.list_booked_years(), [2019, 2020, 2021]
+        )
+
+    def test_list_own_accounts(self):
+        self.assertEqual(
+            self.database.list_own_accounts(), ["ours", "savings"]
+        )
+
+    def test_load_bank_actions_booked_in_a_year(self):
+        positive_transfers, expenses = self.database.load_bank_actions(
+            booked_since=datetime.datetime(2021, 1, 1),
+            booked_before=datetime.datetime(2022, 1, 1),
+        )
+        self.assertEqual(
+            self.summarize(positive_transfers),
+            [
+                ("ours", "1", "2021-01-01 00:00"),
+                ("savings", "1", "2021-06-01 12:00"),
+            ],
+        )
+        self.assertEqual(
+            self.summarize(expenses), [("2", "savings", "2021-02-02 10:00")]
+        )
+        self.assertEqual([a.amount_pln for a in expenses], [30.0])
+
+    def test_load_bank_actions_of_an_account(self):
+        positive_transfers, expenses = self.database.load_bank_actions(
+            acc_no="ours"
+        )
+        self.assertEqual(
+            self.summarize(positive_transfers),
+            [
+                ("ours", "1", "2020-12-31 23:59"),
+                ("ours", "1", "2021-01-01 00:00"),
+            ],
+        )
+        self.assertEqual(
+            self.summarize(expenses), [("2", "ours", "2019-05-05 10:00")]
+        )
+
+
+class MigrationTestCase(unittest.TestCase):
+    def test_new_database_is_up_to_date(self):
+        database = ksiemgowy.models.KsiemgowyDB("sqlite://")
+        with database.database.connect() as connection:
+            self.assertEqual(
+                database.get_schema_version(connection),
+                len(ksiemgowy.models.MIGRATIONS),
+            )
+
+    def test_old_database_is_migrated(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            uri = f"sqlite:///{tmpdir}/db.sqlite"
+            engine = sqlalchemy.create_engine(uri)
+            with engine.begin() as connection:
+                connection.execute(
+                    sqlalchemy.text(
+                        "CREATE TABLE bank_actions (id INTEGER PRIMARY KEY, "
+                        "sender_acc_no VARCHAR, recipient_acc_no VARCHAR, "
+                        "amount_pln FLOAT, in_person VARCHAR, in_desc VARCHAR, "
+                        "balance FLOAT, timestamp VARCHAR, action_type VARCHAR)"
+                    )
+                )
+                connection.execute(
+                    sqlalchemy.text(
+                        "INSERT INTO bank_actions VALUES (1, '1', '2', 100.0, "
+                        "'', '', 0.0, '2021-05-07 01:50', 'in_transfer')"
+                    )
+                )
+            engine.dispose()
+
+            database = ksiemgowy.models.KsiemgowyDB(uri)
+            (action,) = database.list_positive_transfers()
+            self.assertEqual(
+                action.booked_at, datetime.datetime(2021, 5, 7, 1, 50)
+            )
+            indexes = sqlalchemy.inspect(database.database).get_indexes(
+                "bank_actions"
+            )
+            self.assertEqual(
+                sorted(index["column_names"] for index in indexes),
+                [
+                    ["action_type", "booked_at"],
+                    ["amount_pln"],
+                    ["booked_at"],
+                    ["recipient_acc_no", "booked_at"],
+                    ["sender_acc_no", "booked_at"],
+                ],
+            )
+            with database.database.connect() as connection:
+                self.assertEqual(
+                    database.get_schema_version(connection),
+                    len(ksiemgowy.models.MIGRATIONS),
+                )
+            (total,) = database.list_monthly_aggregates(is_positive=True)
+            self.assertEqual(total.total_grosze, 10000)
+            database.connection.close()
+
+            # running migrations again is a no-op:
+            database = ksiemgowy.models.KsiemgowyDB(uri)
+            self.assertEqual(len(list(database.list_positive_transfers())), 1)
+            database.connection.close()
+
+    def test_monthly_aggregates_are_migrated_to_grosze(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            uri = f"sqlite:///{tmpdir}/db.sqlite"
+            database = ksiemgowy.models.KsiemgowyDB(uri)
+            database.add_bank_actions([build_action(0.1)] * 3, [])
+            database.connection.close()
+            # monthly_aggregates as it was in version 3 of the schema:
+            engine = sqlalchemy.create_engine(uri)
+            with engine.begin() as connection:
+                for statement in [
+                    "DROP TABLE monthly_aggregates",
+                    "CREATE TABLE monthly_aggregates (id INTEGER PRIMARY KEY, "
+                    "is_positive BOOLEAN, month VARCHAR, "
+                    "recipient_acc_no VARCHAR, sender_acc_no VARCHAR, "
+                    "amount_pln FLOAT, total_pln FLOAT, "
+                    "last_booked_at DATETIME)",
+                    "INSERT INTO monthly_aggregates VALUES (1, 1, '2021-01', "
+                    "'2', NULL, NULL, 0.30000000000000004, '2021-01-01')",
+                    "UPDATE schema_version SET version = 3",
+                ]:
+                    connection.execute(sqlalchemy.text(statement))
+            engine.dispose()
+
+            database = ksiemgowy.models.KsiemgowyDB(uri)
+            (total,) = database.list_monthly_aggregates(is_positive=True)
+            self.assertEqual(total.total_grosze, 30)
+            with database.database.connect() as connection:
+                self.assertEqual(
+                    database.get_schema_version(connection),
+                    len(ksiemgowy.models.MIGRATIONS),
+                )
+            database.connection.close()
+
+
+class LatestPaymentsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.database = ksiemgowy.models.KsiemgowyDB("sqlite://")
+        actions = []
+        for sender_acc_no, timestamps in [
+            ("overdue", ["2021-01-01", "2021-02-10"]),
+            ("paid", ["2021-02-10", "2021-03-20"]),
+            ("gone", ["2020-12-01"]),
+        ]:
+            for timestamp in timestamps:
+                action = build_action(100.0)
+                action.sender_acc_no = sender_acc_no
+                action.timestamp = timestamp
+                actions.append(action)
+        self.database.add_bank_actions(actions, [build_action(10.0)])
+
+    def test_list_latest_payments(self):
+        self.assertEqual(
+            self.database.list_latest_payments(
+                datetime.datetime(2021, 1, 15), datetime.datetime(2021, 3, 1)
+            ),
+            {"overdue": datetime.datetime(2021, 2, 10)},
+        )
+
+    def test_query_uses_index(self):
+        with self.database.database.begin() as connection:
+            connection.execute(sqlalchemy.text("ANALYZE"))
+        with mock.patch.object(
+            self.database.connection,
+            "execute",
+            wraps=self.database.connection.execute,
+        ) as execute:
+            self.database.list_latest_payments(
+                datetime.datetime(2021, 1, 15), datetime.datetime(2021, 3, 1)
+            )
+        query = execute.call_args[0][0].compile(
+            dialect=self.database.database.dialect,
+            compile_kwargs={"literal_binds": True},
+        )
+        with self.database.database.connect() as connection:
+            plan = connection.exec_driver_sql(
+                f"EXPLAIN QUERY PLAN {query}"
+            ).all()
+        # a range scan of an index, rather than a full scan of the table:
+        self.assertTrue(
+            plan[0][-1].startswith("SEARCH bank_actions USING INDEX"), plan
+        )
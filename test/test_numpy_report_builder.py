@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+import dataclasses
+import io
+import unittest
+
+import yaml
+
+import ksiemgowy.config
+import ksiemgowy.models
+import ksiemgowy.current_report_builder as current_report_builder
+import ksiemgowy.numpy_report_builder as M
+from test import report_fixtures
+
+
+@unittest.skipIf(not M.HAVE_NUMPY, "NumPy is not installed")
+class NumpyReportBuilderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.now = report_fixtures.NOW
+        self.positive_actions, self.expenses = report_fixtures.build_history(
+            self.now,
+            num_days=700,
+            accounts=[
+                report_fixtures.HAKIERSPEJS_ACC_NO,
+                report_fixtures.SAVINGS_ACC_NO,
+            ],
+        )
+        self.database = ksiemgowy.models.KsiemgowyDB("sqlite://")
+        self.database.add_bank_actions(self.positive_actions, self.expenses)
+        self.config = report_fixtures.build_config(engine="numpy")
+
+    def test_matches_python_engine(self):
+        self.assertEqual(
+            M.get_current_report_numpy(self.now, self.database, self.config),
+            current_report_builder.get_current_report(
+                self.now, self.expenses, self.positive_actions, self.config
+            ),
+        )
+
+    def test_empty_database(self):
+        # corrections can't be applied to accounts that weren't used:
+        config = dataclasses.replace(self.config, corrections_by_label={})
+        self.assertEqual(
+            M.get_current_report_numpy(
+                self.now, ksiemgowy.models.KsiemgowyDB("sqlite://"), config
+            ),
+            current_report_builder.get_current_report(
+                self.now, [], [], config
+            ),
+        )
+
+    def test_monthly_final_balance(self):
+        monthly_income = {"2021-01": {"Suma": 10}, "2021-03": {"Suma": 20}}
+        monthly_expenses = {
+            "2021-01": {"a": 30, "b": 70},
+            "2021-02": {"a": 1},
+        }
+        months = set(monthly_income) | set(monthly_expenses)
+        self.assertEqual(
+            M.build_monthly_final_balance(
+                months, monthly_income, monthly_expenses
+            ),
+            current_report_builder.build_monthly_final_balance(
+                months, monthly_income, monthly_expenses
+            ),
+        )
+
+    def test_format_month(self):
+        self.assertEqual(M.format_month(0), "1970-01")
+        self.assertEqual(M.format_month(12 * 51 + 11), "2021-12")
+
+
+@unittest.skipIf(M.HAVE_NUMPY, "NumPy is installed")
+class MissingNumpyTestCase(unittest.TestCase):
+    def test_engine_is_rejected(self):
+        with open("docs/example_config.yaml", encoding="utf8") as f:
+            config = yaml.safe_load(f)
+        config["REPORT_BUILDER"]["REPORT_ENGINE"] = "numpy"
+        with self.assertRaises(ValueError):
+            ksiemgowy.config.load_config(io.StringIO(yaml.dump(config)))
+
+
+if __name__ == "__main__":
+    unittest.main()
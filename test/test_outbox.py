@@ -0,0 +1,72 @@
+import contextlib
+import datetime
+import smtplib
+import unittest
+import unittest.mock as mock
+
+import ksiemgowy.config
+import ksiemgowy.models
+import ksiemgowy.outbox as M
+from ksiemgowy.models import OutgoingMail
+
+NOW = datetime.datetime(2021, 9, 4, 12, 0)
+
+
+class DrainOutboxTestCase(unittest.TestCase):
+    def setUp(self):
+        self.database = ksiemgowy.models.KsiemgowyDB("sqlite://")
+        self.server = mock.Mock()
+        test = self
+
+        class FakeMailConfig(ksiemgowy.config.MailConfig):
+            @contextlib.contextmanager
+            def smtp_login(self):
+                yield test.server
+
+        self.mail_config = FakeMailConfig(
+            login="from@example.com", password="", server="", imap_filter=""
+        )
+
+    def enqueue(self, key):
+        self.database.enqueue_mail(
+            OutgoingMail(
+                idempotency_key=key,
+                sender="from@example.com",
+                message="To: to@example.com\n\nhello\n",
+            ),
+            NOW,
+        )
+
+    def test_same_key_is_queued_once(self):
+        self.enqueue("a")
+        self.enqueue("a")
+        M.drain_outbox(self.database, self.mail_config, NOW)
+        self.assertEqual(self.server.send_message.call_count, 1)
+
+    def test_sent_mail_is_not_sent_again(self):
+        self.enqueue("a")
+        M.drain_outbox(self.database, self.mail_config, NOW)
+        M.drain_outbox(self.database, self.mail_config, NOW)
+        self.assertEqual(self.server.send_message.call_count, 1)
+
+    def test_failed_mail_is_retried_with_backoff(self):
+        self.enqueue("a")
+        self.server.send_message.side_effect = [
+            smtplib.SMTPServerDisconnected(),
+            None,
+        ]
+        M.drain_outbox(self.database, self.mail_config, NOW)
+        M.drain_outbox(self.database, self.mail_config, NOW)
+        self.assertEqual(self.server.send_message.call_count, 1)
+        M.drain_outbox(
+            self.database,
+            self.mail_config,
+            NOW + M.INITIAL_BACKOFF,
+        )
+        self.assertEqual(self.server.send_message.call_count, 2)
+        self.assertEqual(
+            self.database.list_pending_mail(
+                "from@example.com", NOW + datetime.timedelta(days=1), 8
+            ),
+            [],
+        )
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+import copy
+import dataclasses
+import functools
+import os
+import random
+import tempfile
+import unittest
+
+import ksiemgowy.current_report_builder as current_report_builder
+import ksiemgowy.models
+import ksiemgowy.partial_report as M
+from test import report_fixtures
+
+
+class HistoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.now = report_fixtures.NOW
+        self.positive_actions, self.expenses = report_fixtures.build_history(
+            self.now,
+            num_days=900,
+            accounts=[
+                report_fixtures.HAKIERSPEJS_ACC_NO,
+                report_fixtures.SAVINGS_ACC_NO,
+            ],
+            rng=random.Random(2023),
+        )
+        self.config = report_fixtures.build_config()
+        self.recent_positive_transfers = [
+            action
+            for action in self.positive_actions
+            if action.get_timestamp()
+            >= self.now - current_report_builder.MONTH
+        ]
+        self.expected_output = current_report_builder.get_current_report(
+            self.now, self.expenses, self.positive_actions, self.config
+        )
+
+
+class PartialReportTestCase(HistoryTestCase):
+    def reduce_by_year(self):
+        years = sorted(
+            {action.get_timestamp().year for action in self.positive_actions}
+        )
+        return [
+            M.reduce_bank_actions(
+                [
+                    action
+                    for action in self.positive_actions
+                    if action.get_timestamp().year == year
+                ],
+                [
+                    action
+                    for action in self.expenses
+                    if action.get_timestamp().year == year
+                ],
+                self.config.account_labels,
+                self.config.category_index,
+            )
+            for year in years
+        ]
+
+    def test_merge_order_does_not_matter(self):
+        partial_reports = self.reduce_by_year()
+        self.assertEqual(len(partial_reports), 3)
+        for ordering in [[0, 1, 2], [2, 0, 1], [1, 2, 0]]:
+            with self.subTest(ordering=ordering):
+                merged = functools.reduce(
+                    M.PartialReport.merge,
+                    [partial_reports[i] for i in ordering],
+                    M.PartialReport(),
+                )
+                self.assertEqual(
+                    merged.finish(
+                        self.now, self.config, self.recent_positive_transfers
+                    ),
+                    self.expected_output,
+                )
+        first, second, third = partial_reports
+        self.assertEqual(
+            first.merge(second).merge(third), first.merge(second.merge(third))
+        )
+
+    def test_merge_does_not_modify_reports(self):
+        first, second, _ = self.reduce_by_year()
+        before = copy.deepcopy(first)
+        first.merge(second).finish(
+            self.now, self.config, self.recent_positive_transfers
+        )
+        self.assertEqual(first, before)
+
+    def test_empty_report_is_identity(self):
+        partial_report = M.reduce_bank_actions(
+            self.positive_actions,
+            self.expenses,
+            self.config.account_labels,
+            self.config.category_index,
+        )
+        self.assertEqual(
+            M.PartialReport().merge(partial_report), partial_report
+        )
+        self.assertEqual(
+            partial_report.merge(M.PartialReport()), partial_report
+        )
+
+
+class BuildReportInParallelTestCase(HistoryTestCase):
+    def setUp(self):
+        super().setUp()
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.database = ksiemgowy.models.KsiemgowyDB(
+            "sqlite:///" + os.path.join(tmpdir.name, "db.sqlite")
+        )
+        self.addCleanup(self.database.connection.close)
+        self.database.add_bank_actions(self.positive_actions, self.expenses)
+
+    def test_slices_cover_all_actions(self):
+        for by, expected_keys in [
+            ("year", [2019, 2020, 2021]),
+            (
+                "account",
+                [
+                    report_fixtures.HAKIERSPEJS_ACC_NO,
+                    report_fixtures.SAVINGS_ACC_NO,
+                ],
+            ),
+        ]:
+            with self.subTest(by=by):
+                keys = M.list_slices(self.database, by)
+                self.assertEqual(keys, expected_keys)
+                slices = [M.load_slice(self.database, by, k) for k in keys]
+                self.assertEqual(
+                    sum(len(positive) for positive, _ in slices),
+                    len(self.positive_actions),
+                )
+                self.assertEqual(
+                    sum(len(expenses) for _, expenses in slices),
+                    len(self.expenses),
+                )
+
+    def test_unknown_slice_key(self):
+        with self.assertRaises(ValueError):
+            M.list_slices(self.database, "month")
+
+    def test_report_is_built_in_worker_processes(self):
+        self.assertFalse(M.is_in_memory(self.database))
+        for by in M.SLICE_KEYS:
+            with self.subTest(by=by):
+                self.assertEqual(
+                    M.build_report_in_parallel(
+                        self.now, self.database, self.config, by, 2
+                    ),
+                    self.expected_output,
+                )
+
+    def test_parallel_engine(self):
+        self.assertEqual(
+            current_report_builder.get_current_report_from_database(
+                self.now,
+                self.database,
+                dataclasses.replace(self.config, engine="parallel"),
+            ),
+            self.expected_output,
+        )
+
+    def test_in_memory_database(self):
+        database = ksiemgowy.models.KsiemgowyDB("sqlite://")
+        database.add_bank_actions(self.positive_actions, self.expenses)
+        self.assertTrue(M.is_in_memory(database))
+        self.assertEqual(
+            M.build_report_in_parallel(self.now, database, self.config),
+            self.expected_output,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
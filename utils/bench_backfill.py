@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+"""Benchmarks storing of bank actions during a backfill, comparing
+a transaction per row (add_positive_transfer/add_expense) with a single
+transaction per e-mail (add_bank_actions). An on-disk SQLite database is
+used, since that's where the cost of a commit shows."""
+
+import argparse
+import os
+import tempfile
+import time
+import typing as T
+
+import ksiemgowy.models
+from ksiemgowy.mbankmail import MbankAction
+
+
+def build_emails(
+    num_emails: int, actions_per_email: int
+) -> T.List[T.List[MbankAction]]:
+    return [
+        [
+            MbankAction(
+                sender_acc_no=f"sender{i}",
+                recipient_acc_no="recipient",
+                amount_pln=float(j + 1),
+                in_person="person",
+                in_desc="desc",
+                balance=1000.0,
+                timestamp="2021-01-01",
+                action_type="in_transfer" if j % 2 else "out_transfer",
+            )
+            for j in range(actions_per_email)
+        ]
+        for i in range(num_emails)
+    ]
+
+
+def store_per_row(
+    database: ksiemgowy.models.KsiemgowyDB,
+    actions: T.List[MbankAction],
+    mail_key: str,
+) -> None:
+    for action in actions:
+        if action.action_type == "in_transfer":
+            database.add_positive_transfer(action)
+        else:
+            database.add_expense(action)
+    database.mark_imap_ids_already_handled([mail_key])
+
+
+def store_per_email(
+    database: ksiemgowy.models.KsiemgowyDB,
+    actions: T.List[MbankAction],
+    mail_key: str,
+) -> None:
+    database.add_bank_actions(
+        [a for a in actions if a.action_type == "in_transfer"],
+        [a for a in actions if a.action_type == "out_transfer"],
+        handled_imap_ids=[mail_key],
+    )
+
+
+def run(
+    name: str,
+    store: T.Callable[
+        [ksiemgowy.models.KsiemgowyDB, T.List[MbankAction], str], None
+    ],
+    emails: T.List[T.List[MbankAction]],
+) -> None:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "bench.sqlite")
+        database = ksiemgowy.models.KsiemgowyDB(f"sqlite:///{path}")
+        start = time.time()
+        for i, actions in enumerate(emails):
+            store(database, actions, f"mail{i}_0")
+        elapsed = time.time() - start
+        database.connection.close()
+    num_rows = sum(len(actions) for actions in emails)
+    print(
+        f"{name:10s} rows={num_rows} time={elapsed:7.3f}s "
+        f"throughput={num_rows / elapsed:9.1f} rows/s"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--num-emails", type=int, default=100)
+    parser.add_argument("-a", "--actions-per-email", type=int, default=30)
+    args = parser.parse_args()
+    emails = build_emails(args.num_emails, args.actions_per_email)
+    run("per-row", store_per_row, emails)
+    run("per-email", store_per_email, emails)
+
+
+if __name__ == "__main__":
+    main()
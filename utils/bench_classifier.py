@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+"""Benchmarks classification of statement rows as more and more patterns are
+registered, comparing mbankmail.ActionClassifier's prefix dispatch with
+trying every regex in turn. Extra patterns get prefixes of their own, so
+the rows being classified never match them."""
+
+import argparse
+import re
+import time
+import typing as T
+
+import ksiemgowy.mbankmail
+from ksiemgowy.mbankmail import ActionClassifier, ActionPattern
+
+ROWS = [
+    "mBank: Przelew przych. z rach. 3511...075800 na rach. 81089394 kwota "
+    "200,00 PLN od JAN KOWALSKI UL; SKLADKA; Dost. 796,03 PLN",
+    "mBank: Przelew wych. z rach. 81089394 na rach. 3511...075800 kwota "
+    "800,00 PLN dla JAN KOWALSKI; CZYNSZ; Dost. 596,03 PLN",
+    "mBank: Autoryz. karty ...1234 na kwote 12,34 PLN w SKLEP LODZ. "
+    "Dost. 583,69 PLN",
+    "mBank: Blokada srodkow na kwote 12,34 PLN",
+]
+
+
+def build_patterns(num_extra: int) -> T.List[ActionPattern]:
+    patterns = list(
+        ksiemgowy.mbankmail.CLASSIFIER.patterns_by_prefix.values()
+    )
+    extra = [
+        ActionPattern(
+            f"mBank: Operacja {i}",
+            re.compile(
+                f"^mBank: Operacja {i}"
+                " kwota (?P<amount_pln>\\d+,\\d{2}) PLN;"
+                " Dost\\. (?P<balance>\\d+,\\d{2}) PLN$"
+            ),
+            f"operation_{i}",
+        )
+        for i in range(num_extra)
+    ]
+    return [p for group in patterns for p in group] + extra
+
+
+def classify_linearly(
+    patterns: T.List[ActionPattern], desc: str
+) -> T.Optional[str]:
+    for pattern in patterns:
+        if pattern.regex.match(desc) and desc.startswith(pattern.prefix):
+            return pattern.action_type
+    return None
+
+
+def classify_dispatched(
+    classifier: ActionClassifier, desc: str
+) -> T.Optional[str]:
+    found = classifier.find(desc)
+    return found[0].action_type if found else None
+
+
+def measure(fn: T.Callable[[str], T.Optional[str]], num_rows: int) -> float:
+    """Returns the best throughput out of three runs."""
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        for i in range(num_rows):
+            fn(ROWS[i % len(ROWS)])
+        best = min(best, time.perf_counter() - start)
+    return num_rows / best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-r", "--num-rows", type=int, default=20000)
+    parser.add_argument(
+        "-p", "--num-patterns", type=int, nargs="+", default=[0, 10, 100, 1000]
+    )
+    args = parser.parse_args()
+    for num_extra in args.num_patterns:
+        patterns = build_patterns(num_extra)
+        classifier = ActionClassifier(patterns)
+        dispatched = measure(
+            lambda desc: classify_dispatched(classifier, desc), args.num_rows
+        )
+        linear = measure(
+            lambda desc: classify_linearly(patterns, desc), args.num_rows
+        )
+        print(
+            f"patterns={len(patterns):5d} "
+            f"dispatched={dispatched:10.1f} rows/s "
+            f"linear={linear:10.1f} rows/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+"""Benchmarks downloading of new e-mails from a local fake IMAP server with
+different FETCH batch sizes. Batch size 1 is equivalent to the old behavior
+of fetching one message per command."""
+
+import argparse
+import imaplib
+import time
+
+import ksiemgowy.bookkeeping
+import ksiemgowy.models
+
+from fake_imap_server import FakeIMAPServer
+
+
+def build_messages(num_messages: int) -> list:
+    with open("docs/przykladowy_zalacznik_mbanku.eml", "rb") as f:
+        eml = f.read().replace(b"\r\n", b"\n").replace(b"\n", b"\r\n")
+    return [
+        eml.replace(b"\r\nDate: ", f"\r\nDate: {i} ".encode(), 1)
+        for i in range(num_messages)
+    ]
+
+
+def run(messages: list, batch_size: int, latency: float) -> None:
+    database = ksiemgowy.models.KsiemgowyDB("sqlite://")
+    with FakeIMAPServer(messages, latency=latency) as server:
+        mail = imaplib.IMAP4("127.0.0.1", server.port)
+        mail.login("user", "password")
+        round_trips_before = server.round_trips
+        start = time.time()
+        num_fetched = sum(
+            1
+            for _ in ksiemgowy.bookkeeping.gen_unseen_mbank_emails(
+                database, mail, "ALL", "bench", batch_size
+            )
+        )
+        elapsed = time.time() - start
+        round_trips = server.round_trips - round_trips_before
+        mail.logout()
+    print(
+        f"batch_size={batch_size:4d} messages={num_fetched} "
+        f"round_trips={round_trips:5d} time={elapsed:7.3f}s "
+        f"throughput={num_fetched / elapsed:8.1f} msg/s"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--num-messages", type=int, default=500)
+    parser.add_argument(
+        "-l",
+        "--latency",
+        type=float,
+        default=0.005,
+        help="delay added to each IMAP command, in seconds",
+    )
+    parser.add_argument(
+        "-b", "--batch-sizes", type=int, nargs="+", default=[1, 10, 50, 200]
+    )
+    args = parser.parse_args()
+    messages = build_messages(args.num_messages)
+    for batch_size in args.batch_sizes:
+        run(messages, batch_size, args.latency)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+"""Benchmarks finding and parsing of the mBank attachment in e-mails that
+also carry large binary attachments, comparing the old eager path (decode
+the whole message and build every MIME part) with the lazy one."""
+
+import argparse
+import base64
+import email
+import os
+import time
+import tracemalloc
+import typing as T
+
+import ksiemgowy.mbankmail
+
+
+def build_message(attachment_size: int) -> bytes:
+    with open("docs/przykladowy_zalacznik_mbanku.eml", "rb") as f:
+        eml = f.read()
+    boundary = b"--------------050909040207010904090704"
+    pdf = base64.encodebytes(os.urandom(attachment_size))
+    extra_part = (
+        boundary
+        + b"\r\nContent-Type: application/pdf; name=\"statement.pdf\""
+        + b"\r\nContent-Transfer-Encoding: base64\r\n\r\n"
+        + pdf.replace(b"\n", b"\r\n")
+        + b"\r\n"
+    )
+    closing = boundary + b"--"
+    return eml.replace(closing, extra_part + closing)
+
+
+def eager(raw: bytes) -> T.Any:
+    return ksiemgowy.mbankmail.parse_mbank_email(
+        email.message_from_string(raw.decode())
+    )
+
+
+def lazy(raw: bytes) -> T.Any:
+    return ksiemgowy.mbankmail.parse_mbank_email(
+        ksiemgowy.mbankmail.lazy_message_from_bytes(raw)
+    )
+
+
+def run(name: str, parse: T.Callable[[bytes], T.Any], raw: bytes, n: int) -> None:
+    start = time.perf_counter()
+    for _ in range(n):
+        parsed = parse(raw)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    parse(raw)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{name:6s} actions={len(parsed['actions'])} "
+        f"time/msg={elapsed / n * 1000:8.2f}ms "
+        f"peak_alloc={peak / 1024:9.1f}KiB"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-s", "--attachment-size", type=int, default=5 * 1024 * 1024
+    )
+    parser.add_argument("-n", "--num-repeats", type=int, default=10)
+    args = parser.parse_args()
+    raw = build_message(args.attachment_size)
+    run("eager", eager, raw, args.num_repeats)
+    run("lazy", lazy, raw, args.num_repeats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+"""Benchmarks mbankmail.gen_mbank_actions on large synthetic daily
+statements, reporting parsed rows per second, memory allocated by Python
+while parsing and the peak RSS of the process (which, unlike tracemalloc,
+accounts for the memory used by libxml2's tree)."""
+
+import argparse
+import resource
+import time
+import tracemalloc
+
+import ksiemgowy.mbankmail
+
+STATEMENT_TEMPLATE = """<html><body><table>
+<tr valign="top"><td>mBank S.A.</td></tr>
+<tr><td align="right">JAN KOWALSKI</td></tr>
+<tr valign="top" height="60"><td>
+<h5 align="center">2021-05-07 - Powiadomienie e-mail</h5></td></tr>
+<tr><td><h5 align="center">Operacje</h5></td></tr>
+<tr><td align="left">
+<table cellspacing="0" cellpadding="1" border="1" align="left"><tbody>
+<tr><td><center>Czas operacji<br>(GG:MM)</center></td>
+<td><center>Opis operacji</center></td></tr>
+{rows}
+</tbody></table></td></tr>
+<tr><td align="left">Numer referencyjny maila: L02321595.</td></tr>
+</table></body></html>"""
+
+ROW_TEMPLATES = [
+    "<tr><td align=\"center\">{hh:02d}:{mm:02d}</td><td>mBank: Przelew "
+    "przych. z rach. 3511...0758{i:02d} na rach. 81089394 kwota "
+    "{amount},00 PLN od JAN KOWALSKI UL; SKŁADKA {i}; Dost. 796,03 PLN"
+    "</td></tr>",
+    "<tr><td align=\"center\">{hh:02d}:{mm:02d}</td><td>mBank: Przelew "
+    "wych. z rach. 81089394 na rach. 3511...0758{i:02d} kwota "
+    "{amount},00 PLN dla JAN KOWALSKI UL; CZYNSZ {i}; Dost. 596,03 PLN"
+    "</td></tr>",
+    "<tr><td align=\"center\">{hh:02d}:{mm:02d}</td><td>mBank: Blokada "
+    "srodkow na kwote {amount},00 PLN</td></tr>",
+]
+
+
+def build_statement(num_rows: int) -> bytes:
+    rows = "\n".join(
+        ROW_TEMPLATES[i % len(ROW_TEMPLATES)].format(
+            i=i % 100, hh=(i // 60) % 24, mm=i % 60, amount=i % 500 + 1
+        )
+        for i in range(num_rows)
+    )
+    return STATEMENT_TEMPLATE.format(rows=rows).encode()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-r", "--num-rows", type=int, default=2000)
+    parser.add_argument("-n", "--num-repeats", type=int, default=20)
+    args = parser.parse_args()
+    statement = build_statement(args.num_rows)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    for _ in range(args.num_repeats):
+        num_actions = sum(
+            1 for _ in ksiemgowy.mbankmail.gen_mbank_actions(statement)
+        )
+    elapsed = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    tracemalloc.start()
+    for _ in ksiemgowy.mbankmail.gen_mbank_actions(statement):
+        pass
+    snapshot = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    num_blocks = sum(stat.count for stat in snapshot.statistics("filename"))
+
+    num_rows = args.num_rows * args.num_repeats
+    print(
+        f"rows={args.num_rows} actions={num_actions} "
+        f"time={elapsed:7.3f}s throughput={num_rows / elapsed:9.1f} rows/s "
+        f"peak_alloc={peak / 1024:8.1f}KiB live_blocks={num_blocks} "
+        f"rss_growth={rss_after - rss_before}KiB"
+    )
+
+
+if __name__ == "__main__":
+    main()
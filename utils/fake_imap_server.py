@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+"""A tiny, single-mailbox IMAP server used for benchmarking ksiemgowy's IMAP
+code. It understands just enough of the protocol for imaplib and adds
+a configurable delay to every command in order to emulate network latency.
+Each command counts as one round trip."""
+
+import re
+import socket
+import socketserver
+import threading
+import time
+import typing as T
+
+
+FETCH_ITEMS_RE = re.compile(r"^(\S+) \((.*)\)$")
+
+
+class FakeIMAPHandler(socketserver.StreamRequestHandler):
+    """Handles a single client connection."""
+
+    server: "FakeIMAPServer"
+
+    def send_line(self, line: T.Union[str, bytes]) -> None:
+        if isinstance(line, str):
+            line = line.encode()
+        self.wfile.write(line + b"\r\n")
+
+    def handle(self) -> None:
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.send_line("* OK fake IMAP server ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            tag, _, rest = line.decode().rstrip("\r\n").partition(" ")
+            command, _, args = rest.partition(" ")
+            command = command.upper()
+            with self.server.lock:
+                self.server.round_trips += 1
+            time.sleep(self.server.latency)
+            if command == "UID":
+                command, _, args = args.partition(" ")
+                command = command.upper()
+            handler = getattr(self, "do_" + command, None)
+            if handler is None:
+                self.send_line(f"{tag} BAD unknown command")
+                continue
+            if handler(tag, args) is False:
+                return
+
+    def do_CAPABILITY(self, tag: str, _: str) -> None:
+        self.send_line("* CAPABILITY IMAP4rev1 " + self.server.capabilities)
+        self.send_line(f"{tag} OK CAPABILITY completed")
+
+    def do_LOGIN(self, tag: str, _: str) -> None:
+        self.send_line(f"{tag} OK LOGIN completed")
+
+    def do_NOOP(self, tag: str, _: str) -> None:
+        self.send_line(f"{tag} OK NOOP completed")
+
+    def do_LOGOUT(self, tag: str, _: str) -> bool:
+        self.send_line("* BYE logging out")
+        self.send_line(f"{tag} OK LOGOUT completed")
+        return False
+
+    def do_IDLE(self, tag: str, _: str) -> None:
+        with self.server.lock:
+            self.send_line("+ idling")
+            self.server.idlers.add(self)
+        line = self.rfile.readline()
+        with self.server.lock:
+            self.server.idlers.discard(self)
+        if line.strip().upper() == b"DONE":
+            self.send_line(f"{tag} OK IDLE terminated")
+        else:
+            self.send_line(f"{tag} BAD expected DONE")
+
+    def do_SELECT(self, tag: str, _: str) -> None:
+        self.send_line(f"* {len(self.server.messages)} EXISTS")
+        self.send_line(f"* OK [UIDVALIDITY {self.server.uidvalidity}] ok")
+        self.send_line(f"{tag} OK [READ-WRITE] SELECT completed")
+
+    def parse_uid_set(self, uid_set: str) -> T.List[int]:
+        highest = len(self.server.messages)
+        ret = []
+        for part in uid_set.split(","):
+            start, _, end = part.partition(":")
+            first = highest if start == "*" else int(start)
+            last = first if not end else highest if end == "*" else int(end)
+            first, last = min(first, last), max(first, last)
+            ret.extend(range(max(first, 1), min(last, highest) + 1))
+        return ret
+
+    def do_SEARCH(self, tag: str, args: str) -> None:
+        criteria = args.split()
+        uids = list(range(1, len(self.server.messages) + 1))
+        if "UID" in criteria:
+            uids = self.parse_uid_set(criteria[criteria.index("UID") + 1])
+        self.send_line("* SEARCH " + " ".join(map(str, uids)))
+        self.send_line(f"{tag} OK SEARCH completed")
+
+    def do_FETCH(self, tag: str, args: str) -> None:
+        match = FETCH_ITEMS_RE.match(args)
+        if match is None:
+            self.send_line(f"{tag} BAD malformed FETCH")
+            return
+        uid_set, items = match.groups()
+        for uid in self.parse_uid_set(uid_set):
+            raw = self.server.messages[uid - 1]
+            if "HEADER.FIELDS" in items:
+                header_block = raw.split(b"\r\n\r\n", 1)[0] + b"\r\n"
+                payload = (
+                    b"\r\n".join(
+                        line
+                        for line in header_block.split(b"\r\n")
+                        if line.lower().startswith((b"date:", b"message-id:"))
+                    )
+                    + b"\r\n\r\n"
+                )
+                item = "BODY[HEADER.FIELDS (DATE MESSAGE-ID)]"
+            else:
+                payload = raw
+                item = "RFC822"
+            self.wfile.write(
+                f"* {uid} FETCH (UID {uid} {item} {{{len(payload)}}}\r\n"
+                .encode()
+                + payload
+                + b")\r\n"
+            )
+        self.send_line(f"{tag} OK FETCH completed")
+
+
+class FakeIMAPServer(socketserver.ThreadingTCPServer):
+    """Serves a list of raw RFC822 messages, whose UIDs are their positions
+    in the list (counting from 1). Use as a context manager - the server is
+    run in a background thread."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(
+        self,
+        messages: T.List[bytes],
+        latency: float = 0.0,
+        capabilities: str = "IDLE",
+    ) -> None:
+        super().__init__(("127.0.0.1", 0), FakeIMAPHandler)
+        self.messages = messages
+        self.latency = latency
+        self.capabilities = capabilities
+        self.uidvalidity = 1
+        self.round_trips = 0
+        self.idlers: T.Set[FakeIMAPHandler] = set()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def deliver(self, message: bytes) -> None:
+        """Adds a message to the mailbox and notifies idling clients."""
+        with self.lock:
+            self.messages.append(message)
+            for handler in self.idlers:
+                handler.send_line(f"* {len(self.messages)} EXISTS")
+
+    @property
+    def port(self) -> int:
+        return int(self.server_address[1])
+
+    def __enter__(self) -> "FakeIMAPServer":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *_: T.Any) -> None:
+        self.shutdown()
+        self.server_close()